@@ -1,12 +1,15 @@
 from abc import ABC, abstractmethod
 from contextlib import asynccontextmanager
-from typing import List, Optional
+from typing import List, Optional, Union
 
 from pydantic import BaseModel, Field, model_validator
 
 from app.llm import LLM
 from app.logger import logger
-from app.schema import ROLE_TYPE, AgentState, Memory, Message
+from app.schema import ROLE_TYPE, AgentState, Memory, Message, MessageRecord
+
+STUCK_PROMPT = "\
+        Observed duplicate responses. Consider new strategies and avoid repeating ineffective paths already attempted."
 
 
 class BaseAgent(BaseModel, ABC):
@@ -161,8 +164,7 @@ class BaseAgent(BaseModel, ABC):
 
     def handle_stuck_state(self):
         """Handle stuck state by adding a prompt to change strategy"""
-        stuck_prompt = "\
-        Observed duplicate responses. Consider new strategies and avoid repeating ineffective paths already attempted."
+        stuck_prompt = STUCK_PROMPT
         self.next_step_prompt = f"{stuck_prompt}\n{self.next_step_prompt}"
         logger.warning(f"Agent detected stuck state. Added prompt: {stuck_prompt}")
 
@@ -185,11 +187,11 @@ class BaseAgent(BaseModel, ABC):
         return duplicate_count >= self.duplicate_threshold
 
     @property
-    def messages(self) -> List[Message]:
+    def messages(self) -> List[MessageRecord]:
         """Retrieve a list of messages from the agent's memory."""
         return self.memory.messages
 
     @messages.setter
-    def messages(self, value: List[Message]):
+    def messages(self, value: List[Union[Message, MessageRecord]]):
         """Set the list of messages in the agent's memory."""
-        self.memory.messages = value
+        self.memory.messages = [MessageRecord.from_message(m) for m in value]
@@ -1,8 +1,10 @@
+import asyncio
 from typing import Any, Dict, List, Optional, Tuple
 
 from pydantic import Field
 from mcp.server.fastmcp import FastMCP
 from app.agent.toolcall import ToolCallAgent
+from app.config import config
 from app.logger import logger
 from app.prompt.mcp import  NEXT_STEP_PROMPT, SYSTEM_PROMPT
 from app.schema import AgentState, Message, ToolCall
@@ -15,8 +17,9 @@ import json
 class MCPAgent(ToolCallAgent):
     """Agent for interacting with MCP (Model Context Protocol) servers.
 
-    This agent connects to an MCP server using either SSE or stdio transport
-    and makes the server's tools available through the agent's tool interface.
+    This agent connects to an MCP server using either SSE or stdio transport,
+    plus any servers listed under `[mcp.servers]` in the config, and makes the
+    servers' tools available through the agent's tool interface.
     """
 
     name: str = "mcp_agent"
@@ -30,11 +33,12 @@ class MCPAgent(ToolCallAgent):
     available_mcp_tools: MCPClients = None  # Will be set in initialize()
 
     max_steps: int = 20
-    connection_type: str = "stdio"  # "stdio" or "sse"
+    connection_type: str = "stdio"  # "stdio", "sse" or "memory"
 
-    # Track tool schemas to detect changes
-    tool_schemas: Dict[str, Dict[str, Any]] = Field(default_factory=dict)
-    _refresh_tools_interval: int = 5  # Refresh tools every N steps
+    # Track tool schema hashes to detect changes
+    tool_schemas: Dict[str, str] = Field(default_factory=dict)
+    # Poll every N steps, only for servers without tools/list_changed notifications
+    _refresh_tools_interval: int = 5
 
 
     async def initialize(
@@ -43,14 +47,16 @@ class MCPAgent(ToolCallAgent):
         server_url: Optional[str] = None,
         command: Optional[str] = None,
         args: Optional[List[str]] = None,
+        server: Optional[FastMCP] = None,
     ) -> None:
         """Initialize the MCP connection.
 
         Args:
-            connection_type: Type of connection to use ("stdio" or "sse")
+            connection_type: Type of connection to use ("stdio", "sse" or "memory")
             server_url: URL of the MCP server (for SSE connection)
             command: Command to run (for stdio connection)
             args: Arguments for the command (for stdio connection)
+            server: In-process FastMCP server (for memory connection)
         """
         if connection_type:
             self.connection_type = connection_type
@@ -59,19 +65,27 @@ class MCPAgent(ToolCallAgent):
         if self.connection_type == "sse":
             if not server_url:
                 raise ValueError("Server URL is required for SSE connection")
-            await self.mcp_clients.connect_sse(server_url=server_url)
+            primary = self.mcp_clients.connect_sse(server_url=server_url)
         elif self.connection_type == "stdio":
             if not command:
                 raise ValueError("Command is required for stdio connection")
-            await self.mcp_clients.connect_stdio(command=command, args=args or [])
+            primary = self.mcp_clients.connect_stdio(command=command, args=args or [])
+        elif self.connection_type == "memory":
+            if server is None:
+                raise ValueError("Server instance is required for memory connection")
+            primary = self.mcp_clients.connect_memory(server)
         else:
             raise ValueError(f"Unsupported connection type: {self.connection_type}")
 
+        # Connect the configured servers alongside; their failures are isolated
+        servers = config.mcp_config.servers if config.mcp_config else {}
+        await asyncio.gather(primary, self.mcp_clients.connect_all(servers))
+
         # Set available_mcp_tools to our MCP instance
         self.available_mcp_tools = self.mcp_clients
 
         # Store initial tool schemas
-        await self._refresh_tools()
+        self.tool_schemas = dict(self.mcp_clients.tool_hashes)
 
         # Add system message about available tools
         tool_names = list(self.mcp_clients.tool_map.keys())
@@ -90,28 +104,33 @@ class MCPAgent(ToolCallAgent):
         Returns:
             A tuple of (added_tools, removed_tools)
         """
-        if not self.mcp_clients.session:
-            return [], []
+        # Re-list tools from the servers; with notifications only the servers
+        # that announced a change are listed
+        await self.mcp_clients.refresh_tools(
+            changed_only=self.mcp_clients.supports_tool_notifications
+        )
+        return self._update_tool_schemas()
 
-        # Get current tool schemas directly from the server
-        response = await self.mcp_clients.session.list_tools()
-        current_tools = {tool.name: tool.inputSchema for tool in response.tools}
+    def _update_tool_schemas(self) -> Tuple[List[str], List[str]]:
+        """Compare (name, schema hash) pairs with the tools this agent last saw.
 
-        # Determine added, removed, and changed tools
-        current_names = set(current_tools.keys())
-        previous_names = set(self.tool_schemas.keys())
+        Returns:
+            A tuple of (added_tools, removed_tools)
+        """
+        current_tools = self.mcp_clients.tool_hashes
+        current_names = current_tools.keys()
+        previous_names = self.tool_schemas.keys()
 
         added_tools = list(current_names - previous_names)
         removed_tools = list(previous_names - current_names)
-
-        # Check for schema changes in existing tools
-        changed_tools = []
-        for name in current_names.intersection(previous_names):
-            if current_tools[name] != self.tool_schemas.get(name):
-                changed_tools.append(name)
+        changed_tools = [
+            name
+            for name, _ in current_tools.items() - self.tool_schemas.items()
+            if name in previous_names
+        ]
 
         # Update stored schemas
-        self.tool_schemas = current_tools
+        self.tool_schemas = dict(current_tools)
 
         # Log and notify about changes
         if added_tools:
@@ -133,21 +152,28 @@ class MCPAgent(ToolCallAgent):
 
     async def think(self) -> bool:
         """Process current state and decide next action."""
+        # Refresh tools when the server announced a change, or poll as a fallback.
+        # Also when no server is up: refreshing reconnects those whose retry is due
+        if (
+            not self.mcp_clients.connected
+            or self.mcp_clients.tools_changed
+            or (
+                not self.mcp_clients.supports_tool_notifications
+                and self.current_step % self._refresh_tools_interval == 0
+            )
+        ):
+            await self._refresh_tools()
+        elif self.tool_schemas != self.mcp_clients.tool_hashes:
+            # The clients are shared between sessions, another one may have
+            # refreshed them and cleared `tools_changed`
+            self._update_tool_schemas()
+
         # Check MCP session and tools availability
-        if not self.mcp_clients.session or not self.mcp_clients.tool_map:
+        if not self.mcp_clients.connected or not self.mcp_clients.tool_map:
             logger.info("MCP service is no longer available, ending interaction")
             self.state = AgentState.FINISHED
             return False
 
-        # Refresh tools periodically
-        if self.current_step % self._refresh_tools_interval == 0:
-            await self._refresh_tools()
-            # All tools removed indicates shutdown
-            if not self.mcp_clients.tool_map:
-                logger.info("MCP service has shut down, ending interaction")
-                self.state = AgentState.FINISHED
-                return False
-
         # Use the parent class's think method
         return await super().think()
 
@@ -177,10 +203,11 @@ class MCPAgent(ToolCallAgent):
                 result = await self.available_tools.execute(name=name, tool_input=args)
                 # Handle special tools
                 await self._handle_special_tool(name=name, result=result)
-            elif name.split(self.available_mcp_tools.name+"_")[-1] in self.available_mcp_tools.tool_map:
-                tool_name = name.split(self.available_mcp_tools.name+"_")[-1]
-                logger.info(f"🔧 Activating mcp tool: '{tool_name}' in {self.available_mcp_tools.name}...")
-                result = await self.available_mcp_tools.execute(name=tool_name, tool_input=args)
+            elif name in self.available_mcp_tools.tool_map:
+                # Tools are keyed by "<server id>_<tool name>", routing is a lookup
+                tool = self.available_mcp_tools.tool_map[name]
+                logger.info(f"🔧 Activating mcp tool: '{tool.name}' in {tool.mcp_name}...")
+                result = await self.available_mcp_tools.execute(name=name, tool_input=args)
             else:
                 return f"Error: Unknown tool '{name}'"
             
@@ -1,15 +1,22 @@
 import asyncio
 import json
-from typing import Any, List, Optional, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 from pydantic import Field
 
+from app.agent.base import STUCK_PROMPT
 from app.agent.react import ReActAgent
 from app.exceptions import TokenLimitExceeded
 from app.logger import logger
 from app.prompt.toolcall import NEXT_STEP_PROMPT, SYSTEM_PROMPT
 from app.schema import TOOL_CHOICE_TYPE, AgentState, Message, ToolCall, ToolChoice
-from app.tool import CreateChatCompletion, Terminate, ToolCollection, WebSearch
+from app.tool import (
+    CreateChatCompletion,
+    SlicerDocSearch,
+    Terminate,
+    ToolCollection,
+    WebSearch,
+)
 
 TOOL_CALL_REQUIRED = "Tool calls required but none provided"
 
@@ -24,13 +31,17 @@ class ToolCallAgent(ReActAgent):
     next_step_prompt: str = NEXT_STEP_PROMPT
 
     available_tools: ToolCollection = ToolCollection(
-        CreateChatCompletion(), Terminate(), WebSearch()
+        CreateChatCompletion(), Terminate(), WebSearch(), SlicerDocSearch()
     )
     tool_choices: TOOL_CHOICE_TYPE = ToolChoice.AUTO  # type: ignore
     special_tool_names: List[str] = Field(default_factory=lambda: [Terminate().name])
 
     tool_calls: List[ToolCall] = Field(default_factory=list)
     _current_base64_image: Optional[str] = None
+    _tools_cache: Optional[Tuple[tuple, Tuple[Dict[str, Any], ...]]] = None
+    # Keep the request prefix byte-identical across steps for prompt caching
+    stable_prefix: bool = False
+    _stuck_prompt: Optional[str] = None
 
     max_steps: int = 30
     max_observe: Optional[Union[int, bool]] = None
@@ -40,10 +51,32 @@ class ToolCallAgent(ReActAgent):
     async def think(self) -> bool:
         """Process current state and decide next actions using tools"""
 
-        if self.current_step > 1:
+        messages = self.messages
+        if self.stable_prefix:
+            # Same system prompt and tools first on every step, per-step prompts
+            # only as an unsaved last message, so the provider can reuse the
+            # cached prefix of the previous request
+            system_message = (
+                [Message.system_message(self.system_prompt)]
+                if self.system_prompt
+                else None
+            )
+            tail = [
+                prompt
+                for prompt in (
+                    self._stuck_prompt,
+                    self.next_step_prompt if self.current_step > 1 else None,
+                )
+                if prompt
+            ]
+            self._stuck_prompt = None
+            if tail:
+                messages = messages + [Message.user_message("\n".join(tail))]
+        elif self.current_step > 1:
             if self.next_step_prompt:
                 user_message = Message.user_message(self.next_step_prompt)
-                self.messages += [user_message]
+                self.memory.add_message(user_message)
+                messages = self.messages
             system_message = None
         else:
             system_message = (
@@ -53,24 +86,10 @@ class ToolCallAgent(ReActAgent):
             )
 
         try:
-            native_tools = (
-                self.available_tools.to_params()
-                if self.current_step > 1
-                else self.available_tools.to_params_exclude()
-            )
-            mcp_tools = (
-                self.available_mcp_tools.to_params()
-                if "available_mcp_tools" in self.model_fields
-                else None
-            )
-            if mcp_tools:
-                tools = native_tools + mcp_tools
-            else:
-                tools = native_tools
             response: Message = await self.llm.ask(
-                messages=self.messages,
+                messages=messages,
                 system_msgs=system_message,
-                tools=tools,
+                tools=self._tool_params(),
                 tool_choice=self.tool_choices,
                 stream=self.streaming_output,
             )
@@ -93,6 +112,13 @@ class ToolCallAgent(ReActAgent):
                 return False
             raise
 
+        if response and response.usage and not response.usage.estimated:
+            usage = response.usage
+            logger.info(
+                f"📦 Prompt cache: {usage.cached_tokens}/{usage.prompt_tokens} tokens "
+                f"cached this step, {self.llm.cache_hit_rate:.0%} overall"
+            )
+
         self.tool_calls = tool_calls = (
             response.tool_calls if response and response.tool_calls else []
         )
@@ -149,6 +175,42 @@ class ToolCallAgent(ReActAgent):
             )
             return False
 
+    def _tool_params(self) -> Tuple[Dict[str, Any], ...]:
+        """Return the tools payload, rebuilt only when a tool collection changes."""
+        mcp_tools = (
+            self.available_mcp_tools
+            if "available_mcp_tools" in self.model_fields
+            else None
+        )
+        # Step 1 leaves out terminate, unless the prefix must stay stable
+        all_tools = self.stable_prefix or self.current_step > 1
+        key = (
+            all_tools,
+            id(self.available_tools),
+            self.available_tools.version,
+            id(mcp_tools),
+            mcp_tools.version if mcp_tools is not None else None,
+        )
+        if self._tools_cache is None or self._tools_cache[0] != key:
+            native_tools = (
+                self.available_tools.to_params()
+                if all_tools
+                else self.available_tools.to_params_exclude()
+            )
+            tools = native_tools + mcp_tools.to_params() if mcp_tools else native_tools
+            if self.stable_prefix:
+                # Independent of the order tools were registered or listed in
+                tools = tuple(sorted(tools, key=lambda tool: tool["function"]["name"]))
+            self._tools_cache = (key, tools)
+        return self._tools_cache[1]
+
+    def handle_stuck_state(self):
+        """Handle stuck state, in the next request's tail if the prefix is stable"""
+        if not self.stable_prefix:
+            return super().handle_stuck_state()
+        self._stuck_prompt = STUCK_PROMPT
+        logger.warning(f"Agent detected stuck state. Added prompt: {STUCK_PROMPT}")
+
     async def act(self) -> str:
         """Execute tool calls and handle their results"""
         if not self.tool_calls:
@@ -15,6 +15,17 @@ PROJECT_ROOT = get_project_root()
 WORKSPACE_ROOT = PROJECT_ROOT / "workspace"
 
 
+class LLMEndpointSettings(BaseModel):
+    base_url: str = Field(..., description="API base URL")
+    api_key: str = Field(..., description="API key")
+    model: Optional[str] = Field(
+        None, description="Model name at this endpoint, defaults to the llm model"
+    )
+    weight: float = Field(
+        1.0, description="Relative share of requests routed to this endpoint"
+    )
+
+
 class LLMSettings(BaseModel):
     model: str = Field(..., description="Model name")
     base_url: str = Field(..., description="API base URL")
@@ -27,6 +38,36 @@ class LLMSettings(BaseModel):
     temperature: float = Field(1.0, description="Sampling temperature")
     api_type: str = Field(..., description="Azure, Openai, or Ollama")
     api_version: str = Field(..., description="Azure Openai version if AzureOpenai")
+    endpoints: List[LLMEndpointSettings] = Field(
+        default_factory=list,
+        description="Endpoints to balance requests over, base_url/api_key if empty",
+    )
+    requests_per_minute: Optional[int] = Field(
+        None,
+        description="Client-side request rate limit per API key (None for the provider's)",
+    )
+    tokens_per_minute: Optional[int] = Field(
+        None,
+        description="Client-side token rate limit per API key (None for the provider's)",
+    )
+    hedge_percentile: Optional[float] = Field(
+        None,
+        description="Hedge streams without a first token after this TTFT percentile (None disables)",
+    )
+    hedge_min_delay: float = Field(
+        1.0, description="Minimum seconds to wait for a first token before hedging"
+    )
+    hedge_budget: float = Field(
+        0.1, description="Maximum fraction of streaming requests that are hedged"
+    )
+    max_prompt_images: Optional[int] = Field(
+        None,
+        description="Number of most recent images sent at full size (None for all)",
+    )
+    older_image_size: Optional[int] = Field(
+        None,
+        description="Downscale older images to this size in pixels instead of dropping them",
+    )
 
 
 class ProxySettings(BaseModel):
@@ -57,6 +98,18 @@ class SearchSettings(BaseModel):
         default="us",
         description="Country code for search results (e.g., us, cn, uk)",
     )
+    max_passages: int = Field(
+        default=3,
+        description="Maximum number of ranked passages kept per fetched page",
+    )
+    passage_token_budget: int = Field(
+        default=256,
+        description="Token budget for the passages kept per fetched page",
+    )
+    local_index_path: Optional[str] = Field(
+        default=None,
+        description="Directory of the local Slicer documentation index (defaults to workspace/slicer_index)",
+    )
 
 
 class BrowserSettings(BaseModel):
@@ -98,12 +151,27 @@ class SandboxSettings(BaseModel):
     )
 
 
+class MCPServerSettings(BaseModel):
+    """Connection settings of a single MCP server"""
+
+    type: str = Field("sse", description="Transport type: sse or stdio")
+    url: Optional[str] = Field(None, description="Server URL for SSE transport")
+    command: Optional[str] = Field(None, description="Command for stdio transport")
+    args: List[str] = Field(
+        default_factory=list, description="Arguments for stdio transport"
+    )
+
+
 class MCPSettings(BaseModel):
     """Configuration for MCP (Model Context Protocol)"""
 
     server_reference: str = Field(
         "app.mcp.server", description="Module reference for the MCP server"
     )
+    servers: Dict[str, MCPServerSettings] = Field(
+        default_factory=dict,
+        description="Additional MCP servers to connect to, keyed by server id",
+    )
 
 
 class AppConfig(BaseModel):
@@ -177,6 +245,14 @@ class Config:
             "temperature": base_llm.get("temperature", 1.0),
             "api_type": base_llm.get("api_type", ""),
             "api_version": base_llm.get("api_version", ""),
+            "max_prompt_images": base_llm.get("max_prompt_images"),
+            "older_image_size": base_llm.get("older_image_size"),
+            "endpoints": base_llm.get("endpoints", []),
+            "requests_per_minute": base_llm.get("requests_per_minute"),
+            "tokens_per_minute": base_llm.get("tokens_per_minute"),
+            "hedge_percentile": base_llm.get("hedge_percentile"),
+            "hedge_min_delay": base_llm.get("hedge_min_delay", 1.0),
+            "hedge_budget": base_llm.get("hedge_budget", 0.1),
         }
 
         # handle browser config.
@@ -233,7 +309,8 @@ class Config:
             "llm": {
                 "default": default_settings,
                 **{
-                    name: {**default_settings, **override_config}
+                    # Endpoints are not inherited, they belong to the default model
+                    name: {**default_settings, "endpoints": [], **override_config}
                     for name, override_config in llm_overrides.items()
                 },
             },
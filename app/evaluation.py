@@ -0,0 +1,316 @@
+"""Headless batch evaluation of an agent over a JSONL question set.
+
+    python -m app.evaluation questions.jsonl --out runs/baseline [--agent slicer]
+        [--concurrency 4] [--rpm 60] [--tpm 200000] [--timeout 600]
+
+Each input line is a JSON object with a `question` (or `content`) and an
+optional `id`, the line number by default. Questions run concurrently on
+copies of one agent that share its LLM client, tools and MCP connections.
+Every finished question gets a transcript in `transcripts/<id>.json` and a
+line in `results.jsonl`, appended and fsynced right away, so rerunning with
+the same `--out` skips what is already done and a crashed run resumes where
+it stopped. `summary.json` has the totals and latency percentiles. Replies
+the agent streams for Slicer go to `stdout.log`, tagged with the question id.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import math
+import os
+import re
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel
+
+from app.llm import usage_scope
+from app.logger import logger
+from app.schema import current_session_id
+from app.slicer.sessions import fresh_agent
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+class Question(BaseModel):
+    id: str
+    question: str
+
+
+def load_questions(path: Path) -> List[Question]:
+    questions, seen = [], set()
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            data = json.loads(line)
+            question = Question(
+                id=str(data.get("id", line_number)),
+                question=data.get("question") or data.get("content") or "",
+            )
+            if question.id in seen:
+                logger.warning(f"Skipping duplicate question id {question.id}")
+                continue
+            seen.add(question.id)
+            questions.append(question)
+    return questions
+
+
+def load_results(path: Path) -> Dict[str, Dict[str, Any]]:
+    """Latest result per question id, ignoring a line cut short by a crash."""
+    results = {}
+    if path.exists():
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                results[record["id"]] = record
+    return results
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile."""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(math.ceil(q / 100 * len(values)) - 1, 0)]
+
+
+class Evaluation:
+    def __init__(
+        self,
+        template: Any,
+        out_dir: Path,
+        concurrency: int = 4,
+        timeout: Optional[float] = None,
+    ):
+        """
+        Args:
+            template: Agent the question runs are copied from
+            out_dir: Run directory for transcripts, results and summary
+            concurrency: Questions running at the same time
+            timeout: Seconds before a question is abandoned, None to wait
+        """
+        self.template = template
+        self.out_dir = Path(out_dir)
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.results_path = self.out_dir / "results.jsonl"
+        self.transcripts_dir = self.out_dir / "transcripts"
+        self._results_file = None
+        self.finished = 0
+
+    def _write_result(self, record: Dict[str, Any]) -> None:
+        self._results_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._results_file.flush()
+        os.fsync(self._results_file.fileno())
+
+    async def run_question(self, question: Question) -> Dict[str, Any]:
+        agent = fresh_agent(self.template)
+        current_session_id.set(question.id)
+        status, error, result = "ok", None, ""
+        start = time.perf_counter()
+        with usage_scope() as usages:
+            try:
+                async with asyncio.timeout(self.timeout):
+                    result = await agent.run(question.question)
+            except TimeoutError:
+                status, error = "timeout", f"No answer after {self.timeout}s"
+            except Exception as e:
+                status, error = "error", str(e)
+        latency = time.perf_counter() - start
+
+        max_steps_reached = result.endswith(
+            f"Terminated: Reached max steps ({agent.max_steps})"
+        )
+        answer = next(
+            (
+                message.content
+                for message in reversed(agent.memory.messages)
+                if message.role == "assistant" and message.content
+            ),
+            None,
+        )
+        name = re.sub(r"[^\w.-]", "_", question.id)
+        transcript = self.transcripts_dir / f"{name}.json"
+        with open(transcript, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "id": question.id,
+                    "question": question.question,
+                    "messages": agent.memory.to_dict_list(),
+                },
+                f,
+                ensure_ascii=False,
+                indent=2,
+            )
+        return {
+            "id": question.id,
+            "question": question.question,
+            "status": status,
+            "error": error,
+            "answer": answer,
+            "steps": agent.max_steps if max_steps_reached else agent.current_step,
+            "max_steps_reached": max_steps_reached,
+            "requests": len(usages),
+            "prompt_tokens": sum(usage.prompt_tokens for usage in usages),
+            "completion_tokens": sum(usage.completion_tokens for usage in usages),
+            "cached_tokens": sum(usage.cached_tokens for usage in usages),
+            "estimated_usage": any(usage.estimated for usage in usages),
+            "latency_s": round(latency, 3),
+            "transcript": str(transcript.relative_to(self.out_dir)),
+        }
+
+    async def _worker(self, queue: "asyncio.Queue[Question]", total: int) -> None:
+        while not queue.empty():
+            question = queue.get_nowait()
+            record = await self.run_question(question)
+            self._write_result(record)
+            self.finished += 1
+            logger.info(
+                f"📋 [{self.finished}/{total}] {question.id}: {record['status']}, "
+                f"{record['steps']} steps, {record['latency_s']}s"
+            )
+
+    async def run(
+        self, questions: List[Question], retry_errors: bool = False
+    ) -> Dict[str, Any]:
+        """Run the questions without a result yet and write the summary."""
+        self.transcripts_dir.mkdir(parents=True, exist_ok=True)
+        done = load_results(self.results_path)
+        pending = [
+            question
+            for question in questions
+            if question.id not in done
+            or (retry_errors and done[question.id]["status"] != "ok")
+        ]
+        if len(pending) < len(questions):
+            logger.info(
+                f"Resuming: {len(questions) - len(pending)} of {len(questions)} "
+                "questions already have results"
+            )
+
+        queue: "asyncio.Queue[Question]" = asyncio.Queue()
+        for question in pending:
+            queue.put_nowait(question)
+        self.finished = 0
+        start = time.perf_counter()
+        with open(self.results_path, "a+", encoding="utf-8") as f:
+            # Terminate a line cut short by a crash before appending
+            if f.tell() > 0:
+                f.seek(f.tell() - 1)
+                if f.read(1) != "\n":
+                    f.write("\n")
+            self._results_file = f
+            try:
+                async with asyncio.TaskGroup() as group:
+                    for _ in range(min(self.concurrency, len(pending))):
+                        group.create_task(self._worker(queue, len(pending)))
+            finally:
+                self._results_file = None
+        elapsed = time.perf_counter() - start
+
+        ids = {question.id for question in questions}
+        records = [
+            record
+            for record in load_results(self.results_path).values()
+            if record["id"] in ids
+        ]
+        summary = self.summarize(records)
+        summary["run"] = {
+            "questions": len(pending),
+            "seconds": round(elapsed, 1),
+            "questions_per_minute": (
+                round(len(pending) / elapsed * 60, 2) if pending else None
+            ),
+        }
+        llm = self.template.llm
+        if hasattr(llm, "endpoints"):
+            summary["endpoints"] = llm.endpoints.stats()
+        with open(self.out_dir / "summary.json", "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+        return summary
+
+    @staticmethod
+    def summarize(records: List[Dict[str, Any]]) -> Dict[str, Any]:
+        latencies = [record["latency_s"] for record in records]
+        statuses: Dict[str, int] = {}
+        for record in records:
+            statuses[record["status"]] = statuses.get(record["status"], 0) + 1
+        return {
+            "questions": len(records),
+            "statuses": statuses,
+            "max_steps_reached": sum(r["max_steps_reached"] for r in records),
+            "mean_steps": (
+                round(sum(r["steps"] for r in records) / len(records), 2)
+                if records
+                else None
+            ),
+            "requests": sum(r["requests"] for r in records),
+            "prompt_tokens": sum(r["prompt_tokens"] for r in records),
+            "completion_tokens": sum(r["completion_tokens"] for r in records),
+            "cached_tokens": sum(r["cached_tokens"] for r in records),
+            "latency_s": {
+                **{f"p{q}": percentile(latencies, q) for q in PERCENTILES},
+                "max": max(latencies, default=None),
+            },
+        }
+
+
+async def build_agent(kind: str, mcp_url: Optional[str] = None) -> Any:
+    if kind == "toolcall":
+        from app.agent import ToolCallAgent
+
+        return ToolCallAgent()
+    if kind == "slicer":
+        from app.slicer.agent import SlicerAgent
+
+        return SlicerAgent()
+    from app.slicer.agent import SlicerAgentWithMCP
+
+    agent = SlicerAgentWithMCP(**({"server_url": mcp_url} if mcp_url else {}))
+    await agent.connect()
+    return agent
+
+
+async def main(args: argparse.Namespace) -> Dict[str, Any]:
+    template = await build_agent(args.agent, args.mcp_url)
+    if args.max_steps:
+        template.max_steps = args.max_steps
+    if args.rpm or args.tpm:
+        for endpoint in template.llm.endpoints.endpoints:
+            endpoint.limiter.set_limits(args.rpm, args.tpm)
+    evaluation = Evaluation(
+        template, args.out, concurrency=args.concurrency, timeout=args.timeout
+    )
+    evaluation.out_dir.mkdir(parents=True, exist_ok=True)
+    questions = load_questions(args.questions)
+    with open(evaluation.out_dir / "stdout.log", "a", encoding="utf-8") as log:
+        with contextlib.redirect_stdout(log):
+            return await evaluation.run(questions, retry_errors=args.retry_errors)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("questions", type=Path, help="JSONL file of questions")
+    parser.add_argument("--out", type=Path, required=True, help="Run directory")
+    parser.add_argument(
+        "--agent", choices=["toolcall", "slicer", "slicer-mcp"], default="slicer"
+    )
+    parser.add_argument("--mcp-url", help="MCP server for --agent slicer-mcp")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--rpm", type=int, help="Requests per minute limit")
+    parser.add_argument("--tpm", type=int, help="Tokens per minute limit")
+    parser.add_argument("--timeout", type=float, help="Seconds per question")
+    parser.add_argument("--max-steps", type=int, help="Override the agent's max_steps")
+    parser.add_argument(
+        "--retry-errors",
+        action="store_true",
+        help="Run questions again whose last result is an error or timeout",
+    )
+    summary = asyncio.run(main(parser.parse_args()))
+    print(json.dumps(summary, indent=2))
@@ -0,0 +1,203 @@
+"""Content-addressed store for images attached to messages.
+
+Messages keep a short reference (the SHA-256 of the image bytes) instead of a
+base64 string, so an image is held once no matter how many messages, memory
+copies or serialized dicts refer to it. Base64 data URLs are only built when a
+request is formatted, and the most recently used ones are cached.
+"""
+
+import base64
+import binascii
+import hashlib
+import io
+import struct
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple, Union
+
+from app.logger import logger
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Image reference prefix, distinguishes references from inline base64 data
+REF_PREFIX = "sha256:"
+
+# Leading base64 characters of the supported image formats
+_IMAGE_SIGNATURES = {
+    "/9j/": "image/jpeg",
+    "iVBORw0KGgo": "image/png",
+    "UklGR": "image/webp",
+    "R0lGOD": "image/gif",
+}
+# Base64 characters decoded when looking for the image dimensions
+_IMAGE_HEADER_CHARS = 65536
+
+
+def image_mime_type(base64_image: str) -> str:
+    """Guess the mime type of a base64 encoded image, JPEG if unknown."""
+    for signature, mime_type in _IMAGE_SIGNATURES.items():
+        if base64_image.startswith(signature):
+            return mime_type
+    return "image/jpeg"
+
+
+def image_data_url(base64_image: str) -> str:
+    """Wrap a base64 encoded image (or pass through a URL) as an image URL."""
+    if base64_image.startswith(("data:", "http://", "https://")):
+        return base64_image
+    return f"data:{image_mime_type(base64_image)};base64,{base64_image}"
+
+
+def image_dimensions(image: str) -> Optional[Tuple[int, int]]:
+    """Read (width, height) from the header of a base64 image or data URL.
+
+    Supports PNG, GIF, JPEG and WebP. Returns None for remote URLs and
+    unrecognized data.
+    """
+    if image.startswith("data:"):
+        image = image.partition(",")[2]
+    elif image.startswith(("http://", "https://")):
+        return None
+    header = image[:_IMAGE_HEADER_CHARS]
+    try:
+        data = base64.b64decode(header[: len(header) // 4 * 4])
+    except (binascii.Error, ValueError):
+        return None
+
+    try:
+        if data.startswith(b"\x89PNG\r\n\x1a\n"):
+            return struct.unpack(">II", data[16:24])
+        if data[:6] in (b"GIF87a", b"GIF89a"):
+            return struct.unpack("<HH", data[6:10])
+        if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+            chunk = data[12:16]
+            if chunk == b"VP8 ":
+                width, height = struct.unpack("<HH", data[26:30])
+                return width & 0x3FFF, height & 0x3FFF
+            if chunk == b"VP8L":
+                bits = int.from_bytes(data[21:25], "little")
+                return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+            if chunk == b"VP8X":
+                width = int.from_bytes(data[24:27], "little") + 1
+                height = int.from_bytes(data[27:30], "little") + 1
+                return width, height
+            return None
+        if data[:2] == b"\xff\xd8":
+            # Walk the JPEG segments up to the first start-of-frame marker
+            offset = 2
+            while offset + 9 < len(data):
+                if data[offset] != 0xFF:
+                    return None
+                marker = data[offset + 1]
+                if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+                    offset += 2
+                    continue
+                length = struct.unpack(">H", data[offset + 2 : offset + 4])[0]
+                if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                    height, width = struct.unpack(">HH", data[offset + 5 : offset + 9])
+                    return width, height
+                offset += 2 + length
+    except struct.error:
+        pass
+    return None
+
+
+class ImageStore:
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, max_encoded: int = 16):
+        """
+        Args:
+            max_bytes: Budget for the raw image bytes, least recently used
+                images are evicted beyond it
+            max_encoded: Number of base64 data URLs kept ready for requests
+        """
+        self.max_bytes = max_bytes
+        self.max_encoded = max_encoded
+        self._images: "OrderedDict[str, bytes]" = OrderedDict()
+        self._encoded: "OrderedDict[Tuple[str, Optional[int]], str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+
+    @staticmethod
+    def is_ref(value: str) -> bool:
+        return value.startswith(REF_PREFIX)
+
+    def put(self, image: Union[bytes, str]) -> str:
+        """Store raw or base64 encoded image bytes and return their reference."""
+        if isinstance(image, str):
+            if self.is_ref(image):
+                return image
+            if image.startswith("data:"):
+                image = image.partition(",")[2]
+            try:
+                image = base64.b64decode(image, validate=True)
+            except (binascii.Error, ValueError) as e:
+                raise ValueError(f"Invalid base64 image: {e}") from e
+        ref = REF_PREFIX + hashlib.sha256(image).hexdigest()
+        with self._lock:
+            if ref in self._images:
+                self._images.move_to_end(ref)
+                return ref
+            self._images[ref] = image
+            self.total_bytes += len(image)
+            while self.total_bytes > self.max_bytes and len(self._images) > 1:
+                evicted, data = self._images.popitem(last=False)
+                self.total_bytes -= len(data)
+                logger.debug(f"Evicted image {evicted[:19]} from the image store")
+        return ref
+
+    def get(self, ref: str) -> Optional[bytes]:
+        """Raw bytes of a stored image, None if unknown or evicted."""
+        with self._lock:
+            data = self._images.get(ref)
+            if data is not None:
+                self._images.move_to_end(ref)
+            return data
+
+    def data_url(self, ref: str, max_size: Optional[int] = None) -> Optional[str]:
+        """Base64 data URL of an image, optionally downscaled to `max_size` pixels.
+
+        Downscaling needs Pillow; without it the image is returned unchanged.
+        Returns None if the image is unknown or was evicted.
+        """
+        if max_size is not None and Image is None:
+            max_size = None
+        key = (ref, max_size)
+        with self._lock:
+            url = self._encoded.get(key)
+            if url is not None:
+                self._encoded.move_to_end(key)
+                return url
+        data = self.get(ref)
+        if data is None:
+            return None
+        if max_size is not None:
+            data = _downscale(data, max_size)
+        url = image_data_url(base64.b64encode(data).decode("ascii"))
+        with self._lock:
+            self._encoded[key] = url
+            while len(self._encoded) > self.max_encoded:
+                self._encoded.popitem(last=False)
+        return url
+
+    def clear(self) -> None:
+        with self._lock:
+            self._images.clear()
+            self._encoded.clear()
+            self.total_bytes = 0
+
+
+def _downscale(data: bytes, max_size: int) -> bytes:
+    """Shrink an image to fit `max_size` pixels, re-encoded as JPEG."""
+    with Image.open(io.BytesIO(data)) as image:
+        if max(image.size) <= max_size:
+            return data
+        image.thumbnail((max_size, max_size))
+        output = io.BytesIO()
+        image.convert("RGB").save(output, "JPEG", quality=75)
+        return output.getvalue()
+
+
+image_store = ImageStore()
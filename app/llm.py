@@ -1,12 +1,34 @@
+import asyncio
 import math
-from typing import AsyncIterator, Dict, List, Optional, Union
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from collections import deque
+from typing import (
+    AsyncIterator,
+    Deque,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 
 import tiktoken
 from openai import (
+    APIConnectionError,
     APIError,
+    APIStatusError,
+    APITimeoutError,
     AsyncOpenAI,
     AsyncStream,
     AuthenticationError,
+    BadRequestError,
     OpenAIError,
     RateLimitError,
 )
@@ -20,15 +42,18 @@ from tenacity import (
 
 from app.config import LLMSettings, config
 from app.exceptions import TokenLimitExceeded
+from app.image_store import image_dimensions, image_store
 from app.logger import logger  # Assuming a logger is set up in your app
 from app.schema import (
     ROLE_VALUES,
     TOOL_CHOICE_TYPE,
     TOOL_CHOICE_VALUES,
     Message,
-    MessageChunk,
+    MessageRecord,
     Payload,
+    StreamAccumulator,
     ToolChoice,
+    Usage,
 )
 
 REASONING_MODELS = ["o1", "o3-mini"]
@@ -42,6 +67,430 @@ MULTIMODAL_MODELS = [
 ]
 
 
+def _parse_duration(value: str) -> Optional[float]:
+    """Parse rate limit durations like "20ms", "1.5s" or "6m0s" into seconds."""
+    total = 0.0
+    matched = False
+    for amount, unit in re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)?", value.strip()):
+        matched = True
+        total += float(amount) * {"ms": 0.001, "h": 3600, "m": 60}.get(unit, 1)
+    return total if matched else None
+
+
+# Usage of the requests made in the current context, see `usage_scope`
+_usage_log: ContextVar[Optional[List[Usage]]] = ContextVar("usage_log", default=None)
+
+
+@contextmanager
+def usage_scope() -> Iterator[List[Usage]]:
+    """Collect the usage of the LLM requests made in this context.
+
+    The LLM client is shared, so its totals mix all concurrent tasks; a scope
+    only sees the requests of the task it was entered in and the tasks that
+    one starts.
+    """
+    log: List[Usage] = []
+    token = _usage_log.set(log)
+    try:
+        yield log
+    finally:
+        _usage_log.reset(token)
+
+
+class RateLimiter:
+    """Client-side requests/min and tokens/min limits for one API key.
+
+    Two token buckets refill continuously at the configured per-minute rates.
+    Requests wait in FIFO order for both buckets to cover them, the token cost
+    being the estimated prompt tokens plus `max_tokens`. Rate limit response
+    headers resync the buckets with the provider's view, which also counts
+    other processes sharing the key, and 429 responses pause the queue for
+    their `Retry-After`. Limiters are shared by all clients of the same key.
+    """
+
+    _shared: Dict[Tuple[str, str], "RateLimiter"] = {}
+
+    def __init__(
+        self,
+        requests_per_minute: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None,
+    ):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = float(requests_per_minute or 0)
+        self._tokens = float(tokens_per_minute or 0)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        # asyncio.Lock wakes its waiters in FIFO order
+        self._lock = asyncio.Lock()
+
+        self.queued = 0
+        self.granted = 0
+        self.delayed = 0
+        self.total_wait = 0.0
+        self.throttled = 0
+
+    @classmethod
+    def shared(
+        cls,
+        base_url: str,
+        api_key: str,
+        requests_per_minute: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None,
+    ) -> "RateLimiter":
+        key = (base_url, api_key)
+        if key not in cls._shared:
+            cls._shared[key] = cls(requests_per_minute, tokens_per_minute)
+        return cls._shared[key]
+
+    def set_limits(
+        self,
+        requests_per_minute: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None,
+    ) -> None:
+        """Replace the configured limits, None keeps a limit unchanged."""
+        self._refill()
+        for kind, limit in (
+            ("requests", requests_per_minute),
+            ("tokens", tokens_per_minute),
+        ):
+            if limit is None:
+                continue
+            limit_name, bucket = f"{kind}_per_minute", f"_{kind}"
+            # A new limit starts with a full bucket, a changed one keeps its level
+            level = getattr(self, bucket) if getattr(self, limit_name) else limit
+            setattr(self, limit_name, limit)
+            setattr(self, bucket, float(min(level, limit)))
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed, self._updated = now - self._updated, now
+        if self.requests_per_minute:
+            self._requests = min(
+                self.requests_per_minute,
+                self._requests + elapsed * self.requests_per_minute / 60,
+            )
+        if self.tokens_per_minute:
+            self._tokens = min(
+                self.tokens_per_minute,
+                self._tokens + elapsed * self.tokens_per_minute / 60,
+            )
+
+    def delay(self, tokens: int = 0) -> float:
+        """Seconds until a request of `tokens` could start, ignoring the queue."""
+        self._refill()
+        wait = self._blocked_until - time.monotonic()
+        if self.requests_per_minute and self._requests < 1:
+            wait = max(wait, (1 - self._requests) * 60 / self.requests_per_minute)
+        if self.tokens_per_minute:
+            tokens = min(tokens, self.tokens_per_minute)
+            if self._tokens < tokens:
+                wait = max(wait, (tokens - self._tokens) * 60 / self.tokens_per_minute)
+        return max(wait, 0.0)
+
+    async def acquire(self, tokens: int = 0) -> None:
+        """Wait in line until the request fits both buckets, then consume."""
+        self.queued += 1
+        start = time.monotonic()
+        try:
+            async with self._lock:
+                while (wait := self.delay(tokens)) > 0:
+                    await asyncio.sleep(wait)
+                if self.requests_per_minute:
+                    self._requests -= 1
+                if self.tokens_per_minute:
+                    self._tokens -= min(tokens, self.tokens_per_minute)
+        finally:
+            self.queued -= 1
+        waited = time.monotonic() - start
+        self.granted += 1
+        if waited > 0.001:
+            self.delayed += 1
+            self.total_wait += waited
+
+    def adjust(self, tokens: int) -> None:
+        """Correct the token bucket once the actual usage is known."""
+        if self.tokens_per_minute:
+            self._refill()
+            self._tokens = min(self.tokens_per_minute, self._tokens - tokens)
+
+    def update_from_headers(self, headers) -> None:
+        """Sync with `x-ratelimit-*` and `retry-after` response headers."""
+        if not headers:
+            return
+        self._refill()
+        now = time.monotonic()
+        for kind in ("requests", "tokens"):
+            limit_name, bucket = f"{kind}_per_minute", f"_{kind}"
+            limit = headers.get(f"x-ratelimit-limit-{kind}")
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            try:
+                if limit is not None and not getattr(self, limit_name):
+                    # Adopt the provider's limit when none is configured
+                    setattr(self, limit_name, int(limit))
+                    setattr(self, bucket, float(limit))
+                if remaining is not None and getattr(self, limit_name):
+                    setattr(self, bucket, min(getattr(self, bucket), float(remaining)))
+            except ValueError:
+                pass
+
+        retry_after = None
+        if headers.get("retry-after-ms"):
+            try:
+                retry_after = float(headers["retry-after-ms"]) / 1000
+            except ValueError:
+                pass
+        elif headers.get("retry-after"):
+            value = headers["retry-after"]
+            try:
+                retry_after = float(value)
+            except ValueError:
+                try:
+                    retry_after = (
+                        parsedate_to_datetime(value) - datetime.now(timezone.utc)
+                    ).total_seconds()
+                except (TypeError, ValueError):
+                    pass
+        if retry_after and retry_after > 0:
+            self._blocked_until = max(self._blocked_until, now + retry_after)
+
+    def throttle(self, headers=None) -> None:
+        """Handle a 429: pause the queue for Retry-After, or until a reset."""
+        self.throttled += 1
+        self.update_from_headers(headers)
+        if self._blocked_until > time.monotonic() or not headers:
+            return
+        resets = [
+            _parse_duration(headers.get(f"x-ratelimit-reset-{kind}") or "")
+            for kind in ("requests", "tokens")
+        ]
+        wait = max([reset for reset in resets if reset] or [1.0])
+        self._blocked_until = time.monotonic() + wait
+
+    def metrics(self) -> Dict[str, object]:
+        self._refill()
+        return {
+            "requests_per_minute": self.requests_per_minute,
+            "tokens_per_minute": self.tokens_per_minute,
+            "available_requests": (
+                round(self._requests, 1) if self.requests_per_minute else None
+            ),
+            "available_tokens": int(self._tokens) if self.tokens_per_minute else None,
+            "blocked_for_s": round(max(self._blocked_until - time.monotonic(), 0), 2),
+            "queued": self.queued,
+            "granted": self.granted,
+            "delayed": self.delayed,
+            "mean_wait_ms": round(self.total_wait / max(self.delayed, 1) * 1000, 1),
+            "throttled": self.throttled,
+        }
+
+
+class Endpoint:
+    """An API endpoint with its client and rolling health statistics."""
+
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str,
+        model: str,
+        weight: float = 1.0,
+        window: int = 50,
+        limiter: Optional[RateLimiter] = None,
+    ):
+        self.base_url = base_url
+        self.model = model
+        self.weight = max(weight, 1e-3)
+        self.client = AsyncOpenAI(api_key=api_key, base_url=base_url)
+        self.limiter = limiter or RateLimiter()
+        # Whether streams report usage with stream_options, None until known
+        self.stream_usage: Optional[bool] = None
+        self.outstanding = 0
+        # Latencies (seconds) and outcomes of the last `window` requests
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self.outcomes: Deque[bool] = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.probing = False
+
+    @property
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return 1 - sum(self.outcomes) / len(self.outcomes)
+
+    @property
+    def mean_latency(self) -> float:
+        if not self.latencies:
+            return 0.0
+        return sum(self.latencies) / len(self.latencies)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "base_url": self.base_url,
+            "model": self.model,
+            "weight": self.weight,
+            "outstanding": self.outstanding,
+            "mean_latency_ms": round(self.mean_latency * 1000, 1),
+            "error_rate": round(self.error_rate, 3),
+            "ejected": self.ejected_until > time.monotonic(),
+            "ejections": self.ejections,
+            "rate_limit": self.limiter.metrics(),
+        }
+
+
+class EndpointPool:
+    """Routes requests over endpoints by least outstanding requests per weight.
+
+    An endpoint that keeps failing (consecutive failures, or a high error rate
+    over its recent requests) is ejected for a backoff period that doubles with
+    each ejection. Once it expires, a single probe request is let through and
+    the endpoint rejoins the pool if the probe succeeds.
+    """
+
+    MAX_CONSECUTIVE_FAILURES = 3
+    MAX_ERROR_RATE = 0.5
+    MIN_REQUESTS_FOR_ERROR_RATE = 10
+    BASE_EJECTION_SECONDS = 5.0
+    MAX_EJECTION_SECONDS = 120.0
+
+    def __init__(self, endpoints: List[Endpoint]):
+        if not endpoints:
+            raise ValueError("At least one endpoint is required")
+        self.endpoints = endpoints
+
+    def __len__(self) -> int:
+        return len(self.endpoints)
+
+    def acquire(
+        self, exclude: Optional[Set[Endpoint]] = None, tokens: int = 0
+    ) -> Endpoint:
+        """Pick an endpoint for a request and count it as outstanding.
+
+        Endpoints in `exclude` (e.g. those already tried for this request) are
+        only used when nothing else is left. Endpoints whose rate limiter would
+        hold a request of `tokens` back come last.
+        """
+        now = time.monotonic()
+        candidates = [e for e in self.endpoints if not exclude or e not in exclude]
+        candidates = candidates or self.endpoints
+        available = [
+            e for e in candidates if e.ejected_until <= now and not e.probing
+        ] or [min(candidates, key=lambda e: e.ejected_until)]
+        endpoint = min(
+            available,
+            key=lambda e: (
+                e.limiter.delay(tokens),
+                (e.outstanding + 1) / e.weight,
+                e.mean_latency,
+            ),
+        )
+        if endpoint.ejections and endpoint.consecutive_failures:
+            # First request after an ejection expired probes the endpoint
+            endpoint.probing = True
+        endpoint.outstanding += 1
+        return endpoint
+
+    def record(
+        self, endpoint: Endpoint, latency: float, error: Optional[Exception] = None
+    ) -> None:
+        """Record the outcome of a request on `endpoint`."""
+        endpoint.probing = False
+        endpoint.outcomes.append(error is None)
+        if error is None:
+            endpoint.latencies.append(latency)
+            if endpoint.consecutive_failures and endpoint.ejections:
+                # Judge the recovered endpoint by its requests from now on
+                endpoint.outcomes.clear()
+                endpoint.outcomes.append(True)
+                logger.info(f"🩺 LLM endpoint {endpoint.base_url} recovered")
+            endpoint.consecutive_failures = 0
+            return
+
+        endpoint.consecutive_failures += 1
+        unhealthy = endpoint.consecutive_failures >= self.MAX_CONSECUTIVE_FAILURES or (
+            len(endpoint.outcomes) >= self.MIN_REQUESTS_FOR_ERROR_RATE
+            and endpoint.error_rate > self.MAX_ERROR_RATE
+        )
+        # Failures of requests sent before an ejection do not extend it
+        ejected = endpoint.ejected_until > time.monotonic()
+        if unhealthy and not ejected and len(self.endpoints) > 1:
+            backoff = min(
+                self.BASE_EJECTION_SECONDS * 2**endpoint.ejections,
+                self.MAX_EJECTION_SECONDS,
+            )
+            endpoint.ejections += 1
+            endpoint.ejected_until = time.monotonic() + backoff
+            logger.warning(
+                f"🚫 Ejected LLM endpoint {endpoint.base_url} for {backoff:.0f}s "
+                f"after {endpoint.consecutive_failures} failures: {error}"
+            )
+
+    def release(self, endpoint: Endpoint) -> None:
+        endpoint.outstanding -= 1
+
+    def stats(self) -> List[Dict[str, object]]:
+        return [endpoint.stats() for endpoint in self.endpoints]
+
+
+def is_transient_error(error: Exception) -> bool:
+    """Whether another endpoint might succeed where this request failed."""
+    if isinstance(error, (APIConnectionError, APITimeoutError, RateLimitError)):
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code >= 500 or error.status_code in (408, 409)
+    return False
+
+
+class HedgeStats:
+    """Time-to-first-token samples and the outcome of hedged streams.
+
+    Only TTFTs of primary requests that produced their first chunk are
+    sampled, so hedging does not pull its own trigger delay down.
+    """
+
+    MIN_SAMPLES = 20
+
+    def __init__(self, window: int = 500):
+        self.ttfts: Deque[float] = deque(maxlen=window)
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.saved = 0.0
+
+    def delay(self, percentile: float, min_delay: float) -> float:
+        """Seconds to wait for a first chunk before hedging."""
+        if len(self.ttfts) < self.MIN_SAMPLES:
+            return min_delay
+        ordered = sorted(self.ttfts)
+        index = min(int(len(ordered) * percentile / 100), len(ordered) - 1)
+        return max(ordered[index], min_delay)
+
+    def estimate_saved(self, ttft: float) -> float:
+        """Expected primary TTFT beyond `ttft`, given it had not arrived by then."""
+        slower = [sample for sample in self.ttfts if sample > ttft]
+        return sum(slower) / len(slower) - ttft if slower else 0.0
+
+    def metrics(self) -> Dict[str, object]:
+        ordered = sorted(self.ttfts)
+
+        def percentile(p: float) -> Optional[float]:
+            if not ordered:
+                return None
+            index = min(int(len(ordered) * p / 100), len(ordered) - 1)
+            return round(ordered[index] * 1000, 1)
+
+        return {
+            "requests": self.requests,
+            "hedged": self.hedged,
+            "hedge_rate": round(self.hedged / max(self.requests, 1), 3),
+            "hedge_wins": self.hedge_wins,
+            "estimated_saved_ms": round(self.saved * 1000, 1),
+            "ttft_p50_ms": percentile(50),
+            "ttft_p99_ms": percentile(99),
+        }
+
+
 class TokenCounter:
     # Token constants
     BASE_MESSAGE_TOKENS = 4
@@ -68,11 +517,14 @@ class TokenCounter:
         For "low" detail: fixed 85 tokens
         For "high" detail:
         1. Scale to fit in 2048x2048 square
-        2. Scale shortest side to 768px
+        2. Scale shortest side down to 768px
         3. Count 512px tiles (170 tokens each)
         4. Add 85 tokens
         """
-        detail = image_item.get("detail", "medium")
+        image_url = image_item.get("image_url")
+        if not isinstance(image_url, dict):
+            image_url = {"url": image_url or ""}
+        detail = image_item.get("detail") or image_url.get("detail") or "medium"
 
         # For low detail, always return fixed token count
         if detail == "low":
@@ -82,10 +534,13 @@ class TokenCounter:
         # OpenAI doesn't specify a separate calculation for medium
 
         # For high detail, calculate based on dimensions if available
-        if detail == "high" or detail == "medium":
-            # If dimensions are provided in the image_item
-            if "dimensions" in image_item:
-                width, height = image_item["dimensions"]
+        if detail in ("high", "medium", "auto"):
+            # Given dimensions, or those read from the header of a data URL
+            dimensions = image_item.get("dimensions") or image_dimensions(
+                image_url.get("url", "")
+            )
+            if dimensions:
+                width, height = dimensions
                 return self._calculate_high_detail_tokens(width, height)
 
         # Default values when dimensions aren't available or detail level is unknown
@@ -107,8 +562,11 @@ class TokenCounter:
             width = int(width * scale)
             height = int(height * scale)
 
-        # Step 2: Scale so shortest side is HIGH_DETAIL_TARGET_SHORT_SIDE
-        scale = self.HIGH_DETAIL_TARGET_SHORT_SIDE / min(width, height)
+        # Step 2: Scale so shortest side is HIGH_DETAIL_TARGET_SHORT_SIDE,
+        # images already smaller than that are not upscaled
+        scale = min(
+            1.0, self.HIGH_DETAIL_TARGET_SHORT_SIDE / max(min(width, height), 1)
+        )
         scaled_width = int(width * scale)
         scaled_height = int(height * scale)
 
@@ -203,10 +661,24 @@ class LLM:
             self.api_key = llm_config.api_key
             self.api_version = llm_config.api_version
             self.base_url = llm_config.base_url
+            # Which images of the conversation are sent, see format_messages
+            self.image_policy = {
+                "max_images": llm_config.max_prompt_images,
+                "older_image_size": llm_config.older_image_size,
+            }
+            # Hedged streaming, see _open_stream
+            self.hedge_percentile = llm_config.hedge_percentile
+            self.hedge_min_delay = llm_config.hedge_min_delay
+            self.hedge_budget = llm_config.hedge_budget
+            self.hedge_stats = HedgeStats()
 
             # Add token counting related attributes
             self.total_input_tokens = 0
             self.total_completion_tokens = 0
+            self.total_cached_tokens = 0
+            # Usage of the last request, and how many were estimated locally
+            self.last_usage: Optional[Usage] = None
+            self.estimated_requests = 0
             self.max_input_tokens = (
                 llm_config.max_input_tokens
                 if hasattr(llm_config, "max_input_tokens")
@@ -220,10 +692,50 @@ class LLM:
                 # If the model is not in tiktoken's presets, use cl100k_base as default
                 self.tokenizer = tiktoken.get_encoding("cl100k_base")
 
-            self.client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url)
+            self.endpoints = EndpointPool(
+                [
+                    Endpoint(
+                        endpoint.base_url,
+                        endpoint.api_key,
+                        endpoint.model or self.model,
+                        endpoint.weight,
+                        limiter=RateLimiter.shared(
+                            endpoint.base_url,
+                            endpoint.api_key,
+                            llm_config.requests_per_minute,
+                            llm_config.tokens_per_minute,
+                        ),
+                    )
+                    for endpoint in llm_config.endpoints
+                ]
+                or [
+                    Endpoint(
+                        self.base_url,
+                        self.api_key,
+                        self.model,
+                        limiter=RateLimiter.shared(
+                            self.base_url,
+                            self.api_key,
+                            llm_config.requests_per_minute,
+                            llm_config.tokens_per_minute,
+                        ),
+                    )
+                ]
+            )
+            self.client = self.endpoints.endpoints[0].client
 
             self.token_counter = TokenCounter(self.tokenizer)
 
+            # Token cost of tool definitions, keyed by id of the memoized params
+            self._tool_tokens: Dict[int, tuple] = {}
+            self._last_tools: Optional[tuple] = None
+            self._last_tools_tokens = 0
+
+    @property
+    def supports_images(self) -> bool:
+        """Whether the model accepts image inputs"""
+        return self.model in MULTIMODAL_MODELS
+
     def count_tokens(self, text: str) -> int:
         """Calculate the number of tokens in a text"""
         if not text:
@@ -233,17 +745,63 @@ class LLM:
     def count_message_tokens(self, messages: List[dict]) -> int:
         return self.token_counter.count_message_tokens(messages)
 
-    def update_token_count(self, input_tokens: int, completion_tokens: int = 0) -> None:
+    def count_tools_tokens(self, tools: Optional[List[dict]]) -> int:
+        """Calculate the token cost of tool definitions.
+
+        Tool params are memoized by `ToolCollection`, so the same (frozen) dicts
+        come back every step and their cost is only tokenized once.
+        """
+        if not tools:
+            return 0
+        if tools is self._last_tools:
+            return self._last_tools_tokens
+
+        if len(self._tool_tokens) > 512:
+            self._tool_tokens.clear()
+        total = 0
+        for tool in tools:
+            cached = self._tool_tokens.get(id(tool))
+            if cached is None or cached[0] is not tool:
+                cached = (tool, self.count_tokens(str(tool)))
+                self._tool_tokens[id(tool)] = cached
+            total += cached[1]
+
+        if isinstance(tools, tuple):
+            self._last_tools, self._last_tools_tokens = tools, total
+        return total
+
+    def update_token_count(
+        self, input_tokens: int, completion_tokens: int = 0, cached_tokens: int = 0
+    ) -> None:
         """Update token counts"""
         # Only track tokens if max_input_tokens is set
         self.total_input_tokens += input_tokens
         self.total_completion_tokens += completion_tokens
+        self.total_cached_tokens += cached_tokens
         logger.info(
             f"Token usage: Input={input_tokens}, Completion={completion_tokens}, "
+            f"Cached={cached_tokens}, "
             f"Cumulative Input={self.total_input_tokens}, Cumulative Completion={self.total_completion_tokens}, "
             f"Total={input_tokens + completion_tokens}, Cumulative Total={self.total_input_tokens + self.total_completion_tokens}"
         )
 
+    @property
+    def cache_hit_rate(self) -> float:
+        """Share of all input tokens served from the provider's prompt cache"""
+        return self.total_cached_tokens / max(self.total_input_tokens, 1)
+
+    def record_usage(self, usage: Usage) -> None:
+        """Account the usage of one request"""
+        self.last_usage = usage
+        log = _usage_log.get()
+        if log is not None:
+            log.append(usage)
+        self.update_token_count(
+            usage.prompt_tokens, usage.completion_tokens, usage.cached_tokens
+        )
+        if usage.estimated:
+            self.estimated_requests += 1
+
     def check_token_limit(self, input_tokens: int) -> bool:
         """Check if token limits are exceeded"""
         if self.max_input_tokens is not None:
@@ -261,9 +819,194 @@ class LLM:
 
         return "Token limit exceeded"
 
+    async def _create_completion(self, **params):
+        """Create a chat completion on the best endpoint, failing over on errors.
+
+        Transient errors (connection, timeout, rate limit, 5xx) move the request
+        to another endpoint right away; the caller's retry policy only applies
+        once every endpoint has failed. Streams count as outstanding on their
+        endpoint until they are consumed.
+        """
+        estimated_tokens = 0
+        if any(e.limiter.tokens_per_minute for e in self.endpoints.endpoints):
+            # Providers count the completion budget against tokens/min up front
+            estimated_tokens = (
+                self.count_message_tokens(params.get("messages") or [])
+                + self.count_tools_tokens(params.get("tools"))
+                + (
+                    params.get("max_tokens")
+                    or params.get("max_completion_tokens")
+                    or self.max_tokens
+                )
+            )
+
+        tried: Set[Endpoint] = set()
+        while True:
+            endpoint = self.endpoints.acquire(exclude=tried, tokens=estimated_tokens)
+            tried.add(endpoint)
+            try:
+                await endpoint.limiter.acquire(estimated_tokens)
+            except BaseException:
+                self.endpoints.release(endpoint)
+                raise
+            request = {**params, "model": endpoint.model}
+            if params.get("stream") and endpoint.stream_usage is not False:
+                # Ask for a final chunk with the token usage
+                request["stream_options"] = {"include_usage": True}
+            start = time.perf_counter()
+            try:
+                raw = await endpoint.client.chat.completions.with_raw_response.create(
+                    **request
+                )
+                endpoint.limiter.update_from_headers(raw.headers)
+                response = raw.parse()
+            except asyncio.CancelledError:
+                self.endpoints.release(endpoint)
+                raise
+            except BadRequestError as e:
+                self.endpoints.release(endpoint)
+                if "stream_options" in request and "stream_options" in str(e):
+                    logger.info(
+                        f"LLM endpoint {endpoint.base_url} does not support "
+                        "stream_options, estimating streaming usage locally"
+                    )
+                    endpoint.stream_usage = False
+                    tried.discard(endpoint)
+                    continue
+                self.endpoints.record(endpoint, time.perf_counter() - start, e)
+                raise
+            except Exception as e:
+                if isinstance(e, RateLimitError):
+                    endpoint.limiter.throttle(e.response.headers)
+                self.endpoints.record(endpoint, time.perf_counter() - start, e)
+                self.endpoints.release(endpoint)
+                if not is_transient_error(e) or len(tried) >= len(self.endpoints):
+                    raise
+                logger.warning(
+                    f"🔀 LLM endpoint {endpoint.base_url} failed ({e}), failing over"
+                )
+                continue
+
+            self.endpoints.record(endpoint, time.perf_counter() - start)
+            if not params.get("stream"):
+                self.endpoints.release(endpoint)
+                usage = getattr(response, "usage", None)
+                if usage and estimated_tokens:
+                    endpoint.limiter.adjust(usage.total_tokens - estimated_tokens)
+                return response
+            return self._release_after(response, endpoint, estimated_tokens)
+
+    async def _release_after(
+        self,
+        stream: AsyncStream[ChatCompletionChunk],
+        endpoint: Endpoint,
+        estimated_tokens: int = 0,
+    ) -> AsyncIterator[ChatCompletionChunk]:
+        try:
+            async for chunk in stream:
+                if chunk.usage is not None:
+                    endpoint.stream_usage = True
+                    if estimated_tokens:
+                        endpoint.limiter.adjust(
+                            chunk.usage.total_tokens - estimated_tokens
+                        )
+                yield chunk
+        finally:
+            self.endpoints.release(endpoint)
+            # Drop the connection of streams abandoned early, e.g. hedge losers
+            close = getattr(stream, "close", None)
+            if close is not None:
+                await close()
+
+    async def _first_chunk(self, params: dict):
+        """Open a stream and wait for its first chunk.
+
+        Returns:
+            (stream, first chunk or None if the stream was empty, TTFT in seconds)
+        """
+        start = time.perf_counter()
+        stream = await self._create_completion(**params)
+        try:
+            first = await stream.__anext__()
+        except StopAsyncIteration:
+            first = None
+        except BaseException:
+            await stream.aclose()
+            raise
+        return stream, first, time.perf_counter() - start
+
+    async def _open_stream(self, params: dict) -> AsyncIterator[ChatCompletionChunk]:
+        """Open a streaming completion, hedging it when the first chunk is late.
+
+        With `hedge_percentile` set, a duplicate request is sent if no chunk has
+        arrived after that percentile of recent TTFTs (at least
+        `hedge_min_delay`). It goes to the least loaded endpoint, usually
+        another one. The first stream to produce a chunk is used and the other
+        request is cancelled. At most `hedge_budget` of the requests are hedged.
+        """
+        stats = self.hedge_stats
+        stats.requests += 1
+        if self.hedge_percentile is None:
+            return await self._create_completion(**params)
+
+        primary = asyncio.create_task(self._first_chunk(params))
+        delay = stats.delay(self.hedge_percentile, self.hedge_min_delay)
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        over_budget = stats.hedged + 1 > self.hedge_budget * stats.requests
+        if done or over_budget:
+            stream, first, ttft = await primary
+            stats.ttfts.append(ttft)
+            return self._prepend(first, stream)
+
+        stats.hedged += 1
+        logger.info(f"🪁 No first token after {delay:.2f}s, hedging the request")
+        hedge = asyncio.create_task(self._first_chunk(params))
+        pending = {primary, hedge}
+        winner = error = None
+        while pending and winner is None:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.exception() is not None:
+                    error = task.exception()
+                elif winner is None:
+                    winner = task
+                else:
+                    # Both produced a chunk at once, close the extra stream
+                    await task.result()[0].aclose()
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        if winner is None:
+            raise error
+
+        stream, first, ttft = winner.result()
+        if winner is primary:
+            stats.ttfts.append(ttft)
+        else:
+            stats.hedge_wins += 1
+            stats.saved += stats.estimate_saved(delay + ttft)
+        return self._prepend(first, stream)
+
+    @staticmethod
+    async def _prepend(
+        first: Optional[ChatCompletionChunk], stream: AsyncIterator[ChatCompletionChunk]
+    ) -> AsyncIterator[ChatCompletionChunk]:
+        try:
+            if first is not None:
+                yield first
+            async for chunk in stream:
+                yield chunk
+        finally:
+            await stream.aclose()
+
     @staticmethod
     def format_messages(
-        messages: List[Union[dict, Message]], supports_images: bool = False
+        messages: List[Union[dict, Message]],
+        supports_images: bool = False,
+        max_images: Optional[int] = None,
+        older_image_size: Optional[int] = None,
     ) -> List[dict]:
         """
         Format messages for LLM by converting them to OpenAI message format.
@@ -271,6 +1014,9 @@ class LLM:
         Args:
             messages: List of messages that can be either dict or Message objects
             supports_images: Flag indicating if the target model supports image inputs
+            max_images: Number of most recent images sent at full size, None for all
+            older_image_size: Downscale older images to this size in pixels,
+                drop them if None
 
         Returns:
             List[dict]: List of formatted messages in OpenAI format
@@ -288,10 +1034,24 @@ class LLM:
             >>> formatted = LLM.format_messages(msgs)
         """
         formatted_messages = []
+        # Images of tool results, sent in a user message after the tool messages
+        # since tool message content can only be text
+        tool_images = []
+        # Images still to come, to tell recent images from older ones
+        remaining_images = sum(
+            1
+            for message in messages
+            if (
+                message.image_ref
+                if isinstance(message, (Message, MessageRecord))
+                else isinstance(message, dict)
+                and (message.get("image_ref") or message.get("base64_image"))
+            )
+        )
 
         for message in messages:
             # Convert Message objects to dictionaries
-            if isinstance(message, Message):
+            if isinstance(message, (Message, MessageRecord)):
                 message = message.to_dict()
 
             if isinstance(message, dict):
@@ -299,42 +1059,56 @@ class LLM:
                 if "role" not in message:
                     raise ValueError("Message dict must contain 'role' field")
 
-                # Process base64 images if present and model supports images
-                if supports_images and message.get("base64_image"):
-                    # Initialize or convert content to appropriate format
-                    if not message.get("content"):
-                        message["content"] = []
-                    elif isinstance(message["content"], str):
-                        message["content"] = [
-                            {"type": "text", "text": message["content"]}
-                        ]
-                    elif isinstance(message["content"], list):
-                        # Convert string items to proper text objects
-                        message["content"] = [
-                            (
-                                {"type": "text", "text": item}
-                                if isinstance(item, str)
-                                else item
-                            )
-                            for item in message["content"]
-                        ]
+                if tool_images and message["role"] != "tool":
+                    formatted_messages.append({"role": "user", "content": tool_images})
+                    tool_images = []
 
-                    # Add the image to content
-                    message["content"].append(
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{message['base64_image']}"
-                            },
-                        }
-                    )
-
-                    # Remove the base64_image field
-                    del message["base64_image"]
-                # If model doesn't support images but message has base64_image, handle gracefully
-                elif not supports_images and message.get("base64_image"):
-                    # Just remove the base64_image field and keep the text content
-                    del message["base64_image"]
+                image = message.pop("image_ref", None) or message.pop(
+                    "base64_image", None
+                )
+                image_url = None
+                if image and supports_images:
+                    remaining_images -= 1
+                    older = max_images is not None and remaining_images >= max_images
+                    max_size = older_image_size if older else None
+                    if not older or max_size is not None:
+                        # Base64 is only encoded here, from the shared image store
+                        image_url = image_store.data_url(
+                            image_store.put(image), max_size
+                        )
+                        if image_url is None:
+                            logger.warning("Image no longer in the image store")
+
+                # Images are left out for models without image support
+                if image_url:
+                    image_part = {"type": "image_url", "image_url": {"url": image_url}}
+                    if message["role"] == "tool":
+                        source = message.get("name") or "the tool"
+                        tool_images += [
+                            {"type": "text", "text": f"Image returned by {source}:"},
+                            image_part,
+                        ]
+                    else:
+                        # Initialize or convert content to appropriate format
+                        if not message.get("content"):
+                            message["content"] = []
+                        elif isinstance(message["content"], str):
+                            message["content"] = [
+                                {"type": "text", "text": message["content"]}
+                            ]
+                        elif isinstance(message["content"], list):
+                            # Convert string items to proper text objects
+                            message["content"] = [
+                                (
+                                    {"type": "text", "text": item}
+                                    if isinstance(item, str)
+                                    else item
+                                )
+                                for item in message["content"]
+                            ]
+
+                        # Add the image to content
+                        message["content"].append(image_part)
 
                 if "content" in message or "tool_calls" in message:
                     formatted_messages.append(message)
@@ -342,6 +1116,9 @@ class LLM:
             else:
                 raise TypeError(f"Unsupported message type: {type(message)}")
 
+        if tool_images:
+            formatted_messages.append({"role": "user", "content": tool_images})
+
         # Validate all messages have required fields
         for msg in formatted_messages:
             if msg["role"] not in ROLE_VALUES:
@@ -388,19 +1165,21 @@ class LLM:
             if isinstance(messages, str):
                 messages = [Message.user_message(messages)]
             if system_msgs:
-                system_msgs = self.format_messages(system_msgs)
-                messages = system_msgs + self.format_messages(messages)
+                system_msgs = self.format_messages(system_msgs, self.supports_images)
+                messages = system_msgs + self.format_messages(
+                    messages, self.supports_images, **self.image_policy
+                )
             else:
-                messages = self.format_messages(messages)
+                messages = self.format_messages(
+                    messages, self.supports_images, **self.image_policy
+                )
 
             # Validate tool_choice
             if tool_choice not in TOOL_CHOICE_VALUES:
                 raise ValueError(f"Invalid tool_choice: {tool_choice}")  # TODO:fix
 
             input_tokens = self.count_message_tokens(messages)
-            if tools:
-                for tool in tools:
-                    input_tokens += self.count_tokens(str(tool))
+            input_tokens += self.count_tools_tokens(tools)
             # Check if token limits are exceeded
             if not self.check_token_limit(input_tokens):
                 error_message = self.get_limit_error_message(input_tokens)
@@ -413,14 +1192,18 @@ class LLM:
                 tool_choice=tool_choice,
             )
 
-            # estimate completion tokens for streaming response
-            completion_tokens = self.count_tokens(completion.content)
-            # self.total_completion_tokens += completion_tokens
-            self.update_token_count(input_tokens, completion_tokens)
+            if completion.usage is None:
+                # The provider reported no usage, estimate it with the tokenizer
+                completion.usage = Usage(
+                    prompt_tokens=input_tokens,
+                    completion_tokens=self.count_tokens(completion.content)
+                    + self.token_counter.count_tool_calls(
+                        [call.model_dump() for call in completion.tool_calls or []]
+                    ),
+                    estimated=True,
+                )
+            self.record_usage(completion.usage)
             logger.info(f"LLM response: {completion.content}")
-            logger.info(
-                f"Estimated completion tokens for streaming response: {completion_tokens}"
-            )
             return completion
 
         except TokenLimitExceeded:
@@ -572,20 +1355,24 @@ class LLM:
 
             # Handle non-streaming request
             if not stream:
-                response = await self.client.chat.completions.create(**params)
+                response = await self._create_completion(**params)
 
                 if not response.choices or not response.choices[0].message.content:
                     raise ValueError("Empty or invalid response from LLM")
 
-                self.update_token_count(response.usage.prompt_tokens)
+                self.record_usage(Usage.from_openai(response.usage))
                 return response.choices[0].message.content
 
             # Handle streaming request
-            self.update_token_count(input_tokens)
-            response = await self.client.chat.completions.create(**params)
+            response = await self._create_completion(**params)
 
             collected_messages = []
+            usage = None
             async for chunk in response:
+                if chunk.usage is not None:
+                    usage = Usage.from_openai(chunk.usage)
+                if not chunk.choices:
+                    continue
                 chunk_message = chunk.choices[0].delta.content or ""
                 collected_messages.append(chunk_message)
                 print(chunk_message)
@@ -595,6 +1382,14 @@ class LLM:
 
             if not full_response:
                 raise ValueError("Empty response from streaming LLM")
+            self.record_usage(
+                usage
+                or Usage(
+                    prompt_tokens=input_tokens,
+                    completion_tokens=self.count_tokens(full_response),
+                    estimated=True,
+                )
+            )
 
             return full_response
 
@@ -662,21 +1457,20 @@ class LLM:
             if isinstance(messages, str):
                 messages = [Message.user_message(messages)]
             if system_msgs:
-                system_msgs = self.format_messages(system_msgs)
-                messages = system_msgs + self.format_messages(messages)
+                system_msgs = self.format_messages(system_msgs, self.supports_images)
+                messages = system_msgs + self.format_messages(
+                    messages, self.supports_images, **self.image_policy
+                )
             else:
-                messages = self.format_messages(messages)
+                messages = self.format_messages(
+                    messages, self.supports_images, **self.image_policy
+                )
 
             # Calculate input token count
             input_tokens = self.count_message_tokens(messages)
 
             # If there are tools, calculate token count for tool descriptions
-            tools_tokens = 0
-            if tools:
-                for tool in tools:
-                    tools_tokens += self.count_tokens(str(tool))
-
-            input_tokens += tools_tokens
+            input_tokens += self.count_tools_tokens(tools)
 
             # Check if token limits are exceeded
             if not self.check_token_limit(input_tokens):
@@ -702,9 +1496,7 @@ class LLM:
 
             # Non-streaming request
             params["stream"] = False
-            response: ChatCompletion = await self.client.chat.completions.create(
-                **params
-            )
+            response: ChatCompletion = await self._create_completion(**params)
 
             # Check if response is valid
             if not response.choices or not response.choices[0].message:
@@ -712,9 +1504,8 @@ class LLM:
                 # return None
 
             # Update token counts
-            self.update_token_count(
-                response.usage.prompt_tokens, response.usage.completion_tokens
-            )
+            if response.usage is not None:
+                self.record_usage(Usage.from_openai(response.usage))
 
             return response.choices[0].message
 
@@ -741,7 +1532,7 @@ class LLM:
         self,
         messages: List[Union[dict, Message]],
         **kwargs,
-    ) -> MessageChunk:
+    ) -> Message:
         try:
             params = {
                 "model": self.model,
@@ -749,33 +1540,30 @@ class LLM:
                 "stream": True,
                 **kwargs,
             }
-            response: AsyncStream[
-                ChatCompletionChunk
-            ] = await self.client.chat.completions.create(**params)
+            response = await self._open_stream(params)
 
-            completion = MessageChunk()
+            completion = StreamAccumulator()
             current_function = None
             async for chunk in response:
-                content = chunk.choices[0].delta.content or ""
-                # chunk_message = MessageChunk(content)
-                chunk_message = MessageChunk(
-                    content=content,
-                    tool_calls=chunk.choices[0].delta.tool_calls,
-                )
-                if content in ["", None] and chunk.choices[0].delta.tool_calls:
-                    if chunk.choices[0].delta.tool_calls[0].function.name:
-                        current_function = (
-                            chunk.choices[0].delta.tool_calls[0].function.name
-                        )
-                    content = chunk.choices[0].delta.tool_calls[0].function.arguments
-                    payload = Payload(content, type="toolcall", name=current_function)
-                    payload.write_structed_content()
+                if chunk.usage is not None:
+                    completion.usage = Usage.from_openai(chunk.usage)
+                if not chunk.choices:
+                    # The usage chunk that ends the stream has no choices
+                    continue
+                delta = chunk.choices[0].delta
+                content = delta.content or ""
+                completion.add(content, delta.tool_calls)
+                if content in ["", None] and delta.tool_calls:
+                    if delta.tool_calls[0].function.name:
+                        current_function = delta.tool_calls[0].function.name
+                    content = delta.tool_calls[0].function.arguments
+                    Payload.write_message(
+                        content, type="toolcall", name=current_function
+                    )
                 else:
                     current_function = None
-                    payload = Payload(content)
-                    payload.write_structed_content()
-                completion += chunk_message
-            return completion
+                    Payload.write_message(content)
+            return completion.to_message()
 
         except Exception:
             logger.exception(f"Unexpected error in astream")
@@ -793,9 +1581,7 @@ class LLM:
                 "stream": False,
                 **kwargs,
             }
-            response: ChatCompletion = await self.client.chat.completions.create(
-                **params
-            )
+            response: ChatCompletion = await self._create_completion(**params)
             message = response.choices[0].message
             if not message:
                 raise ValueError("Empty or invalid response from LLM")
@@ -803,12 +1589,15 @@ class LLM:
             payload = Payload(content)
             payload.write_structed_content()
             if message.tool_calls:
-                return Message.from_tool_calls(
+                result = Message.from_tool_calls(
                     content=content,
                     tool_calls=message.tool_calls,
                 )
             else:
-                return Message.assistant_message(content)
+                result = Message.assistant_message(content)
+            if response.usage is not None:
+                result.usage = Usage.from_openai(response.usage)
+            return result
         except Exception:
             logger.exception(f"Unexpected error in agenerate")
             raise
@@ -1,10 +1,14 @@
+from contextvars import ContextVar
+from dataclasses import dataclass
 from enum import Enum
-from typing import Any, List, Literal, Optional, Union
+from typing import Any, Dict, List, Literal, Optional, Tuple, Union
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr, field_validator
 import sys
 import json
 
+from app.image_store import image_store
+
 
 class Role(str, Enum):
     """Message role options"""
@@ -54,6 +58,30 @@ class ToolCall(BaseModel):
     function: Optional[Function] = Field(default=None)
 
 
+class Usage(BaseModel):
+    """Token usage of a single LLM request"""
+
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    # True when counted locally because the provider reported no usage
+    estimated: bool = False
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    @classmethod
+    def from_openai(cls, usage: Any) -> "Usage":
+        """Create from an OpenAI `CompletionUsage`"""
+        details = getattr(usage, "prompt_tokens_details", None)
+        return cls(
+            prompt_tokens=usage.prompt_tokens or 0,
+            completion_tokens=usage.completion_tokens or 0,
+            cached_tokens=(getattr(details, "cached_tokens", None) or 0),
+        )
+
+
 class Message(BaseModel):
     """Represents a chat message in the conversation"""
 
@@ -62,7 +90,17 @@ class Message(BaseModel):
     tool_calls: Optional[List[ToolCall]] = Field(default=None)
     name: Optional[str] = Field(default=None)
     tool_call_id: Optional[str] = Field(default=None)
-    base64_image: Optional[str] = Field(default=None)
+    base64_image: Optional[str] = Field(default=None, exclude=True)
+    # Reference into the image store, set from base64_image on creation
+    image_ref: Optional[str] = Field(default=None)
+    # Token usage of the request that produced this message
+    usage: Optional[Usage] = Field(default=None, exclude=True)
+
+    def model_post_init(self, __context: Any) -> None:
+        # Keep the image bytes once in the store instead of inline base64
+        if self.base64_image:
+            self.image_ref = image_store.put(self.base64_image)
+            self.base64_image = None
 
     def __add__(self, other) -> List["Message"]:
         """支持 Message + list 或 Message + Message 的操作"""
@@ -86,18 +124,7 @@ class Message(BaseModel):
 
     def to_dict(self) -> dict:
         """Convert message to dictionary format"""
-        message = {"role": self.role}
-        if self.content is not None:
-            message["content"] = self.content
-        if self.tool_calls is not None:
-            message["tool_calls"] = [tool_call.dict() for tool_call in self.tool_calls]
-        if self.name is not None:
-            message["name"] = self.name
-        if self.tool_call_id is not None:
-            message["tool_call_id"] = self.tool_call_id
-        if self.base64_image is not None:
-            message["base64_image"] = self.base64_image
-        return message
+        return MessageRecord.from_message(self).to_dict()
 
     @classmethod
     def user_message(
@@ -165,67 +192,185 @@ class Message(BaseModel):
         )
 
 
-class MessageChunk(Message):
-    type: str = Literal["message", "toolcall"]
+@dataclass(frozen=True, slots=True)
+class FunctionRecord:
+    name: Optional[str] = None
+    arguments: Optional[str] = None
 
-    def __init__(self, content="", **kwargs):
-        super().__init__(role=Role.ASSISTANT)
-        self.content = content
-        self.type = "message"
-        self.tool_calls = kwargs.get("tool_calls", None)
 
-    def __add__(self, other) -> List["MessageChunk"]:
-        if not isinstance(other, MessageChunk):
-            raise TypeError(
-                f"unsupported operand type(s) for +: '{type(self).__name__}' and '{type(other).__name__}'"
+@dataclass(frozen=True, slots=True)
+class ToolCallRecord:
+    id: Optional[str]
+    function: FunctionRecord
+    type: str = "function"
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "type": self.type,
+            "function": {
+                "name": self.function.name,
+                "arguments": self.function.arguments,
+            },
+        }
+
+
+@dataclass(frozen=True, slots=True)
+class MessageRecord:
+    """Immutable message as kept in `Memory`.
+
+    A slotted dataclass without validation, so a long conversation holds no
+    per-message pydantic state. `Message` stays the type agents create and the
+    LLM client returns; it becomes a record once, when added to memory.
+    """
+
+    role: str
+    content: Optional[str] = None
+    tool_calls: Optional[Tuple[ToolCallRecord, ...]] = None
+    name: Optional[str] = None
+    tool_call_id: Optional[str] = None
+    image_ref: Optional[str] = None
+
+    @classmethod
+    def from_message(cls, message: Union[Message, "MessageRecord"]) -> "MessageRecord":
+        if isinstance(message, MessageRecord):
+            return message
+        tool_calls = None
+        if message.tool_calls:
+            tool_calls = tuple(
+                ToolCallRecord(
+                    call.id,
+                    (
+                        FunctionRecord(call.function.name, call.function.arguments)
+                        if call.function
+                        else FunctionRecord()
+                    ),
+                    call.type,
+                )
+                for call in message.tool_calls
             )
-        new_content = self.content + other.content
-        if other.tool_calls is None:
-            new_tool_calls = self.tool_calls
-        else:
-            if self.tool_calls is None:
-                new_tool_calls = []
-            else:
-                new_tool_calls = list(self.tool_calls)
-            for delta in other.tool_calls:
-                i = delta.index
-                while len(new_tool_calls) <= i:
-                    new_tool_calls.append(None)
-                if new_tool_calls[i] is None:
-                    new_tool_calls[i] = ToolCall(
-                        index=delta.index,
-                        id=delta.id,
-                        type=delta.type,
-                        function=delta.function.model_dump(),
-                    )
-                else:
-                    existing = new_tool_calls[i]
-                    if delta.id is not None:
-                        existing.id = delta.id
-                    if delta.type is not None:
-                        existing.type = delta.type
-                    if delta.function is not None:
-                        if delta.function.name is not None:
-                            existing.function.name = delta.function.name
-                        if delta.function.arguments is not None:
-                            existing.function.arguments += delta.function.arguments
-        return self.__class__(content=new_content, tool_calls=new_tool_calls)
+        return cls(
+            message.role,
+            message.content,
+            tool_calls,
+            message.name,
+            message.tool_call_id,
+            message.image_ref,
+        )
+
+    def to_dict(self) -> dict:
+        """Convert message to dictionary format"""
+        message = {"role": self.role}
+        if self.content is not None:
+            message["content"] = self.content
+        if self.tool_calls is not None:
+            message["tool_calls"] = [call.to_dict() for call in self.tool_calls]
+        if self.name is not None:
+            message["name"] = self.name
+        if self.tool_call_id is not None:
+            message["tool_call_id"] = self.tool_call_id
+        if self.image_ref is not None:
+            message["image_ref"] = self.image_ref
+        return message
+
+    @property
+    def base64_image(self) -> None:
+        """Images are kept in the image store, see `image_ref`."""
+        return None
+
+    def to_message(self) -> Message:
+        return Message(**self.to_dict())
+
+
+class StreamAccumulator:
+    """Assemble a streamed completion from its deltas.
+
+    Content pieces and tool call argument fragments are collected in lists
+    and joined once in `to_message`, so a delta costs a few list appends
+    instead of a new model and a copy of the text so far.
+    """
+
+    __slots__ = ("_content", "_tool_calls", "usage")
+
+    def __init__(self):
+        self._content: List[str] = []
+        # index -> [id, type, name, argument fragments]
+        self._tool_calls: Dict[int, list] = {}
+        self.usage: Optional[Usage] = None
+
+    def add(self, content: Optional[str], tool_calls: Optional[List[Any]] = None):
+        """Add a delta, `tool_calls` being the delta's tool call fragments."""
+        if content:
+            self._content.append(content)
+        for delta in tool_calls or ():
+            call = self._tool_calls.get(delta.index)
+            if call is None:
+                call = self._tool_calls[delta.index] = [None, "function", None, []]
+            if delta.id is not None:
+                call[0] = delta.id
+            if delta.type is not None:
+                call[1] = delta.type
+            function = delta.function
+            if function is not None:
+                if function.name is not None:
+                    call[2] = function.name
+                if function.arguments is not None:
+                    call[3].append(function.arguments)
+
+    def to_message(self) -> Message:
+        tool_calls = [
+            ToolCall(
+                index=index,
+                id=call_id,
+                type=call_type,
+                function=Function(name=name, arguments="".join(arguments)),
+            )
+            for index, (call_id, call_type, name, arguments) in sorted(
+                self._tool_calls.items()
+            )
+        ]
+        return Message(
+            role=Role.ASSISTANT,
+            content="".join(self._content),
+            tool_calls=tool_calls or None,
+            usage=self.usage,
+        )
 
 
 class Memory(BaseModel):
-    messages: List[Message] = Field(default_factory=list)
+    messages: List[MessageRecord] = Field(default_factory=list)
     max_messages: int = Field(default=100)
+    # Append-only log the messages are persisted to, see app.session_store
+    _log: Optional[Any] = PrivateAttr(default=None)
 
-    def add_message(self, message: Message) -> None:
+    @field_validator("messages", mode="before")
+    @classmethod
+    def _to_records(cls, messages: List[Any]) -> List[Any]:
+        return [
+            MessageRecord.from_message(m) if isinstance(m, Message) else m
+            for m in messages
+        ]
+
+    def persist_to(self, log: Any) -> None:
+        """Append every message added from now on to `log`."""
+        self._log = log
+
+    def add_message(self, message: Union[Message, MessageRecord]) -> None:
         """Add a message to memory"""
-        self.messages.append(message)
+        self.messages.append(MessageRecord.from_message(message))
+        if self._log is not None:
+            self._log.append(self.messages)
         # Optional: Implement message limit
         if len(self.messages) > self.max_messages:
             self.messages = self.messages[-self.max_messages :]
 
-    def add_messages(self, messages: List[Message]) -> None:
+    def add_messages(self, messages: List[Union[Message, MessageRecord]]) -> None:
         """Add multiple messages to memory"""
-        self.messages.extend(messages)
+        start = len(self.messages)
+        self.messages.extend(MessageRecord.from_message(m) for m in messages)
+        if self._log is not None:
+            for end in range(start + 1, len(self.messages) + 1):
+                self._log.append(self.messages, end)
         # Optional: Implement message limit
         if len(self.messages) > self.max_messages:
             self.messages = self.messages[-self.max_messages :]
@@ -233,8 +378,10 @@ class Memory(BaseModel):
     def clear(self) -> None:
         """Clear all messages"""
         self.messages.clear()
+        if self._log is not None:
+            self._log.reset([])
 
-    def get_recent_messages(self, n: int) -> List[Message]:
+    def get_recent_messages(self, n: int) -> List[MessageRecord]:
         """Get n most recent messages"""
         return self.messages[-n:]
 
@@ -243,6 +390,12 @@ class Memory(BaseModel):
         return [msg.to_dict() for msg in self.messages]
 
 
+# Chat session the current task serves, tags the frames written to the main process
+current_session_id: ContextVar[Optional[str]] = ContextVar(
+    "current_session_id", default=None
+)
+
+
 class Payload(BaseModel):
     content: str
     type: str = Literal[
@@ -261,10 +414,13 @@ class Payload(BaseModel):
         super().__init__(content=content, type=type, name=name)
 
     def model_dump(self):
+        data = {"type": self.type, "content": self.content}
         if self.name is not None:
-            return {"type": self.type, "content": self.content, "name": self.name}
-        else:
-            return {"type": self.type, "content": self.content}
+            data["name"] = self.name
+        session_id = current_session_id.get()
+        if session_id is not None:
+            data["session_id"] = session_id
+        return data
 
     def write_structed_content(self):
         """
@@ -274,8 +430,14 @@ class Payload(BaseModel):
         sys.stdout.flush()
 
     @staticmethod
-    def write_message(content: str, type: str = "message"):
+    def write_message(content: str, type: str = "message", name: Optional[str] = None):
+        """Write a frame without building a model, for streamed deltas."""
         data = {"type": type, "content": content}
+        if name is not None:
+            data["name"] = name
+        session_id = current_session_id.get()
+        if session_id is not None:
+            data["session_id"] = session_id
         json.dump(data, sys.stdout)
         sys.stdout.flush()
 
@@ -0,0 +1,331 @@
+"""Append-only persistence of conversation memory.
+
+Every message added to a `Memory` is appended to the session's log as one
+binary record: a length, a CRC32 and the message fields as length-prefixed
+UTF-8 strings. Appends are buffered and fsynced in batches, every
+`sync_every` records or `sync_interval` seconds, and at the end of each turn.
+Every `snapshot_every` records the whole memory is written to a snapshot and
+the log restarts in a new segment, so loading a session reads one snapshot
+and a short log tail. A record cut short by a crash ends the replay.
+
+Images are kept once per store in `images/`, named by their image store
+reference, and put back into the image store on load.
+
+    <root>/<session id>/snapshot.bin
+    <root>/<session id>/log-000001.bin
+    <root>/images/<sha256>
+"""
+
+import json
+import os
+import re
+import struct
+import time
+import zlib
+from pathlib import Path
+from typing import BinaryIO, Iterator, List, Optional
+
+from app.image_store import REF_PREFIX, image_store
+from app.logger import logger
+from app.schema import (
+    ROLE_VALUES,
+    FunctionRecord,
+    MessageRecord,
+    ToolCallRecord,
+)
+
+SNAPSHOT_MAGIC = b"SLS1"
+# Record header: payload length, CRC32 of the payload
+_HEADER = struct.Struct("<II")
+_LENGTH = struct.Struct("<I")
+_NONE = 0xFFFFFFFF
+_SNAPSHOT_HEADER = struct.Struct("<4sII")  # magic, next segment, message count
+
+
+def encode_message(message: MessageRecord) -> bytes:
+    """Role index followed by content, name, tool_call_id, image_ref, tool_calls."""
+    tool_calls = (
+        json.dumps(
+            [call.to_dict() for call in message.tool_calls], separators=(",", ":")
+        )
+        if message.tool_calls
+        else None
+    )
+    parts = [bytes((ROLE_VALUES.index(message.role),))]
+    for value in (
+        message.content,
+        message.name,
+        message.tool_call_id,
+        message.image_ref,
+        tool_calls,
+    ):
+        if value is None:
+            parts.append(_LENGTH.pack(_NONE))
+        else:
+            data = value.encode("utf-8")
+            parts.append(_LENGTH.pack(len(data)))
+            parts.append(data)
+    return b"".join(parts)
+
+
+def decode_message(data: bytes) -> MessageRecord:
+    values = []
+    offset = 1
+    for _ in range(5):
+        (length,) = _LENGTH.unpack_from(data, offset)
+        offset += _LENGTH.size
+        if length == _NONE:
+            values.append(None)
+        else:
+            values.append(data[offset : offset + length].decode("utf-8"))
+            offset += length
+    content, name, tool_call_id, image_ref, tool_calls = values
+    if tool_calls:
+        tool_calls = tuple(
+            ToolCallRecord(
+                call.get("id"),
+                FunctionRecord(**call.get("function") or {}),
+                call.get("type") or "function",
+            )
+            for call in json.loads(tool_calls)
+        )
+    return MessageRecord(
+        ROLE_VALUES[data[0]], content, tool_calls, name, tool_call_id, image_ref
+    )
+
+
+def encode_record(payload: bytes) -> bytes:
+    return _HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def read_records(data: bytes, offset: int = 0) -> Iterator[bytes]:
+    """Payloads of the complete, intact records in `data`."""
+    while offset + _HEADER.size <= len(data):
+        length, crc = _HEADER.unpack_from(data, offset)
+        start = offset + _HEADER.size
+        payload = data[start : start + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            logger.warning("Session log ends with a torn record, ignoring the rest")
+            return
+        yield payload
+        offset = start + length
+
+
+class SessionLog:
+    def __init__(
+        self,
+        store: "SessionStore",
+        session_id: str,
+        sync_every: int = 32,
+        sync_interval: float = 0.05,
+        snapshot_every: int = 256,
+    ):
+        """
+        Args:
+            store: Store the log belongs to
+            session_id: Session the log persists
+            sync_every: Records buffered at most before an fsync
+            sync_interval: Seconds a record stays unsynced at most, checked on append
+            snapshot_every: Records appended between snapshots
+        """
+        self.store = store
+        self.session_id = session_id
+        self.path = store.session_path(session_id)
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.snapshot_every = snapshot_every
+        self.segment = 0
+        self._file: Optional[BinaryIO] = None
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._since_snapshot = 0
+        # A new log replaces what was persisted for the session on first write
+        self._started = False
+
+        self.appended = 0
+        self.syncs = 0
+        self.snapshots = 0
+
+    def _segment_path(self, segment: int) -> Path:
+        return self.path / f"log-{segment:06d}.bin"
+
+    def append(self, messages: List[MessageRecord], end: Optional[int] = None) -> None:
+        """Persist `messages[end - 1]`, just added to memory, by default the last.
+
+        `messages[:end]` is the memory after it; it is only copied for the first
+        record of the log and for snapshots.
+        """
+        if end is None:
+            end = len(messages)
+        message = messages[end - 1]
+        if not self._started:
+            self.reset(messages[: end - 1])
+        if message.image_ref:
+            self.store.save_image(message.image_ref)
+        if self._file is None:
+            self._file = open(self._segment_path(self.segment), "ab")
+        self._file.write(encode_record(encode_message(message)))
+        self.appended += 1
+        self._unsynced += 1
+        self._since_snapshot += 1
+        if self._since_snapshot >= self.snapshot_every:
+            self.reset(messages[:end])
+        elif (
+            self._unsynced >= self.sync_every
+            or time.monotonic() - self._last_sync >= self.sync_interval
+        ):
+            self.sync()
+
+    def attach(self) -> None:
+        """Continue the session's persisted log instead of replacing it.
+
+        Appends go to a new segment after the existing ones, so a record
+        torn by a crash at the end of the last segment stays the end of it.
+        """
+        snapshot = _read_snapshot_segment(self.path)
+        segments = [
+            path
+            for path in self.path.glob("log-*.bin")
+            if _segment_number(path) >= snapshot
+        ]
+        self.segment = max(map(_segment_number, segments), default=snapshot) + 1
+        self._since_snapshot = sum(
+            1 for path in segments for _ in read_records(path.read_bytes())
+        )
+        self._started = True
+
+    def sync(self) -> None:
+        """Flush buffered records to disk."""
+        if self._file is not None and self._unsynced:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.syncs += 1
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def reset(self, messages: List[MessageRecord]) -> None:
+        """Snapshot `messages` as the session's whole state and start a new segment."""
+        self.close()
+        self.path.mkdir(parents=True, exist_ok=True)
+        if not self._started:
+            # Number past the segments of an earlier log of this session
+            self.segment = max(
+                (_segment_number(path) for path in self.path.glob("log-*.bin")),
+                default=0,
+            )
+            if (self.path / "snapshot.bin").exists():
+                self.segment = max(self.segment, _read_snapshot_segment(self.path))
+        self.segment += 1
+        body = b"".join(encode_record(encode_message(m)) for m in messages)
+        header = _SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, self.segment, len(messages))
+        for message in messages:
+            if message.image_ref:
+                self.store.save_image(message.image_ref)
+        _write_atomic(self.path / "snapshot.bin", header + body)
+        # Segments before the snapshot are no longer needed
+        for path in self.path.glob("log-*.bin"):
+            if _segment_number(path) < self.segment:
+                path.unlink()
+        self._started = True
+        self._since_snapshot = 0
+        self.snapshots += 1
+
+    def close(self) -> None:
+        self.sync()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class SessionStore:
+    def __init__(self, root: Path, **log_options):
+        """
+        Args:
+            root: Directory holding one subdirectory per session
+            **log_options: Passed to every `SessionLog`
+        """
+        self.root = Path(root)
+        self.images_path = self.root / "images"
+        self.log_options = log_options
+
+    def session_path(self, session_id: str) -> Path:
+        return self.root / re.sub(r"[^\w.-]", "_", session_id or "default")
+
+    def log(self, session_id: str) -> SessionLog:
+        return SessionLog(self, session_id, **self.log_options)
+
+    def exists(self, session_id: str) -> bool:
+        return (self.session_path(session_id) / "snapshot.bin").exists()
+
+    def load(
+        self, session_id: str, max_messages: Optional[int] = None
+    ) -> Optional[List[MessageRecord]]:
+        """Rebuild a session's messages from its snapshot and log tail.
+
+        Returns None if nothing was persisted for the session.
+        """
+        path = self.session_path(session_id)
+        try:
+            data = (path / "snapshot.bin").read_bytes()
+        except FileNotFoundError:
+            return None
+        magic, segment, _ = _SNAPSHOT_HEADER.unpack_from(data)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"Not a session snapshot: {path / 'snapshot.bin'}")
+        payloads = list(read_records(data, _SNAPSHOT_HEADER.size))
+        segments = sorted(
+            (number, log_path)
+            for log_path in path.glob("log-*.bin")
+            if (number := _segment_number(log_path)) >= segment
+        )
+        for _, log_path in segments:
+            payloads.extend(read_records(log_path.read_bytes()))
+        if max_messages is not None:
+            payloads = payloads[-max_messages:]
+        messages = [decode_message(payload) for payload in payloads]
+        # A tool result whose assistant tool call was cut off is rejected by the API
+        start = 0
+        while start < len(messages) and messages[start].role == "tool":
+            start += 1
+        messages = messages[start:]
+        for message in messages:
+            if message.image_ref and image_store.get(message.image_ref) is None:
+                self.restore_image(message.image_ref)
+        return messages
+
+    def _image_path(self, ref: str) -> Path:
+        return self.images_path / ref[len(REF_PREFIX) :]
+
+    def save_image(self, ref: str) -> None:
+        path = self._image_path(ref)
+        if path.exists():
+            return
+        data = image_store.get(ref)
+        if data is None:
+            return
+        self.images_path.mkdir(parents=True, exist_ok=True)
+        _write_atomic(path, data)
+
+    def restore_image(self, ref: str) -> None:
+        try:
+            image_store.put(self._image_path(ref).read_bytes())
+        except FileNotFoundError:
+            logger.warning(f"Image {ref[:19]} of a persisted session is missing")
+
+
+def _segment_number(path: Path) -> int:
+    return int(path.stem.partition("-")[2])
+
+
+def _read_snapshot_segment(path: Path) -> int:
+    with open(path / "snapshot.bin", "rb") as f:
+        return _SNAPSHOT_HEADER.unpack(f.read(_SNAPSHOT_HEADER.size))[1]
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
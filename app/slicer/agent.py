@@ -1,13 +1,18 @@
 import asyncio
 import json
 import sys
-from typing import Literal
+from typing import Literal, Optional
 
+from mcp.server.fastmcp import FastMCP
 from pydantic import BaseModel
 
 from app.agent import BaseAgent, MCPAgent, ToolCallAgent
+from app.config import WORKSPACE_ROOT
 from app.logger import logger
 from app.schema import Payload
+from app.session_store import SessionStore
+from app.slicer.sessions import SessionHost, StdinReader
+from app.tool import ToolCollection, VolumeAnalysis
 
 SLICER_SYSTEM_PROMPT = (
     "You are SlicerAgent, an all-capable AI assistant for 3D Slicer, aimed at solving any task presented by the user. "
@@ -31,6 +36,7 @@ class SlicerMessageHandler(BaseModel):
 
     Methods:
         load_message_from_main_process() -> dict: Reads a line from stdin and parses it as JSON.
+        parse_message(line: str) -> dict: Parses a line from the main process as JSON.
         write_message_to_main_process(message: str, type: str = "message") -> None: Writes a message to the main process.
     """
 
@@ -38,7 +44,11 @@ class SlicerMessageHandler(BaseModel):
         """
         Read a line from stdin and parse it as JSON.
         """
-        line = sys.stdin.readline().strip()
+        return self.parse_message(sys.stdin.readline())
+
+    @staticmethod
+    def parse_message(line: str) -> Optional[dict]:
+        line = line.strip()
         if not line:
             return None
         try:
@@ -69,34 +79,42 @@ class SlicerBaseAgent(SlicerMessageHandler, BaseAgent):
     max_observe: int = 10000
     max_steps: int = 20
     streaming_output: bool = True
+    stable_prefix: bool = True
+
+    # Sessions served by one process, see `app.slicer.sessions`
+    max_sessions: int = 32
+    max_active_sessions: int = 4
+    max_pending_per_session: int = 8
+    # Where session memories are persisted for "resume", None to keep them in memory
+    session_dir: Optional[str] = str(WORKSPACE_ROOT / "sessions")
+    # Shared by the sessions of a process, bounds the concurrent agent steps
+    step_limiter: Optional[asyncio.Semaphore] = None
+
+    async def step(self) -> str:
+        if self.step_limiter is None:
+            return await super().step()
+        async with self.step_limiter:
+            return await super().step()
 
     async def run_loop(self):
-        while True:
-            try:
-                data = self.load_message_from_main_process()
-                if data is None:
-                    continue
-                if data.get("type") == "message":
-                    question = data.get("content")
-                    if question:
-                        await self.run(question)
-                    else:
-                        self.write_message_to_main_process(
-                            "No content in message", type="info"
-                        )
-                elif data.get("type") == "command":
-                    if data.get("content") == "exit":
-                        break
-                    elif data.get("content") == "clear":
-                        self.current_step = 0
-                        self.memory.clear()
-                        self.write_message_to_main_process(
-                            "Memory cleared", type="info"
-                        )
-            except Exception as e:
-                self.write_message_to_main_process(
-                    f"Error in run_loop: {e}", type="error"
-                )
+        """Serve the chat sessions of the main process until exit or end of input.
+
+        Every frame may carry a `session_id`; this agent is the template the
+        sessions are copied from and keeps no conversation of its own.
+        """
+        reader = StdinReader()
+
+        async def read_message() -> Optional[dict]:
+            return self.parse_message(await reader.readline())
+
+        host = SessionHost(
+            self,
+            max_sessions=self.max_sessions,
+            max_active=self.max_active_sessions,
+            max_pending=self.max_pending_per_session,
+            store=SessionStore(self.session_dir) if self.session_dir else None,
+        )
+        await host.serve(read_message)
 
 
 class SlicerAgent(SlicerBaseAgent, ToolCallAgent):
@@ -106,12 +124,32 @@ class SlicerAgent(SlicerBaseAgent, ToolCallAgent):
 class SlicerAgentWithMCP(SlicerBaseAgent, MCPAgent):
     """A versatile general-purpose agent for 3D Slicer."""
 
-    connection_type: Literal["stdio", "sse"] = "sse"
+    connection_type: Literal["stdio", "sse", "memory"] = "sse"
+    server_url: str = "http://localhost:6666/sse"
+    # Set when the MCP server lives in this process, tools are then called in-memory
+    mcp_server: Optional[FastMCP] = None
 
-    async def run_loop(self):
-        await self.initialize(
-            connection_type="sse", server_url="http://localhost:6666/sse"
+    def _report_tool_progress(
+        self, tool_name: str, progress: float, total: Optional[float]
+    ) -> None:
+        """Forward MCP tool progress to the main process as info frames."""
+        percent = f"{progress / total:.0%}" if total else f"{progress:g}"
+        self.write_message_to_main_process(f"{tool_name}: {percent}", type="info")
+
+    async def connect(self) -> None:
+        """Connect to the MCP server and add the tools that build on it."""
+        if self.mcp_server is not None:
+            await self.initialize(connection_type="memory", server=self.mcp_server)
+        else:
+            await self.initialize(connection_type="sse", server_url=self.server_url)
+        # Analysis tools that map volumes exported by the MCP server
+        self.available_tools = ToolCollection(
+            *self.available_tools.tools, VolumeAnalysis(mcp_clients=self.mcp_clients)
         )
+
+    async def run_loop(self):
+        self.mcp_clients.on_progress = self._report_tool_progress
+        await self.connect()
         await super().run_loop()
 
 
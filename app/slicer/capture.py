@@ -0,0 +1,126 @@
+"""Downsampled screenshots of Slicer views for multimodal agent steps.
+
+The view is grabbed on the main thread; scaling and encoding work on the
+thread-safe `QImage` and run in the calling worker thread. Encoded images are
+cached by view, size, format and scene index version, so repeated captures of
+an unchanged scene skip the render and encode.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Literal, Tuple
+
+View = Literal["3D", "Red", "Yellow", "Green", "layout"]
+ImageFormat = Literal["jpeg", "webp", "png"]
+
+# Qt image writer format names
+_QT_FORMATS = {"jpeg": "JPG", "webp": "WEBP", "png": "PNG"}
+
+
+def _grab(view: str):
+    """Render and grab a view as a QImage. Runs on the main thread."""
+    import ctk
+    import slicer
+
+    layout_manager = slicer.app.layoutManager()
+    if view == "layout":
+        widget = layout_manager.viewport()
+    elif view == "3D":
+        widget = layout_manager.threeDWidget(0).threeDView()
+        widget.forceRender()
+    else:
+        slice_widget = layout_manager.sliceWidget(view)
+        if slice_widget is None:
+            raise ValueError(f"Slice view {view} is not in the current layout")
+        widget = slice_widget.sliceView()
+        widget.forceRender()
+    return ctk.ctkWidgetsUtils.grabWidget(widget)
+
+
+class ViewCapture:
+    def __init__(self, max_entries: int = 32):
+        self.max_entries = max_entries
+        self._cache: "OrderedDict[Tuple, Tuple[bytes, int, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._writable_formats = None
+        self.hits = 0
+        self.misses = 0
+
+    def _supported(self, image_format: str) -> bool:
+        import qt
+
+        if self._writable_formats is None:
+            self._writable_formats = {
+                bytes(name).decode().upper()
+                for name in qt.QImageWriter.supportedImageFormats()
+            }
+        return _QT_FORMATS[image_format] in self._writable_formats
+
+    def capture(
+        self,
+        view: View,
+        max_size: int,
+        image_format: ImageFormat,
+        quality: int,
+        version: int,
+        call_on_main: Callable[[Callable], Any] = lambda fn: fn(),
+    ) -> Dict[str, Any]:
+        """Capture `view` scaled to fit `max_size` pixels and encode it.
+
+        Args:
+            view: View to capture, "layout" for the whole view layout
+            max_size: Maximum width and height of the image in pixels
+            image_format: Encoding, WebP falls back to JPEG when Qt cannot write it
+            quality: Encoder quality (0-100), ignored for PNG
+            version: Scene index version the cached image must match
+            call_on_main: Runs a callable on the main thread and returns its result
+
+        Returns:
+            {data, format, width, height, cached}
+        """
+        if image_format == "webp" and not self._supported("webp"):
+            image_format = "jpeg"
+        key = (view, max_size, image_format, quality, version)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached:
+                self._cache.move_to_end(key)
+                self.hits += 1
+        if cached:
+            data, width, height = cached
+            return {
+                "data": data,
+                "format": image_format,
+                "width": width,
+                "height": height,
+                "cached": True,
+            }
+
+        import qt
+
+        image = call_on_main(lambda: _grab(view))
+        if image.width() > max_size or image.height() > max_size:
+            image = image.scaled(
+                max_size, max_size, qt.Qt.KeepAspectRatio, qt.Qt.SmoothTransformation
+            )
+        if image_format != "png":
+            # No alpha channel in JPEG
+            image = image.convertToFormat(qt.QImage.Format_RGB888)
+        buffer = qt.QBuffer()
+        buffer.open(qt.QIODevice.WriteOnly)
+        image.save(buffer, _QT_FORMATS[image_format], quality)
+        data = bytes(buffer.data().data())
+        width, height = image.width(), image.height()
+
+        with self._lock:
+            self.misses += 1
+            self._cache[key] = (data, width, height)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return {
+            "data": data,
+            "format": image_format,
+            "width": width,
+            "height": height,
+            "cached": False,
+        }
@@ -0,0 +1,232 @@
+"""Persistent index of DICOM files grouped by series.
+
+Headers are read with pydicom (pixel data skipped, only the tags needed to
+group and order series) in a pool of spawned processes, or of threads inside
+Slicer, and stored in SQLite keyed by file path with its mtime and size.
+Rescanning a folder only reads files that are new or changed since the last
+scan and drops rows of deleted files. The database is created on the first scan.
+"""
+
+import multiprocessing
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from app.logger import logger
+
+# Tags read from each file, in the column order of the `files` table
+HEADER_TAGS = (
+    "SeriesInstanceUID",
+    "StudyInstanceUID",
+    "PatientID",
+    "PatientName",
+    "StudyDate",
+    "Modality",
+    "SeriesDescription",
+    "SeriesNumber",
+    "InstanceNumber",
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    series_uid TEXT,
+    study_uid TEXT,
+    patient_id TEXT,
+    patient_name TEXT,
+    study_date TEXT,
+    modality TEXT,
+    series_description TEXT,
+    series_number INTEGER,
+    instance_number INTEGER
+);
+CREATE INDEX IF NOT EXISTS files_series ON files (series_uid);
+"""
+
+CHUNK_SIZE = 256
+
+
+def read_headers(paths: List[str]) -> List[Tuple[str, Tuple[Any, ...]]]:
+    """Read the indexed tags of several files. Runs in pool workers.
+
+    Files that are not DICOM get a row of None values, so they are remembered
+    and skipped on the next scan as well.
+    """
+    import pydicom
+
+    rows = []
+    for path in paths:
+        try:
+            dataset = pydicom.dcmread(
+                path, stop_before_pixels=True, specific_tags=list(HEADER_TAGS)
+            )
+            values = []
+            for tag in HEADER_TAGS:
+                value = dataset.get(tag)
+                if tag in ("SeriesNumber", "InstanceNumber"):
+                    value = int(value) if value not in (None, "") else None
+                elif value is not None:
+                    value = str(value)
+                values.append(value)
+            rows.append((path, tuple(values)))
+        except Exception:
+            rows.append((path, (None,) * len(HEADER_TAGS)))
+    return rows
+
+
+class DicomIndex:
+    def __init__(
+        self,
+        db_path: Path,
+        max_workers: Optional[int] = None,
+        use_processes: bool = True,
+    ):
+        """
+        Args:
+            db_path: SQLite database of the index, created on the first scan
+            max_workers: Header reading workers, the pool's default if None
+            use_processes: Read headers in spawned processes rather than threads.
+                Disable inside Slicer, whose interpreter cannot start them.
+        """
+        self.db_path = Path(db_path)
+        self.max_workers = max_workers
+        self.use_processes = use_processes
+        self._schema_ready = False
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # One connection per call, so the index can be used from any thread
+        if not self._schema_ready:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        db = sqlite3.connect(self.db_path)
+        db.row_factory = sqlite3.Row
+        try:
+            if not self._schema_ready:
+                db.executescript(_SCHEMA)
+                self._schema_ready = True
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    @staticmethod
+    def _walk(folder: Path) -> Iterator[Tuple[str, float, int]]:
+        for root, _, files in os.walk(folder):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield path, stat.st_mtime, stat.st_size
+
+    def _read_parallel(self, chunks: List[List[str]]) -> list:
+        if self.use_processes:
+            # Spawn rather than fork: forking a multithreaded process can deadlock
+            executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        else:
+            executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        with executor:
+            return [row for rows in executor.map(read_headers, chunks) for row in rows]
+
+    def scan(self, folder: str) -> Dict[str, Any]:
+        """Index new and changed files under `folder`, forget deleted ones."""
+        start = time.perf_counter()
+        folder = str(Path(folder).resolve())
+        prefix = os.path.join(folder, "")
+        with self._connect() as db:
+            known = {
+                row["path"]: (row["mtime"], row["size"])
+                for row in db.execute(
+                    "SELECT path, mtime, size FROM files WHERE substr(path, 1, ?) = ?",
+                    (len(prefix), prefix),
+                )
+            }
+
+        found = {}
+        stale = []
+        for path, mtime, size in self._walk(Path(folder)):
+            found[path] = (mtime, size)
+            if known.get(path) != (mtime, size):
+                stale.append(path)
+        removed = [path for path in known if path not in found]
+
+        rows = []
+        if stale:
+            chunks = [
+                stale[i : i + CHUNK_SIZE] for i in range(0, len(stale), CHUNK_SIZE)
+            ]
+            try:
+                rows = self._read_parallel(chunks)
+            except BrokenProcessPool as e:
+                logger.warning(f"Process pool scan failed ({e}), using threads")
+                self.use_processes = False
+                rows = self._read_parallel(chunks)
+
+        with self._connect() as db:
+            db.executemany(
+                "DELETE FROM files WHERE path = ?", ((path,) for path in removed)
+            )
+            db.executemany(
+                f"INSERT OR REPLACE INTO files VALUES ({', '.join('?' * 12)})",
+                ((path, *found[path], *values) for path, values in rows),
+            )
+
+        return {
+            "folder": folder,
+            "files": len(found),
+            "read": len(stale),
+            "removed": len(removed),
+            "dicom_files_read": sum(1 for _, values in rows if values[0]),
+            "seconds": round(time.perf_counter() - start, 3),
+        }
+
+    def list_series(
+        self, folder: Optional[str] = None, series_uid: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """Summarize indexed series, optionally only those under `folder` or one series."""
+        if not self.db_path.exists():
+            return []
+        conditions = ["series_uid IS NOT NULL"]
+        params: List[Any] = []
+        if folder:
+            prefix = os.path.join(str(Path(folder).resolve()), "")
+            conditions.append("substr(path, 1, ?) = ?")
+            params += [len(prefix), prefix]
+        if series_uid:
+            conditions.append("series_uid = ?")
+            params.append(series_uid)
+        query = f"""
+            SELECT series_uid, study_uid, patient_id, patient_name, study_date,
+                   modality, series_description, series_number,
+                   COUNT(*) AS files
+            FROM files WHERE {" AND ".join(conditions)}
+            GROUP BY series_uid
+            ORDER BY patient_id, study_date, series_number
+        """
+        with self._connect() as db:
+            return [dict(row) for row in db.execute(query, params)]
+
+    def series_files(self, series_uid: str) -> List[str]:
+        """Files of a series ordered by instance number."""
+        if not self.db_path.exists():
+            return []
+        with self._connect() as db:
+            return [
+                row["path"]
+                for row in db.execute(
+                    "SELECT path FROM files WHERE series_uid = ? "
+                    "ORDER BY instance_number, path",
+                    (series_uid,),
+                )
+            ]
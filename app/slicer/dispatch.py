@@ -0,0 +1,136 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+from app.logger import logger
+
+try:
+    from qt import QTimer
+
+    has_qt = True
+except ImportError:
+    has_qt = False
+
+
+class MainThreadExecutor:
+    """Run callables on Slicer's Qt main thread on behalf of worker threads.
+
+    Worker threads (e.g. the MCP server) submit callables and get futures back.
+    A QTimer on the main thread drains the queue in batches, but stops a batch
+    once `budget_ms` is spent so rendering and user interaction keep running
+    under heavy agent activity. Without Qt, or when called from the main
+    thread itself, callables run inline.
+    """
+
+    def __init__(self, interval_ms: int = 10, budget_ms: float = 8.0):
+        self.interval_ms = interval_ms
+        self.budget = budget_ms / 1000
+        self._queue: Deque[Tuple[Future, Callable, tuple, dict, float]] = deque()
+        self._lock = threading.Lock()
+        self._timer = None
+
+        self.submitted = 0
+        self.completed = 0
+        self.ticks = 0
+        self.max_queue_depth = 0
+        self._total_wait = 0.0
+        self.max_wait = 0.0
+        self._total_run = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._timer is not None
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    def start(self) -> None:
+        """Start draining the queue. Must be called on the main thread."""
+        if not has_qt or self._timer is not None:
+            return
+        self._timer = QTimer()
+        self._timer.setInterval(self.interval_ms)
+        self._timer.connect("timeout()", self._tick)
+        self._timer.start()
+
+    def stop(self) -> None:
+        """Stop the timer and fail pending calls."""
+        # Under the lock that submit enqueues with, so no call is queued after
+        # the drain and left unresolved
+        with self._lock:
+            timer, self._timer = self._timer, None
+            pending, self._queue = self._queue, deque()
+        if timer is not None:
+            timer.stop()
+        for future, *_ in pending:
+            future.set_exception(RuntimeError("Main thread executor stopped"))
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """Queue `fn(*args, **kwargs)` for the main thread."""
+        future: Future = Future()
+        self.submitted += 1
+        if threading.current_thread() is not threading.main_thread():
+            with self._lock:
+                if self.running:
+                    self._queue.append((future, fn, args, kwargs, time.perf_counter()))
+                    self.max_queue_depth = max(self.max_queue_depth, len(self._queue))
+                    return future
+        self._run(future, fn, args, kwargs, time.perf_counter())
+        return future
+
+    def call(self, fn: Callable, *args, timeout: Optional[float] = None, **kwargs):
+        """Run `fn` on the main thread and block until it returns."""
+        return self.submit(fn, *args, **kwargs).result(timeout)
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """Run `fn` on the main thread and await its result."""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def _run(self, future: Future, fn: Callable, args, kwargs, queued_at: float):
+        if not future.set_running_or_notify_cancel():
+            return
+        start = time.perf_counter()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            end = time.perf_counter()
+            wait = start - queued_at
+            self.completed += 1
+            self._total_wait += wait
+            self._total_run += end - start
+            self.max_wait = max(self.max_wait, wait)
+
+    def _tick(self) -> None:
+        """Drain queued calls until the queue is empty or the time budget is spent."""
+        self.ticks += 1
+        deadline = time.perf_counter() + self.budget
+        while time.perf_counter() < deadline:
+            with self._lock:
+                if not self._queue:
+                    break
+                item = self._queue.popleft()
+            self._run(*item)
+        if self._queue:
+            logger.debug(
+                f"Main thread budget spent, {len(self._queue)} calls left for next tick"
+            )
+
+    def metrics(self) -> Dict[str, Any]:
+        """Queue depth and latency counters."""
+        completed = max(self.completed, 1)
+        return {
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "ticks": self.ticks,
+            "mean_wait_ms": round(self._total_wait / completed * 1000, 2),
+            "max_wait_ms": round(self.max_wait * 1000, 2),
+            "mean_run_ms": round(self._total_run / completed * 1000, 2),
+        }
@@ -0,0 +1,173 @@
+"""Volume loading that keeps file reading off Slicer's main thread.
+
+Files are read and decoded by SimpleITK in worker threads; only the finished
+array is handed to the main thread to create the volume node. Several paths
+load concurrently and progress is reported through an async callback. Without
+SimpleITK, or for images it cannot map to a scalar volume, loading falls back
+to `slicer.util.loadVolume` on the main thread.
+"""
+
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, List, Optional, Union
+
+from app.logger import logger
+from app.slicer.dispatch import MainThreadExecutor
+
+try:
+    import SimpleITK as sitk
+except ImportError:
+    sitk = None
+
+# progress(fraction in [0, 1], message)
+ProgressCallback = Callable[[float, str], Awaitable[None]]
+
+# Share of the progress spent reading, the rest is node creation
+READ_SHARE = 0.9
+
+
+class VolumeLoader:
+    def __init__(self, main_thread: MainThreadExecutor, max_workers: int = 4):
+        self.main_thread = main_thread
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="volume-loader"
+        )
+
+    async def load(
+        self,
+        path: Union[str, List[str]],
+        progress: Optional[ProgressCallback] = None,
+        name: Optional[str] = None,
+    ) -> Dict[str, str]:
+        """Load a file, DICOM series directory or list of series files as a volume node."""
+        progress = progress or _no_progress
+        first = path[0] if isinstance(path, list) else path
+        name = name or os.path.basename(os.path.normpath(first)).split(".")[0]
+        if sitk is None:
+            await progress(0.0, f"Loading {name}")
+            result = await self.main_thread.run(_load_on_main_thread, path)
+            await progress(1.0, f"Loaded {name}")
+            return result
+
+        loop = asyncio.get_running_loop()
+        reported = [0.0]
+
+        def on_read_progress(fraction: float) -> None:
+            # Called from the worker thread, throttled to 5% steps
+            if fraction - reported[0] >= 0.05:
+                reported[0] = fraction
+                loop.call_soon_threadsafe(
+                    asyncio.ensure_future,
+                    progress(fraction * READ_SHARE, f"Reading {name}"),
+                )
+
+        await progress(0.0, f"Reading {name}")
+        image = await loop.run_in_executor(
+            self._pool, _read_image, path, on_read_progress
+        )
+        if image is None:
+            result = await self.main_thread.run(_load_on_main_thread, path)
+        else:
+            await progress(READ_SHARE, f"Creating node {name}")
+            result = await self.main_thread.run(_create_volume_node, name, *image)
+        await progress(1.0, f"Loaded {name}")
+        return result
+
+    async def load_many(
+        self, paths: List[str], progress: Optional[ProgressCallback] = None
+    ) -> List[Dict[str, str]]:
+        """Load several paths concurrently, reporting their average progress.
+
+        Returns:
+            One result per path, with `error` set for paths that failed
+        """
+        progress = progress or _no_progress
+        fractions = [0.0] * len(paths)
+
+        async def load_one(index: int, path: str) -> Dict[str, str]:
+            async def report(fraction: float, message: str) -> None:
+                fractions[index] = max(fractions[index], fraction)
+                await progress(sum(fractions) / len(fractions), message)
+
+            try:
+                return {"path": path, **await self.load(path, report)}
+            except Exception as e:
+                logger.warning(f"Failed to load volume {path}: {e}")
+                return {"path": path, "error": str(e)}
+
+        return await asyncio.gather(
+            *(load_one(index, path) for index, path in enumerate(paths))
+        )
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def _no_progress(fraction: float, message: str) -> None:
+    pass
+
+
+def _read_image(path: Union[str, List[str]], on_progress: Callable[[float], None]):
+    """Read a file, DICOM series directory or list of series files in a worker thread.
+
+    Returns:
+        (array, spacing, origin, direction) in SimpleITK's LPS convention, or
+        None when the image should be loaded by Slicer itself
+    """
+    if isinstance(path, list):
+        reader = sitk.ImageSeriesReader()
+        reader.SetFileNames(path)
+    elif os.path.isdir(path):
+        reader = sitk.ImageSeriesReader()
+        file_names = reader.GetGDCMSeriesFileNames(path)
+        if not file_names:
+            raise ValueError(f"No DICOM series found in {path}")
+        reader.SetFileNames(file_names)
+    else:
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        reader = sitk.ImageFileReader()
+        reader.SetFileName(path)
+    reader.AddCommand(sitk.sitkProgressEvent, lambda: on_progress(reader.GetProgress()))
+    image = reader.Execute()
+    if image.GetDimension() != 3 or image.GetNumberOfComponentsPerPixel() != 1:
+        return None
+    return (
+        sitk.GetArrayViewFromImage(image).copy(),
+        image.GetSpacing(),
+        image.GetOrigin(),
+        image.GetDirection(),
+    )
+
+
+def _create_volume_node(name: str, array, spacing, origin, direction):
+    """Create a scalar volume node from a decoded array, on the main thread."""
+    import slicer
+    import vtk
+
+    node = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLScalarVolumeNode", name)
+    # LPS (ITK) -> RAS (Slicer)
+    node.SetOrigin(-origin[0], -origin[1], origin[2])
+    node.SetSpacing(*spacing)
+    matrix = vtk.vtkMatrix4x4()
+    for row in range(3):
+        sign = -1 if row < 2 else 1
+        for col in range(3):
+            matrix.SetElement(row, col, sign * direction[row * 3 + col])
+    node.SetIJKToRASDirectionMatrix(matrix)
+    slicer.util.updateVolumeFromArray(node, array)
+    node.CreateDefaultDisplayNodes()
+    slicer.util.setSliceViewerLayers(background=node, fit=True)
+    return {"node_id": node.GetID(), "name": node.GetName()}
+
+
+def _load_on_main_thread(path: Union[str, List[str]]):
+    import slicer
+
+    if isinstance(path, list):
+        # Let Slicer read the whole series from its first file
+        node = slicer.util.loadVolume(path[0], {"singleFile": False})
+    else:
+        node = slicer.util.loadVolume(path)
+    return {"node_id": node.GetID(), "name": node.GetName()}
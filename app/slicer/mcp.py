@@ -1,14 +1,26 @@
+import asyncio
+import functools
 import threading
+import weakref
+from typing import Callable, List, Optional
 
 import requests
-from mcp.server.fastmcp import FastMCP
+from mcp.server.fastmcp import Context, FastMCP, Image
+from mcp.server.lowlevel.server import NotificationOptions
 
-try:
-    from qt import QObject, Signal
+from app.config import WORKSPACE_ROOT
+from app.slicer.capture import ImageFormat, View, ViewCapture
+from app.slicer.dicom_index import DicomIndex
+from app.slicer.dispatch import MainThreadExecutor
+from app.slicer.loader import VolumeLoader
+from app.slicer.operations import Operation, run_batch
+from app.slicer.scene import SceneIndex
+from app.slicer.shm import SharedVolumeExporter
+from app.slicer.statistics import SegmentStatisticsCalculator
+from app.slicer.web import SlicerWebClient
 
-    class SignalEmitter(QObject):
-        load_volume_signal = Signal(str, result={"success": bool})
-        list_volumes_signal = Signal(result={"success": bool, "volumes": list})
+try:
+    import slicer
 
     is_in_slicer = True
 except ImportError:
@@ -21,53 +33,336 @@ class MCPServer:
         self.mcp = FastMCP(name="SlicerWebServer", port=port)
         self.thread = None
         self.running = False
+        # Connected client sessions -> the event loop serving them
+        self._sessions: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+        self.web_client = SlicerWebClient()
+        # Every scene change also invalidates cached web server responses
+        self.scene_index = SceneIndex(on_change=self.web_client.invalidate)
+        # Volume arrays exported to shared memory for agent-side analysis
+        self.volume_exporter = SharedVolumeExporter()
+        self.segment_statistics = SegmentStatisticsCalculator()
+        # Slicer API calls from tool threads are queued to the Qt main thread
+        self.main_thread = MainThreadExecutor()
+        # Reads volume files in worker threads, creates nodes on the main thread
+        self.volume_loader = VolumeLoader(self.main_thread)
+        self.dicom_index = DicomIndex(
+            WORKSPACE_ROOT / "dicom_index.sqlite", use_processes=not is_in_slicer
+        )
+        self.view_capture = ViewCapture()
+        self._enable_tool_notifications()
         self._configure_tools()
         if is_in_slicer:
-            self.signal_emitter = SignalEmitter()
-            self.signal_emitter.load_volume_signal.connect(self._load_volume)
+            self.main_thread.start()
+            self.scene_index.attach(slicer.mrmlScene)
 
-    def _load_volume(self, volume_path):
-        """加载体视显微镜数据到3D Slicer"""
-        try:
-            # 在主线程中执行Slicer API调用
-            import slicer
+    @staticmethod
+    def _progress_reporter(ctx: Context):
+        """Forward load progress as MCP progress notifications (in percent)."""
 
-            slicer.util.loadVolume(volume_path)
-            return {"success": True}
-        except Exception as e:
-            return {"success": False, "error": str(e)}
+        async def report(fraction: float, message: str):
+            await ctx.report_progress(round(fraction * 100, 1), 100)
 
-    def _configure_tools(self):
-        SLICER_WEB_SERVER_URL = "http://localhost:2016"
+        return report
+
+    def _export_volume(self, node: str):
+        volume_node = slicer.util.getNode(node)
+        if not volume_node.IsA("vtkMRMLScalarVolumeNode"):
+            raise ValueError(f"'{node}' is not a volume")
+        return self.volume_exporter.export_node(volume_node)
+
+    def _enable_tool_notifications(self):
+        """Advertise `tools.listChanged` and remember sessions that listed tools."""
+        server = self.mcp._mcp_server
+        server.create_initialization_options = functools.partial(
+            server.create_initialization_options,
+            NotificationOptions(tools_changed=True),
+        )
+
+        async def list_tools():
+            self._sessions[server.request_context.session] = asyncio.get_running_loop()
+            return await self.mcp.list_tools()
+
+        server.list_tools()(list_tools)
 
+    def register_tool(
+        self,
+        fn: Callable,
+        name: Optional[str] = None,
+        description: Optional[str] = None,
+    ):
+        """Register a tool at runtime and notify connected clients."""
+        self.mcp.add_tool(fn, name=name, description=description)
+        self._notify_tools_changed()
+
+    def unregister_tool(self, name: str):
+        """Remove a tool at runtime and notify connected clients."""
+        if self.mcp._tool_manager._tools.pop(name, None) is not None:
+            self._notify_tools_changed()
+
+    def _notify_tools_changed(self):
+        """Send `notifications/tools/list_changed` to every known session."""
+        for session, loop in list(self._sessions.items()):
+            if loop.is_closed():
+                self._sessions.pop(session, None)
+                continue
+            future = asyncio.run_coroutine_threadsafe(
+                session.send_tool_list_changed(), loop
+            )
+            future.add_done_callback(functools.partial(self._forget_session, session))
+
+    def _forget_session(self, session, future):
+        """Drop sessions whose notification failed, e.g. disconnected clients."""
+        if future.cancelled() or future.exception() is not None:
+            self._sessions.pop(session, None)
+
+    def _configure_tools(self):
         @self.mcp.tool()
-        def get_node_names():
+        async def get_node_names():
             """获取当前3D Slicer中的节点名称"""
-            url = f"{SLICER_WEB_SERVER_URL}/slicer/mrml"
             try:
-                response = requests.get(url)
-                response.raise_for_status()
-                data = response.json()
+                # Blocking HTTP call, off the event loop serving the agent
+                data = await asyncio.to_thread(self.web_client.get_json, "/slicer/mrml")
                 assert isinstance(data, list)
-            except requests.RequestException as e:
+            except (requests.RequestException, ValueError) as e:
                 return {"success": False, "error": str(e)}
             except AssertionError:
                 return {"success": False, "error": "Invalid response format"}
             return {"success": True, "nodes": data}
 
+        @self.mcp.tool()
+        async def index_dicom_folder(folder: str):
+            """Index the DICOM files under a folder by series, reading headers only.
+
+            Rescans are incremental: only new or changed files are read again.
+            Call list_dicom_series afterwards to see the series.
+            """
+            try:
+                summary = await asyncio.to_thread(self.dicom_index.scan, folder)
+            except Exception as e:
+                return {"success": False, "error": str(e)}
+            return {"success": True, **summary}
+
+        @self.mcp.tool()
+        async def list_dicom_series(folder: str = ""):
+            """List indexed DICOM series (patient, modality, description, file count).
+
+            Args:
+                folder: Only list series under this folder, all indexed series if empty
+            """
+            series = await asyncio.to_thread(
+                self.dicom_index.list_series, folder or None
+            )
+            return {"series": series}
+
+        @self.mcp.tool()
+        def server_status():
+            """Report the load of the Slicer bridge.
+
+            Returns the main thread queue depth and call latencies, and the web
+            server response cache hit counts.
+            """
+            return {
+                "main_thread": self.main_thread.metrics(),
+                "web_cache": {
+                    "hits": self.web_client.hits,
+                    "misses": self.web_client.misses,
+                },
+            }
+
         # add below tools only if in Slicer environment
         if not is_in_slicer:
             return
 
         @self.mcp.tool()
-        def load_volume(volume_file_path: str):
+        async def load_dicom_series(series_uid: str, ctx: Context):
+            """Load an indexed DICOM series as a volume.
+
+            Args:
+                series_uid: SeriesInstanceUID from list_dicom_series
+            """
+            files = await asyncio.to_thread(self.dicom_index.series_files, series_uid)
+            if not files:
+                return {
+                    "success": False,
+                    "error": f"Series {series_uid} is not indexed",
+                }
+            series = await asyncio.to_thread(
+                self.dicom_index.list_series, series_uid=series_uid
+            )
+            name = series[0]["series_description"] if series else None
+            try:
+                result = await self.volume_loader.load(
+                    files, self._progress_reporter(ctx), name=name
+                )
+            except Exception as e:
+                return {"success": False, "error": str(e)}
+            return {"success": True, **result}
+
+        @self.mcp.tool()
+        async def load_volume(volume_file_path: str, ctx: Context):
             """加载体视显微镜数据到3D Slicer"""
             try:
-                # 在主线程中执行Slicer API调用
-                result = self.signal_emitter.load_volume_signal.emit(volume_file_path)
-                return result
+                result = await self.volume_loader.load(
+                    volume_file_path, self._progress_reporter(ctx)
+                )
+            except Exception as e:
+                return {"success": False, "error": str(e)}
+            return {"success": True, **result}
+
+        @self.mcp.tool()
+        async def load_volumes(volume_file_paths: List[str], ctx: Context):
+            """Load several volume files or DICOM series directories concurrently.
+
+            Args:
+                volume_file_paths: Paths of the volume files or DICOM directories
+            """
+            results = await self.volume_loader.load_many(
+                volume_file_paths, self._progress_reporter(ctx)
+            )
+            return {
+                "success": all("error" not in result for result in results),
+                "results": results,
+            }
+
+        @self.mcp.tool()
+        async def run_operations(
+            operations: List[Operation], stop_on_error: bool = True
+        ):
+            """Run several scene operations in order within one call.
+
+            Prefer this over separate tool calls when a task needs multiple actions,
+            e.g. load a volume, rename it, set its window/level and show it.
+
+            Args:
+                operations: Ordered operations, each selected by its `op` field
+                stop_on_error: Skip the remaining operations after the first failure
+                    (true) or run all of them and report each result (false)
+            """
+            results = await self.main_thread.run(run_batch, operations, stop_on_error)
+            return {
+                "success": all(result["status"] == "ok" for result in results),
+                "results": results,
+            }
+
+        @self.mcp.tool()
+        def query_nodes(
+            name: str = "",
+            class_name: str = "",
+            include_hidden: bool = False,
+            offset: int = 0,
+            limit: int = 50,
+        ):
+            """List MRML scene nodes page by page, filtered by name and class.
+
+            Args:
+                name: Case-insensitive substring of the node name
+                class_name: Case-insensitive substring of the node class, e.g. "Volume" or "Segmentation"
+                include_hidden: Whether to include nodes hidden from editors
+                offset: Index of the first node to return
+                limit: Maximum number of nodes to return
+            """
+            return self.scene_index.query(
+                name=name or None,
+                class_name=class_name or None,
+                include_hidden=include_hidden,
+                offset=max(0, offset),
+                limit=max(1, min(limit, 200)),
+            )
+
+        @self.mcp.tool()
+        async def segment_statistics(volume: str, segmentation: str):
+            """Compute statistics of every segment of a segmentation over a volume.
+
+            For each segment returns voxel count, physical volume (mm³ and mL),
+            intensity mean/std/min/max, 5/25/50/75/95th percentiles (linearly
+            interpolated, as numpy.percentile) and IJK bounding box.
+
+            Args:
+                volume: Name or ID of the intensity volume node
+                segmentation: Name or ID of the segmentation node
+            """
+            try:
+                volume_node, segmentation_node = await self.main_thread.run(
+                    lambda: (
+                        slicer.util.getNode(volume),
+                        slicer.util.getNode(segmentation),
+                    )
+                )
+                # Reductions run in a worker thread, node access on the main thread
+                segments = await asyncio.to_thread(
+                    self.segment_statistics.compute,
+                    volume_node,
+                    segmentation_node,
+                    self.main_thread.call,
+                )
+            except Exception as e:
+                return {"success": False, "error": str(e)}
+            return {"success": True, "segments": segments}
+
+        @self.mcp.tool()
+        async def export_volume(node: str):
+            """Export a volume node's voxel array to shared memory for local analysis.
+
+            Returns a descriptor (shm_name, shape, dtype, spacing, origin) instead of
+            the voxels. Call release_volume with the shm_name when done.
+
+            Args:
+                node: Name or ID of the volume node
+            """
+            try:
+                descriptor = await self.main_thread.run(self._export_volume, node)
+            except Exception as e:
+                return {"success": False, "error": str(e)}
+            return {"success": True, "descriptor": descriptor.model_dump()}
+
+        @self.mcp.tool()
+        def release_volume(shm_name: str):
+            """Release a volume exported with export_volume."""
+            return {"success": self.volume_exporter.release(shm_name)}
+
+        @self.mcp.tool()
+        def scene_changes(since_version: int):
+            """List nodes added, modified and removed since a scene version.
+
+            Pass the `version` returned by a previous query_nodes or scene_changes call.
+            When the result is `truncated`, call again with its `version` for the rest.
+            """
+            return self.scene_index.changes_since(since_version)
+
+        @self.mcp.tool()
+        async def capture_view(
+            view: View = "layout",
+            max_size: int = 512,
+            image_format: ImageFormat = "jpeg",
+            quality: int = 80,
+        ):
+            """Take a downsampled screenshot of a view to look at the current display.
+
+            Small images cost fewer tokens: 512 px is enough to check what is shown,
+            use larger sizes only to inspect fine detail.
+
+            Args:
+                view: "3D", a slice view ("Red", "Yellow", "Green") or "layout" for all views
+                max_size: Maximum width and height in pixels (64-2048)
+                image_format: "jpeg", "webp" or "png"
+                quality: Encoder quality (1-100), ignored for png
+            """
+            try:
+                capture = await asyncio.to_thread(
+                    self.view_capture.capture,
+                    view,
+                    max(64, min(max_size, 2048)),
+                    image_format,
+                    max(1, min(quality, 100)),
+                    self.scene_index.version,
+                    self.main_thread.call,
+                )
             except Exception as e:
                 return {"success": False, "error": str(e)}
+            return [
+                Image(data=capture.pop("data"), format=capture["format"]),
+                {"success": True, "view": view, **capture},
+            ]
 
     def start(self):
         """在单独线程中启动MCP服务器"""
@@ -86,6 +381,11 @@ class MCPServer:
     def stop(self):
         """停止MCP服务器"""
         self.running = False
+        self.volume_loader.shutdown()
+        self.main_thread.stop()
+        self.scene_index.detach()
+        self.volume_exporter.release_all()
+        self.web_client.close()
         if self.thread:
             self.thread.join(0.1)  # shutdown server
             self.thread = None
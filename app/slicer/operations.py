@@ -0,0 +1,158 @@
+"""Typed scene operations executed as one main-thread batch by `run_operations`.
+
+Each operation is a pydantic model selected by its `op` field, so a batch is
+validated against the per-operation schemas before anything touches the scene.
+"""
+
+from abc import ABC, abstractmethod
+from typing import Annotated, Any, Dict, List, Literal, Optional, Union
+
+from pydantic import BaseModel, Field
+
+
+class SceneOperation(BaseModel, ABC):
+    @abstractmethod
+    def apply(self) -> Dict[str, Any]:
+        """Execute the operation on the main thread and return its result."""
+
+
+class LoadVolume(SceneOperation):
+    """Load a volume file into the scene."""
+
+    op: Literal["load_volume"] = "load_volume"
+    path: str = Field(..., description="Path of the volume file")
+    name: Optional[str] = Field(None, description="Name of the new node")
+
+    def apply(self) -> Dict[str, Any]:
+        import slicer
+
+        properties = {"name": self.name} if self.name else {}
+        node = slicer.util.loadVolume(self.path, properties)
+        return {"node_id": node.GetID(), "name": node.GetName()}
+
+
+class RenameNode(SceneOperation):
+    """Rename a node."""
+
+    op: Literal["rename_node"] = "rename_node"
+    node: str = Field(..., description="Name or ID of the node")
+    name: str = Field(..., description="New name")
+
+    def apply(self) -> Dict[str, Any]:
+        import slicer
+
+        node = slicer.util.getNode(self.node)
+        node.SetName(self.name)
+        return {"node_id": node.GetID(), "name": node.GetName()}
+
+
+class SetWindowLevel(SceneOperation):
+    """Set the display window/level of a scalar volume."""
+
+    op: Literal["set_window_level"] = "set_window_level"
+    node: str = Field(..., description="Name or ID of the volume node")
+    window: float = Field(..., description="Window width")
+    level: float = Field(..., description="Window center")
+
+    def apply(self) -> Dict[str, Any]:
+        import slicer
+
+        display_node = slicer.util.getNode(self.node).GetDisplayNode()
+        display_node.SetAutoWindowLevel(False)
+        display_node.SetWindowLevel(self.window, self.level)
+        return {"window": self.window, "level": self.level}
+
+
+class ShowVolume(SceneOperation):
+    """Show a volume in the slice views."""
+
+    op: Literal["show_volume"] = "show_volume"
+    node: str = Field(..., description="Name or ID of the volume node")
+    layer: Literal["background", "foreground", "label"] = Field(
+        "background", description="Slice view layer to show the volume in"
+    )
+    fit: bool = Field(True, description="Fit the slice views to the volume")
+
+    def apply(self) -> Dict[str, Any]:
+        import slicer
+
+        node = slicer.util.getNode(self.node)
+        slicer.util.setSliceViewerLayers(**{self.layer: node}, fit=self.fit)
+        return {"node_id": node.GetID(), "layer": self.layer}
+
+
+class ShowSlice(SceneOperation):
+    """Move a slice view to an offset along its normal."""
+
+    op: Literal["show_slice"] = "show_slice"
+    view: Literal["Red", "Yellow", "Green"] = Field(
+        "Red", description="Slice view: Red (axial), Yellow (sagittal), Green (coronal)"
+    )
+    offset: float = Field(..., description="Slice offset in mm")
+
+    def apply(self) -> Dict[str, Any]:
+        import slicer
+
+        slice_logic = slicer.app.layoutManager().sliceWidget(self.view).sliceLogic()
+        slice_logic.SetSliceOffset(self.offset)
+        return {"view": self.view, "offset": slice_logic.GetSliceOffset()}
+
+
+class DeleteNode(SceneOperation):
+    """Remove a node from the scene."""
+
+    op: Literal["delete_node"] = "delete_node"
+    node: str = Field(..., description="Name or ID of the node")
+
+    def apply(self) -> Dict[str, Any]:
+        import slicer
+
+        node = slicer.util.getNode(self.node)
+        node_id = node.GetID()
+        slicer.mrmlScene.RemoveNode(node)
+        return {"node_id": node_id}
+
+
+Operation = Annotated[
+    Union[LoadVolume, RenameNode, SetWindowLevel, ShowVolume, ShowSlice, DeleteNode],
+    Field(discriminator="op"),
+]
+
+
+def run_batch(
+    operations: List[SceneOperation], stop_on_error: bool = True
+) -> List[Dict[str, Any]]:
+    """Apply operations in order, rendering once at the end.
+
+    Args:
+        operations: The validated operations
+        stop_on_error: Skip the remaining operations after the first failure,
+            otherwise run all of them (best effort)
+
+    Returns:
+        One result per operation with `op`, `status` and `result` or `error`
+    """
+    try:
+        import slicer
+
+        slicer.app.pauseRender()
+    except (ImportError, AttributeError):
+        slicer = None
+
+    results = []
+    failed = False
+    try:
+        for operation in operations:
+            if failed and stop_on_error:
+                results.append({"op": operation.op, "status": "skipped"})
+                continue
+            try:
+                result = operation.apply()
+                results.append({"op": operation.op, "status": "ok", "result": result})
+            except Exception as e:
+                failed = True
+                results.append({"op": operation.op, "status": "error", "error": str(e)})
+    finally:
+        if slicer is not None:
+            slicer.app.resumeRender()
+    return results
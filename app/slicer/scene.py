@@ -0,0 +1,251 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+
+class NodeRecord:
+    __slots__ = ("id", "name", "class_name", "hidden", "created", "version", "mtime")
+
+    def __init__(self, node_id: str, name: str, class_name: str, hidden: bool):
+        self.id = node_id
+        self.name = name
+        self.class_name = class_name
+        self.hidden = hidden
+        self.created = 0  # scene index version the node was added at
+        self.version = 0  # scene index version of the last change
+        self.mtime = 0.0  # wall-clock time of the last change
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "class": self.class_name,
+            "mtime": round(self.mtime, 3),
+        }
+
+
+class SceneIndex:
+    """Incremental index of the MRML scene (node ID -> name/class/modified time).
+
+    Every add, remove or modification bumps `version` and stamps the node with
+    it, so "what changed since version V" is answered without diffing full node
+    lists. Removed nodes are kept as tombstones; once more than `max_tombstones`
+    accumulate, the oldest are dropped and `floor` rises. Callers asking for
+    changes older than `floor` get a reset and should re-query the scene.
+
+    The index is updated from MRML observers on Slicer's main thread and read
+    from MCP tool calls on the server thread, so all access goes through a lock.
+    """
+
+    def __init__(
+        self,
+        on_change: Optional[Callable[[], None]] = None,
+        max_tombstones: int = 1000,
+    ):
+        self.version = 0
+        self.floor = 0
+        self.max_tombstones = max_tombstones
+        self._nodes: Dict[str, NodeRecord] = {}
+        # node id -> (created version, removed version), oldest first
+        self._tombstones: "OrderedDict[str, tuple]" = OrderedDict()
+        self._on_change = on_change
+        self._lock = threading.Lock()
+        self._scene = None
+        self._scene_observers: List[int] = []
+        self._node_observers: Dict[str, tuple] = {}
+
+    def _changed(self) -> None:
+        if self._on_change:
+            self._on_change()
+
+    def add(self, node_id: str, name: str, class_name: str, hidden: bool = False):
+        with self._lock:
+            self.version += 1
+            record = NodeRecord(node_id, name, class_name, hidden)
+            record.created = record.version = self.version
+            record.mtime = time.time()
+            self._nodes[node_id] = record
+            self._tombstones.pop(node_id, None)
+        self._changed()
+
+    def modify(self, node_id: str, name: Optional[str] = None):
+        with self._lock:
+            record = self._nodes.get(node_id)
+            if record is None:
+                return
+            self.version += 1
+            record.version = self.version
+            record.mtime = time.time()
+            if name is not None:
+                record.name = name
+        self._changed()
+
+    def remove(self, node_id: str):
+        with self._lock:
+            record = self._nodes.pop(node_id, None)
+            if record is None:
+                return
+            self.version += 1
+            self._tombstones[node_id] = (record.created, self.version)
+            while len(self._tombstones) > self.max_tombstones:
+                _, (_, removed) = self._tombstones.popitem(last=False)
+                self.floor = max(self.floor, removed)
+        self._changed()
+
+    def clear(self):
+        """Forget every node, e.g. when the scene is closed."""
+        with self._lock:
+            self.version += 1
+            self.floor = self.version
+            self._nodes.clear()
+            self._tombstones.clear()
+        self._changed()
+
+    def query(
+        self,
+        name: Optional[str] = None,
+        class_name: Optional[str] = None,
+        include_hidden: bool = False,
+        offset: int = 0,
+        limit: int = 50,
+    ) -> Dict[str, Any]:
+        """Return one page of nodes, filtered by name substring and class.
+
+        Args:
+            name: Case-insensitive substring of the node name
+            class_name: Case-insensitive substring of the node class, e.g. "Volume"
+            include_hidden: Whether to include nodes hidden from editors
+            offset: Index of the first node of the page
+            limit: Maximum number of nodes of the page
+        """
+        name = name.lower() if name else None
+        class_name = class_name.lower() if class_name else None
+        with self._lock:
+            matches = [
+                record
+                for record in self._nodes.values()
+                if (include_hidden or not record.hidden)
+                and (name is None or name in record.name.lower())
+                and (class_name is None or class_name in record.class_name.lower())
+            ]
+            page = matches[offset : offset + limit]
+            return {
+                "version": self.version,
+                "total": len(matches),
+                "offset": offset,
+                "nodes": [record.to_dict() for record in page],
+            }
+
+    def changes_since(self, version: int, limit: int = 100) -> Dict[str, Any]:
+        """Return nodes added, modified and removed after `version`.
+
+        A node added and removed within the window is left out, a node added and
+        then modified is only reported as added. Changes are returned oldest
+        first, at most `limit` of them; when `truncated` is set, `version` is
+        that of the last change returned, so passing it back continues with the
+        rest. A node added before such a cursor and modified after it is then
+        reported as modified, with its full record.
+        """
+        with self._lock:
+            if version < self.floor:
+                return {
+                    "version": self.version,
+                    "reset": True,
+                    "message": f"Changes before version {self.floor} are no longer "
+                    "tracked, query the scene again.",
+                }
+            # (version of the change, kind, entry)
+            changes = [
+                (
+                    record.version,
+                    "added" if record.created > version else "modified",
+                    record.to_dict(),
+                )
+                for record in self._nodes.values()
+                if record.version > version
+            ]
+            changes.extend(
+                (removed, "removed", node_id)
+                for node_id, (created, removed) in self._tombstones.items()
+                if removed > version and created <= version
+            )
+            changes.sort(key=lambda change: change[0])
+            truncated = len(changes) > limit
+            if truncated:
+                changes = changes[:limit]
+            result = {
+                "version": changes[-1][0] if truncated else self.version,
+                "added": [],
+                "modified": [],
+                "removed": [],
+                "truncated": truncated,
+            }
+            for _, kind, entry in changes:
+                result[kind].append(entry)
+            return result
+
+    def attach(self, scene) -> None:
+        """Populate the index from an MRML scene and keep it up to date."""
+        import vtk
+
+        self._scene = scene
+
+        @vtk.calldata_type(vtk.VTK_OBJECT)
+        def on_node_added(caller, event, node):
+            self._watch_node(node)
+
+        @vtk.calldata_type(vtk.VTK_OBJECT)
+        def on_node_removed(caller, event, node):
+            self._unwatch_node(node.GetID())
+            self.remove(node.GetID())
+
+        def on_scene_closed(caller, event):
+            for node_id in list(self._node_observers):
+                self._unwatch_node(node_id)
+            self.clear()
+            self._populate()
+
+        self._scene_observers = [
+            scene.AddObserver(scene.NodeAddedEvent, on_node_added),
+            scene.AddObserver(scene.NodeRemovedEvent, on_node_removed),
+            scene.AddObserver(scene.EndCloseEvent, on_scene_closed),
+        ]
+        self._populate()
+
+    def detach(self) -> None:
+        if self._scene is None:
+            return
+        for tag in self._scene_observers:
+            self._scene.RemoveObserver(tag)
+        for node_id in list(self._node_observers):
+            self._unwatch_node(node_id)
+        self._scene_observers = []
+        self._scene = None
+
+    def _populate(self) -> None:
+        for i in range(self._scene.GetNumberOfNodes()):
+            self._watch_node(self._scene.GetNthNode(i))
+
+    def _watch_node(self, node) -> None:
+        import vtk
+
+        node_id = node.GetID()
+        if not node_id or node_id in self._node_observers:
+            return
+        self.add(
+            node_id,
+            node.GetName() or "",
+            node.GetClassName(),
+            bool(node.GetHideFromEditors()),
+        )
+        tag = node.AddObserver(
+            vtk.vtkCommand.ModifiedEvent,
+            lambda caller, event: self.modify(caller.GetID(), caller.GetName() or ""),
+        )
+        self._node_observers[node_id] = (node, tag)
+
+    def _unwatch_node(self, node_id: str) -> None:
+        node, tag = self._node_observers.pop(node_id, (None, None))
+        if node is not None:
+            node.RemoveObserver(tag)
@@ -0,0 +1,271 @@
+"""Several independent chat sessions served by one agent process.
+
+Frames from the main process may carry a `session_id`. Each session gets its
+own agent copy, with its own memory and step state, made from a template
+agent whose LLM client, tools and MCP connections are shared by all sessions.
+A session handles its frames in order in its own task; a shared semaphore
+bounds how many sessions run an agent step at once, and the least recently
+used idle session is dropped when `max_sessions` is reached. Frames without a
+`session_id` go to a default session and get untagged replies, as before.
+With a `SessionStore`, each session's memory is persisted as it grows, a
+session opened again after a restart or eviction continues its persisted
+conversation, and "resume <session>" loads another session's conversation.
+"""
+
+import asyncio
+import sys
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from app.logger import logger
+from app.schema import AgentState, Memory, Payload, current_session_id
+from app.session_store import SessionStore
+
+
+def fresh_agent(template: Any, **update) -> Any:
+    """Shallow copy of an agent with new conversation state.
+
+    The copy shares the template's LLM, tools and MCP clients but gets its
+    own memory and step state.
+    """
+    return template.model_copy(
+        update={
+            "memory": Memory(max_messages=template.memory.max_messages),
+            "state": AgentState.IDLE,
+            "current_step": 0,
+            "tool_calls": [],
+            **update,
+        }
+    )
+
+
+class Session:
+    def __init__(self, session_id: Optional[str], agent: Any, max_pending: int):
+        self.id = session_id
+        self.agent = agent
+        self.queue: "asyncio.Queue[dict]" = asyncio.Queue(maxsize=max_pending)
+        self.task: Optional[asyncio.Task] = None
+        self.log = None
+        self.busy = False
+        self.last_active = time.monotonic()
+        self.turns = 0
+
+    @property
+    def idle(self) -> bool:
+        return not self.busy and self.queue.empty()
+
+
+class SessionHost:
+    def __init__(
+        self,
+        template: Any,
+        max_sessions: int = 32,
+        max_active: int = 4,
+        max_pending: int = 8,
+        store: Optional[SessionStore] = None,
+    ):
+        """
+        Args:
+            template: Agent whose LLM, tools and MCP clients the sessions share
+            max_sessions: Sessions kept at once, idle ones are evicted beyond it
+            max_active: Sessions running an agent step at the same time
+            max_pending: Frames queued per session before new ones are rejected
+            store: Where session memories are persisted, None to keep them in memory
+        """
+        self.template = template
+        self.max_sessions = max_sessions
+        self.max_pending = max_pending
+        self.store = store
+        self.step_slots = asyncio.Semaphore(max_active)
+        self.sessions: Dict[Optional[str], Session] = {}
+        self._group: Optional[asyncio.TaskGroup] = None
+
+    def new_agent(self) -> Any:
+        return fresh_agent(self.template, step_limiter=self.step_slots)
+
+    def _evict_idle(self) -> bool:
+        idle = [session for session in self.sessions.values() if session.idle]
+        if not idle:
+            return False
+        session = min(idle, key=lambda session: session.last_active)
+        self.close(session.id)
+        logger.info(f"🧹 Evicted idle session {session.id}")
+        return True
+
+    def open(self, session_id: Optional[str]) -> Optional[Session]:
+        """Get or create a session, None if the process is full of busy sessions."""
+        session = self.sessions.get(session_id)
+        if session is not None:
+            return session
+        if len(self.sessions) >= self.max_sessions and not self._evict_idle():
+            return None
+        session = Session(session_id, self.new_agent(), self.max_pending)
+        if self.store is not None:
+            session.log = self.store.log(session_id)
+            memory = session.agent.memory
+            messages = self.store.load(session_id, max_messages=memory.max_messages)
+            if messages is not None:
+                # Pick up the conversation persisted before a restart or eviction
+                memory.messages = messages
+                session.log.attach()
+            memory.persist_to(session.log)
+        session.task = self._group.create_task(self._serve(session))
+        self.sessions[session_id] = session
+        logger.info(f"💬 Opened session {session_id} ({len(self.sessions)} open)")
+        return session
+
+    def close(self, session_id: Optional[str]) -> None:
+        session = self.sessions.pop(session_id, None)
+        if session is None:
+            return
+        if session.task is not None:
+            session.task.cancel()
+        if session.log is not None:
+            session.log.close()
+
+    async def _serve(self, session: Session) -> None:
+        # Tasks copy the context they are created in, so this only tags the
+        # frames written on behalf of this session
+        current_session_id.set(session.id)
+        while True:
+            data = await session.queue.get()
+            session.busy = True
+            try:
+                await self._handle(session, data)
+            except Exception as e:
+                Payload.write_message(f"Error in run_loop: {e}", type="error")
+            finally:
+                session.busy = False
+                session.last_active = time.monotonic()
+                session.queue.task_done()
+
+    async def _handle(self, session: Session, data: dict) -> None:
+        agent = session.agent
+        if data.get("type") == "message":
+            question = data.get("content")
+            if question:
+                session.turns += 1
+                try:
+                    await agent.run(question)
+                finally:
+                    if session.log is not None:
+                        session.log.sync()
+            else:
+                Payload.write_message("No content in message", type="info")
+        elif data.get("type") == "command":
+            command, _, argument = (data.get("content") or "").partition(" ")
+            if command == "clear":
+                agent.current_step = 0
+                agent.memory.clear()
+                Payload.write_message("Memory cleared", type="info")
+            elif command == "resume":
+                self._resume(session, argument.strip() or session.id)
+
+    def _resume(self, session: Session, name: Optional[str]) -> None:
+        """Replace the session's memory with the persisted conversation `name`."""
+        if self.store is None:
+            Payload.write_message("Sessions are not persisted", type="error")
+            return
+        start = time.perf_counter()
+        memory = session.agent.memory
+        messages = self.store.load(name, max_messages=memory.max_messages)
+        if messages is None:
+            Payload.write_message(f"No saved session {name}", type="error")
+            return
+        memory.messages = messages
+        session.agent.current_step = 0
+        session.log.reset(messages)
+        elapsed = (time.perf_counter() - start) * 1000
+        logger.info(
+            f"📂 Resumed {len(messages)} messages of {name} in {elapsed:.1f} ms"
+        )
+        Payload.write_message(
+            f"Resumed {len(messages)} messages of session {name}", type="info"
+        )
+
+    def dispatch(self, data: dict) -> bool:
+        """Route a frame to its session. Returns False when the process should exit."""
+        session_id = data.get("session_id")
+        if data.get("type") == "command":
+            if data.get("content") == "exit":
+                return False
+            if data.get("content") == "close":
+                self.close(session_id)
+                self._reply(session_id, "Session closed", type="info")
+                return True
+        session = self.open(session_id)
+        if session is None:
+            self._reply(session_id, "Too many active sessions", type="error")
+            return True
+        try:
+            session.queue.put_nowait(data)
+        except asyncio.QueueFull:
+            self._reply(session_id, "Session is busy, message dropped", type="error")
+        return True
+
+    @staticmethod
+    def _reply(session_id: Optional[str], content: str, type: str) -> None:
+        token = current_session_id.set(session_id)
+        try:
+            Payload.write_message(content, type=type)
+        finally:
+            current_session_id.reset(token)
+
+    async def serve(self, read_message) -> None:
+        """Dispatch frames from `read_message` until exit or end of input.
+
+        Args:
+            read_message: Coroutine function returning the next parsed frame,
+                None for an unparsable line and EOFError at end of input
+        """
+        async with asyncio.TaskGroup() as group:
+            self._group = group
+            try:
+                while True:
+                    try:
+                        data = await read_message()
+                    except EOFError:
+                        break
+                    if data is not None and not self.dispatch(data):
+                        break
+                # Finish the queued turns, then stop the session tasks
+                await asyncio.gather(
+                    *(session.queue.join() for session in self.sessions.values())
+                )
+            finally:
+                for session_id in list(self.sessions):
+                    self.close(session_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sessions": len(self.sessions),
+            "busy": sum(1 for session in self.sessions.values() if session.busy),
+            "queued": sum(session.queue.qsize() for session in self.sessions.values()),
+            "turns": sum(session.turns for session in self.sessions.values()),
+        }
+
+
+class StdinReader:
+    """Read stdin lines in a daemon thread, so the event loop never blocks on it.
+
+    A daemon thread rather than the default executor: a read still pending at
+    exit must not keep the process alive.
+    """
+
+    def __init__(self):
+        self._loop = asyncio.get_running_loop()
+        self._lines: "asyncio.Queue[Optional[str]]" = asyncio.Queue()
+        threading.Thread(target=self._read, name="stdin-reader", daemon=True).start()
+
+    def _read(self) -> None:
+        for line in sys.stdin:
+            self._loop.call_soon_threadsafe(self._lines.put_nowait, line)
+        self._loop.call_soon_threadsafe(self._lines.put_nowait, None)
+
+    async def readline(self) -> str:
+        """Next line, EOFError once stdin is closed."""
+        line = await self._lines.get()
+        if line is None:
+            raise EOFError
+        return line
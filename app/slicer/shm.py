@@ -0,0 +1,137 @@
+"""Shared-memory export of volume arrays between Slicer and the agent process.
+
+The Slicer side copies a volume's voxel array once into a named shared memory
+block and hands out a small descriptor. The agent side maps that block as a
+NumPy array without copying and closes its mapping when done; the exporting
+side unlinks the block on release.
+"""
+
+import os
+import threading
+import uuid
+from multiprocessing import resource_tracker, shared_memory
+from typing import Dict, List, Optional, Tuple
+
+from pydantic import BaseModel, Field
+
+
+class VolumeDescriptor(BaseModel):
+    """Everything needed to map an exported volume array."""
+
+    shm_name: str = Field(..., description="Name of the shared memory block")
+    shape: Tuple[int, ...] = Field(..., description="Array shape in KJI order")
+    dtype: str = Field(..., description="NumPy dtype string, e.g. '<i2'")
+    spacing: Tuple[float, float, float] = Field((1.0, 1.0, 1.0), description="IJK mm")
+    origin: Tuple[float, float, float] = Field((0.0, 0.0, 0.0), description="RAS mm")
+    node_id: Optional[str] = Field(None, description="Exported MRML node ID")
+    node_name: Optional[str] = Field(None, description="Exported MRML node name")
+    pid: int = Field(default_factory=os.getpid, description="Exporting process ID")
+
+
+class SharedVolumeExporter:
+    """Owns the shared memory blocks exported by this process."""
+
+    def __init__(self):
+        self._blocks: Dict[str, shared_memory.SharedMemory] = {}
+        self._lock = threading.Lock()
+
+    def export(
+        self,
+        array,
+        spacing=(1.0, 1.0, 1.0),
+        origin=(0.0, 0.0, 0.0),
+        node_id: Optional[str] = None,
+        node_name: Optional[str] = None,
+    ) -> VolumeDescriptor:
+        """Copy `array` into a new shared memory block and describe it."""
+        import numpy as np
+
+        array = np.ascontiguousarray(array)
+        block = shared_memory.SharedMemory(
+            name=f"slicer_{uuid.uuid4().hex[:16]}",
+            create=True,
+            size=max(1, array.nbytes),
+        )
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        with self._lock:
+            self._blocks[block.name] = block
+        return VolumeDescriptor(
+            shm_name=block.name,
+            shape=array.shape,
+            dtype=array.dtype.str,
+            spacing=tuple(float(v) for v in spacing),
+            origin=tuple(float(v) for v in origin),
+            node_id=node_id,
+            node_name=node_name,
+        )
+
+    def export_node(self, volume_node) -> VolumeDescriptor:
+        """Export the voxel array of a Slicer volume node."""
+        import slicer
+
+        return self.export(
+            slicer.util.arrayFromVolume(volume_node),
+            spacing=volume_node.GetSpacing(),
+            origin=volume_node.GetOrigin(),
+            node_id=volume_node.GetID(),
+            node_name=volume_node.GetName(),
+        )
+
+    def release(self, shm_name: str) -> bool:
+        """Unlink an exported block. Agents that still map it keep their mapping."""
+        with self._lock:
+            block = self._blocks.pop(shm_name, None)
+        if block is None:
+            return False
+        block.close()
+        block.unlink()
+        return True
+
+    def release_all(self) -> None:
+        for name in self.exported():
+            self.release(name)
+
+    def exported(self) -> List[str]:
+        with self._lock:
+            return list(self._blocks)
+
+
+class SharedVolume:
+    """Zero-copy, read-only NumPy view of an exported volume.
+
+    Use as a context manager, or call `close()` once the array is no longer used.
+    """
+
+    def __init__(self, descriptor: VolumeDescriptor):
+        import numpy as np
+
+        self.descriptor = descriptor
+        self._block = shared_memory.SharedMemory(name=descriptor.shm_name)
+        if descriptor.pid != os.getpid():
+            # The exporting process owns the block: keep this process's resource
+            # tracker from unlinking it when we exit
+            resource_tracker.unregister(self._block._name, "shared_memory")
+        self.array = np.ndarray(
+            descriptor.shape, dtype=np.dtype(descriptor.dtype), buffer=self._block.buf
+        )
+        self.array.flags.writeable = False
+
+    @property
+    def voxel_volume(self) -> float:
+        """Volume of a single voxel in mm³."""
+        sx, sy, sz = self.descriptor.spacing
+        return sx * sy * sz
+
+    def close(self) -> None:
+        if self._block is None:
+            return
+        # Views on the buffer must be gone before the mapping can be closed
+        self.array = None
+        self._block.close()
+        self._block = None
+
+    def __enter__(self) -> "SharedVolume":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
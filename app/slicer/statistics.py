@@ -0,0 +1,268 @@
+"""Vectorized per-segment statistics over a volume and a labelmap.
+
+All segments are measured in a single pass with label-indexed `bincount`
+reductions, so the cost does not grow with the number of segments. The arrays
+are processed in slabs along the first (K) axis to bound temporary memory.
+
+Minimum and maximum are exact. Percentiles are linearly interpolated between
+order statistics, the default method of `numpy.percentile`, with the order
+statistics read from per-label intensity histograms: exact for integer volumes
+whose value range fits into `max_bins`, otherwise approximated by the centers
+of `max_bins` equal-width bins and clamped to the label's range.
+"""
+
+import threading
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+DEFAULT_PERCENTILES = (5, 25, 50, 75, 95)
+
+
+def label_statistics(
+    volume,
+    labels,
+    spacing: Sequence[float] = (1.0, 1.0, 1.0),
+    n_labels: Optional[int] = None,
+    percentiles: Sequence[float] = DEFAULT_PERCENTILES,
+    max_bins: int = 65536,
+    slab: int = 16,
+) -> Dict[int, Dict[str, Any]]:
+    """Compute statistics of `volume` for every non-zero label in `labels`.
+
+    Args:
+        volume: Intensity array in KJI order
+        labels: Non-negative integer label array with the same shape
+        spacing: Voxel spacing in IJK order (mm)
+        n_labels: Number of labels including background, defaults to labels.max() + 1
+        percentiles: Intensity percentiles to report
+        max_bins: Maximum number of histogram bins per label, lowered for many labels
+        slab: Number of K slices processed at once
+
+    Returns:
+        label -> {voxel_count, volume_mm3, volume_ml, mean, std, min, max,
+        percentiles, bbox_ijk} for every label present
+    """
+    import numpy as np
+
+    if volume.shape != labels.shape or volume.ndim != 3:
+        raise ValueError(
+            f"Volume {volume.shape} and labelmap {labels.shape} must be 3D and match"
+        )
+    if n_labels is None:
+        n_labels = int(labels.max()) + 1
+    depth, rows, cols = volume.shape
+    # Keep the label x bin histogram table at or below 16M entries
+    max_bins = min(max_bins, max(256, 2**24 // n_labels))
+
+    vmin, vmax = float(volume.min()), float(volume.max())
+    exact = np.issubdtype(volume.dtype, np.integer) and vmax - vmin + 1 <= max_bins
+    n_bins = int(vmax - vmin + 1) if exact else max_bins
+    bin_width = 1.0 if exact else (vmax - vmin) / n_bins or 1.0
+
+    counts = np.zeros(n_labels, dtype=np.int64)
+    sums = np.zeros(n_labels, dtype=np.float64)
+    sumsq = np.zeros(n_labels, dtype=np.float64)
+    mins = np.full(n_labels, np.inf)
+    maxs = np.full(n_labels, -np.inf)
+    hist = np.zeros(n_labels * n_bins, dtype=np.int64)
+    # Per-label presence along each axis, for bounding boxes
+    present_k = np.zeros((depth, n_labels), dtype=bool)
+    present_j = np.zeros(n_labels * rows, dtype=np.int64)
+    present_i = np.zeros(n_labels * cols, dtype=np.int64)
+    j_offsets = (np.arange(rows, dtype=np.intp) * n_labels)[None, :, None]
+    i_offsets = (np.arange(cols, dtype=np.intp) * n_labels)[None, None, :]
+
+    for start in range(0, depth, slab):
+        lab = labels[start : start + slab].astype(np.intp, copy=False)
+        val = volume[start : start + slab]
+        flat = lab.ravel()
+
+        counts += np.bincount(flat, minlength=n_labels)
+        values = val.ravel().astype(np.float64)
+        sums += np.bincount(flat, weights=values, minlength=n_labels)
+        sumsq += np.bincount(flat, weights=values * values, minlength=n_labels)
+        if not exact:
+            # Integer histograms give exact extrema, binned ones do not
+            np.minimum.at(mins, flat, values)
+            np.maximum.at(maxs, flat, values)
+
+        if exact:
+            bins = val.ravel().astype(np.intp) - int(vmin)
+        else:
+            bins = np.minimum(((values - vmin) / bin_width).astype(np.intp), n_bins - 1)
+        hist += np.bincount(flat * n_bins + bins, minlength=n_labels * n_bins)
+
+        k_offsets = (np.arange(lab.shape[0], dtype=np.intp) * n_labels)[:, None, None]
+        present_k[start : start + lab.shape[0]] = (
+            np.bincount(
+                (lab + k_offsets).ravel(), minlength=n_labels * lab.shape[0]
+            ).reshape(lab.shape[0], n_labels)
+            > 0
+        )
+        present_j += np.bincount((lab + j_offsets).ravel(), minlength=n_labels * rows)
+        present_i += np.bincount((lab + i_offsets).ravel(), minlength=n_labels * cols)
+
+    hist = hist.reshape(n_labels, n_bins)
+    present = [
+        present_k.T,
+        present_j.reshape(rows, n_labels).T > 0,
+        present_i.reshape(cols, n_labels).T > 0,
+    ]
+
+    ids = np.nonzero(counts[1:])[0] + 1
+    safe_counts = np.maximum(counts, 1)
+    means = sums / safe_counts
+    stds = np.sqrt(np.maximum(sumsq / safe_counts - means * means, 0.0))
+
+    # Histogram percentiles for all labels at once
+    cdf = np.cumsum(hist[ids], axis=1)
+    centers = (
+        (lambda b: vmin + b) if exact else (lambda b: vmin + (b + 0.5) * bin_width)
+    )
+    if exact:
+        nonzero_bins = hist[ids] > 0
+        mins[ids] = centers(nonzero_bins.argmax(axis=1))
+        maxs[ids] = centers(n_bins - 1 - nonzero_bins[:, ::-1].argmax(axis=1))
+
+    def order_statistic(rank):
+        """Value of the 0-based `rank`-th smallest voxel of each label."""
+        return centers((cdf <= rank[:, None]).sum(axis=1))
+
+    label_counts = counts[ids]
+    percentile_values = {}
+    for p in percentiles:
+        rank = (label_counts - 1) * p / 100.0
+        lower = np.floor(rank)
+        low = order_statistic(lower)
+        high = order_statistic(np.minimum(lower + 1, label_counts - 1))
+        value = low + (rank - lower) * (high - low)
+        percentile_values[p] = np.clip(value, mins[ids], maxs[ids])
+
+    # Bounding boxes as [min, max] voxel indices, reported in IJK order
+    bbox_min = [axis.argmax(axis=1) for axis in present]
+    bbox_max = [axis.shape[1] - 1 - axis[:, ::-1].argmax(axis=1) for axis in present]
+
+    voxel_volume = float(np.prod(spacing))
+    results = {}
+    for row, label in enumerate(ids):
+        count = int(counts[label])
+        results[int(label)] = {
+            "voxel_count": count,
+            "volume_mm3": count * voxel_volume,
+            "volume_ml": count * voxel_volume / 1000,
+            "mean": float(means[label]),
+            "std": float(stds[label]),
+            "min": float(mins[label]),
+            "max": float(maxs[label]),
+            "percentiles": {
+                str(p): float(by_label[row])
+                for p, by_label in percentile_values.items()
+            },
+            "bbox_ijk": [
+                [int(bbox_min[axis][label]), int(bbox_max[axis][label])]
+                for axis in (2, 1, 0)
+            ],
+        }
+    return results
+
+
+class SegmentStatisticsCalculator:
+    """Per-segment statistics of Slicer segmentations, cached per node state.
+
+    Results are cached per (volume, segmentation) and reused while neither
+    node nor their voxel data has been modified since.
+    """
+
+    def __init__(self, max_entries: int = 16):
+        self.max_entries = max_entries
+        self._cache: Dict[Tuple[str, str], Tuple[Tuple[int, int], List[dict]]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _mtime(node) -> int:
+        data = (
+            node.GetImageData()
+            if node.IsA("vtkMRMLScalarVolumeNode")
+            else node.GetSegmentation()
+        )
+        return max(node.GetMTime(), data.GetMTime() if data else 0)
+
+    def compute(
+        self,
+        volume_node,
+        segmentation_node,
+        call_on_main: Callable[[Callable], Any] = lambda fn: fn(),
+    ) -> List[dict]:
+        """Return statistics for every segment of `segmentation_node`.
+
+        Args:
+            volume_node: Intensity volume node
+            segmentation_node: Segmentation node
+            call_on_main: Runs a callable on the main thread and returns its
+                result. Only node access and labelmap export go through it, the
+                reductions run in the calling thread.
+        """
+        key, mtimes = call_on_main(
+            lambda: (
+                (volume_node.GetID(), segmentation_node.GetID()),
+                (self._mtime(volume_node), self._mtime(segmentation_node)),
+            )
+        )
+        with self._lock:
+            cached = self._cache.get(key)
+        if cached and cached[0] == mtimes:
+            return cached[1]
+
+        volume, labels, spacing, segments = call_on_main(
+            lambda: self._export(volume_node, segmentation_node)
+        )
+        stats = (
+            label_statistics(volume, labels, spacing, n_labels=len(segments) + 1)
+            if segments
+            else {}
+        )
+        results = [
+            {**segment, **stats.get(index + 1, {"voxel_count": 0})}
+            for index, segment in enumerate(segments)
+        ]
+        with self._lock:
+            self._cache.pop(key, None)
+            self._cache[key] = (mtimes, results)
+            while len(self._cache) > self.max_entries:
+                self._cache.pop(next(iter(self._cache)))
+        return results
+
+    @staticmethod
+    def _export(volume_node, segmentation_node):
+        """Export all segments to a labelmap on the volume's geometry.
+
+        Returns:
+            (volume array, labelmap array, spacing, segments), where segment n
+            has label n + 1
+        """
+        import slicer
+        import vtk
+
+        segmentation = segmentation_node.GetSegmentation()
+        segment_ids = vtk.vtkStringArray()
+        segmentation.GetSegmentIDs(segment_ids)
+        segments = [
+            {
+                "segment_id": segment_ids.GetValue(index),
+                "name": segmentation.GetSegment(segment_ids.GetValue(index)).GetName(),
+            }
+            for index in range(segment_ids.GetNumberOfValues())
+        ]
+        volume = slicer.util.arrayFromVolume(volume_node)
+        if not segments:
+            return volume, None, volume_node.GetSpacing(), segments
+
+        labelmap_node = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLabelMapVolumeNode")
+        try:
+            slicer.modules.segmentations.logic().ExportSegmentsToLabelmapNode(
+                segmentation_node, segment_ids, labelmap_node, volume_node
+            )
+            # Copy, the temporary labelmap node's memory goes away with the node
+            labels = slicer.util.arrayFromVolume(labelmap_node).copy()
+        finally:
+            slicer.mrmlScene.RemoveNode(labelmap_node)
+        return volume, labels, volume_node.GetSpacing(), segments
@@ -0,0 +1,94 @@
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+SLICER_WEB_SERVER_URL = "http://localhost:2016"
+
+# (connect, read) timeouts in seconds
+DEFAULT_TIMEOUT = (3.05, 10)
+# How long a cached response is served without asking the web server again
+DEFAULT_TTL = 2.0
+
+
+class SlicerWebClient:
+    """Pooled, caching client for the Slicer Web Server.
+
+    One keep-alive session is shared by all tool calls. GET responses are cached
+    per path and served from memory while the scene version is unchanged and the
+    entry is younger than `ttl`. Older entries are revalidated with
+    `If-None-Match` when the server sent an ETag. Bumping the scene version, e.g.
+    from MRML scene observers, drops every cached entry at once.
+    """
+
+    def __init__(
+        self,
+        base_url: str = SLICER_WEB_SERVER_URL,
+        timeout: Tuple[float, float] = DEFAULT_TIMEOUT,
+        ttl: float = DEFAULT_TTL,
+        pool_size: int = 4,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.ttl = ttl
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.scene_version = 0
+        # path -> (scene version, fetched at, etag, data)
+        self._cache: Dict[str, Tuple[int, float, Optional[str], Any]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def invalidate(self) -> None:
+        """Mark the scene as modified so cached responses are refetched."""
+        with self._lock:
+            self.scene_version += 1
+            self._cache.clear()
+
+    def get_json(self, path: str, use_cache: bool = True) -> Any:
+        """GET a JSON document from the web server.
+
+        Raises:
+            requests.RequestException: If the request fails
+            ValueError: If the response is not valid JSON
+        """
+        now = time.monotonic()
+        with self._lock:
+            version = self.scene_version
+            entry = self._cache.get(path) if use_cache else None
+            if entry and entry[0] == version and now - entry[1] < self.ttl:
+                self.hits += 1
+                return entry[3]
+
+        headers = {}
+        if entry and entry[2]:
+            headers["If-None-Match"] = entry[2]
+        response = self.session.get(
+            f"{self.base_url}{path}", headers=headers, timeout=self.timeout
+        )
+        revalidated = response.status_code == 304 and entry is not None
+        if revalidated:
+            data = entry[3]
+        else:
+            response.raise_for_status()
+            data = response.json()
+
+        with self._lock:
+            if revalidated:
+                self.hits += 1
+            else:
+                self.misses += 1
+            # Don't cache a response that raced with a scene modification
+            if self.scene_version == version:
+                etag = response.headers.get("ETag") or (entry[2] if entry else None)
+                self._cache[path] = (version, time.monotonic(), etag, data)
+        return data
+
+    def close(self) -> None:
+        self.session.close()
@@ -1,7 +1,9 @@
 from app.tool.base import BaseTool
 from app.tool.create_chat_completion import CreateChatCompletion
+from app.tool.slicer_doc_search import SlicerDocSearch
 from app.tool.terminate import Terminate
 from app.tool.tool_collection import ToolCollection
+from app.tool.volume_analysis import VolumeAnalysis
 from app.tool.web_search import WebSearch
 
 __all__ = [
@@ -10,4 +12,6 @@ __all__ = [
     "ToolCollection",
     "CreateChatCompletion",
     "WebSearch",
+    "SlicerDocSearch",
+    "VolumeAnalysis",
 ]
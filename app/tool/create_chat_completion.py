@@ -1,4 +1,14 @@
-from typing import Any, List, Optional, Type, Union, get_args, get_origin
+from typing import (
+    Any,
+    ClassVar,
+    Dict,
+    List,
+    Optional,
+    Type,
+    Union,
+    get_args,
+    get_origin,
+)
 
 from pydantic import BaseModel, Field
 
@@ -23,11 +33,25 @@ class CreateChatCompletion(BaseTool):
     response_type: Optional[Type] = None
     required: List[str] = Field(default_factory=lambda: ["response"])
 
+    # Parameter schemas shared by all instances, keyed by response type
+    _schema_cache: ClassVar[Dict[Any, dict]] = {}
+
     def __init__(self, response_type: Optional[Type] = str):
         """Initialize with a specific response type."""
         super().__init__()
         self.response_type = response_type
-        self.parameters = self._build_parameters()
+        self.parameters = self._cached_parameters()
+
+    def _cached_parameters(self) -> dict:
+        """Return the (read-only) parameters schema, building it once per type."""
+        key = (self.response_type, tuple(self.required))
+        try:
+            schema = self._schema_cache.get(key)
+        except TypeError:  # unhashable type hint
+            return self._build_parameters()
+        if schema is None:
+            schema = self._schema_cache[key] = self._build_parameters()
+        return schema
 
     def _build_parameters(self) -> dict:
         """Build parameters schema based on response type."""
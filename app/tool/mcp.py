@@ -1,21 +1,134 @@
+import asyncio
+import contextvars
+import hashlib
+import itertools
+import json
+import time
 from contextlib import AsyncExitStack
-from typing import List, Optional
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
 
+import anyio
 from mcp import ClientSession, StdioServerParameters
 from mcp.client.sse import sse_client
 from mcp.client.stdio import stdio_client
-from mcp.types import TextContent
+from mcp.server.fastmcp import FastMCP
+from mcp.shared.memory import create_client_server_memory_streams
+from mcp.types import (
+    CallToolRequest,
+    CallToolRequestParams,
+    CallToolResult,
+    ClientRequest,
+    ImageContent,
+    ProgressNotification,
+    RequestParams,
+    ServerNotification,
+    TextContent,
+    Tool,
+    ToolListChangedNotification,
+)
 
+from app.config import MCPServerSettings
 from app.logger import logger
 from app.tool.base import BaseTool, ToolResult
 from app.tool.tool_collection import ToolCollection
 
 
+def tool_schema_hash(tool: Tool) -> str:
+    """Stable digest of a tool's description and input schema."""
+    payload = json.dumps(
+        {"description": tool.description, "inputSchema": tool.inputSchema},
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+# Seconds before a dead server is first retried, doubled per failed attempt
+RECONNECT_DELAY = 5.0
+MAX_RECONNECT_DELAY = 300.0
+
+# progress_callback(tool name, progress, total)
+ProgressCallback = Callable[[str, float, Optional[float]], None]
+
+
+class MCPClientSession(ClientSession):
+    """Client session that reports `notifications/tools/list_changed` and progress."""
+
+    def __init__(
+        self, *args, on_tools_changed: Optional[Callable[[], None]] = None, **kwargs
+    ):
+        super().__init__(*args, **kwargs)
+        self._on_tools_changed = on_tools_changed
+        # progress token -> handler(progress, total)
+        self._progress_handlers: Dict[
+            str, Tuple[contextvars.Context, Callable[[float, Optional[float]], None]]
+        ] = {}
+        self._progress_tokens = itertools.count()
+
+    async def call_tool_with_progress(
+        self,
+        name: str,
+        arguments: Optional[Dict[str, Any]],
+        on_progress: Callable[[float, Optional[float]], None],
+    ) -> CallToolResult:
+        """Call a tool with a progress token, routing its progress notifications.
+
+        `on_progress` runs in the caller's context, not the receive loop's, so
+        it sees the caller's context variables such as the chat session.
+        """
+        token = f"progress-{next(self._progress_tokens)}"
+        self._progress_handlers[token] = (contextvars.copy_context(), on_progress)
+        try:
+            return await self.send_request(
+                ClientRequest(
+                    CallToolRequest(
+                        method="tools/call",
+                        params=CallToolRequestParams(
+                            name=name,
+                            arguments=arguments,
+                            _meta=RequestParams.Meta(progressToken=token),
+                        ),
+                    )
+                ),
+                CallToolResult,
+            )
+        finally:
+            self._progress_handlers.pop(token, None)
+
+    async def __aenter__(self) -> "MCPClientSession":
+        await super().__aenter__()
+        # The SDK also queues every notification on an unbuffered stream, which
+        # blocks its receive loop until someone reads it
+        self._task_group.start_soon(self._drain_incoming_messages)
+        return self
+
+    async def _drain_incoming_messages(self) -> None:
+        async for message in self.incoming_messages:
+            if isinstance(message, Exception):
+                logger.warning(f"MCP session received an error: {message}")
+
+    async def _received_notification(self, notification: ServerNotification) -> None:
+        if isinstance(notification.root, ToolListChangedNotification):
+            logger.debug("MCP server reported a tool list change")
+            if self._on_tools_changed:
+                self._on_tools_changed()
+            return
+        if isinstance(notification.root, ProgressNotification):
+            params = notification.root.params
+            entry = self._progress_handlers.get(params.progressToken)
+            if entry:
+                context, handler = entry
+                context.run(handler, params.progress, params.total)
+            return
+        await super()._received_notification(notification)
+
+
 class MCPClientTool(BaseTool):
     """Represents a tool proxy that can be called on the MCP server from the client side."""
 
     mcp_name: str = "mcp_server_name"
     session: Optional[ClientSession] = None
+    progress_callback: Optional[ProgressCallback] = None
 
     async def execute(self, **kwargs) -> ToolResult:
         """Execute the tool by making a remote call to the MCP server."""
@@ -23,102 +136,463 @@ class MCPClientTool(BaseTool):
             return ToolResult(error="Not connected to MCP server")
 
         try:
-            result = await self.session.call_tool(self.name, kwargs)
+            if self.progress_callback and isinstance(self.session, MCPClientSession):
+                result = await self.session.call_tool_with_progress(
+                    self.name,
+                    kwargs,
+                    lambda progress, total: self.progress_callback(
+                        self.full_name, progress, total
+                    ),
+                )
+            else:
+                result = await self.session.call_tool(self.name, kwargs)
             content_str = ", ".join(
                 item.text for item in result.content if isinstance(item, TextContent)
             )
+            images = [item for item in result.content if isinstance(item, ImageContent)]
+            if images:
+                if len(images) > 1:
+                    logger.warning(
+                        f"Tool {self.full_name} returned {len(images)} images, "
+                        "keeping the first"
+                    )
+                return ToolResult(
+                    output=content_str or "Image returned.",
+                    base64_image=images[0].data,
+                )
             return ToolResult(output=content_str or "No output returned.")
         except Exception as e:
             return ToolResult(error=f"Error executing tool: {str(e)}")
 
+    @property
+    def full_name(self) -> str:
+        # needs to match pattern '^[a-zA-Z0-9_-]+$'
+        return self.mcp_name + "_" + self.name
+
     def to_param(self):
         param = super().to_param()
-        param["function"]["name"] = (
-            self.mcp_name + "_" + self.name
-        )  # needs to match pattern '^[a-zA-Z0-9_-]+$'
+        param["function"]["name"] = self.full_name
         return param
 
 
+Transport = Callable[[AsyncExitStack], Awaitable[Tuple[Any, Any]]]
+
+
+class MCPServerConnection:
+    """A connection to a single MCP server.
+
+    The transport and session contexts are entered and exited by one dedicated
+    task, as the SDK's anyio task groups must not cross tasks. This also keeps a
+    failing server from tearing down the connections of the others.
+    """
+
+    def __init__(
+        self,
+        server_id: str,
+        transport: Transport,
+        on_tools_changed: Callable[[], None],
+        on_progress: Optional[ProgressCallback] = None,
+    ):
+        self.server_id = server_id
+        self.transport = transport
+        self.session: Optional[MCPClientSession] = None
+        self.tools: Dict[str, MCPClientTool] = {}
+        # Tool name -> schema hash of the last listed tools
+        self.tool_hashes: Dict[str, str] = {}
+        # Set by the server's tools/list_changed notification, cleared on refresh
+        self.tools_changed = False
+        self.supports_tool_notifications = False
+        self._on_tools_changed = on_tools_changed
+        self._on_progress = on_progress
+        self._task: Optional[asyncio.Task] = None
+        self._closing: Optional[asyncio.Event] = None
+        # Reconnect backoff while the server is down
+        self.retry_delay = RECONNECT_DELAY
+        self.retry_at = 0.0
+
+    @property
+    def alive(self) -> bool:
+        return (
+            self.session is not None
+            and self._task is not None
+            and not self._task.done()
+        )
+
+    def _mark_tools_changed(self) -> None:
+        self.tools_changed = True
+        self._on_tools_changed()
+
+    def schedule_retry(self, delay: float) -> None:
+        """Retry the connection after `delay` seconds, doubling the next delay."""
+        self.retry_at = time.monotonic() + delay
+        self.retry_delay = min(delay * 2, MAX_RECONNECT_DELAY)
+
+    async def connect(self) -> None:
+        """Open the transport, initialize the session and list tools."""
+        ready = asyncio.get_running_loop().create_future()
+        self._closing = asyncio.Event()
+        self._task = asyncio.create_task(
+            self._run(ready), name=f"mcp-server-{self.server_id}"
+        )
+        await ready
+        await self.refresh_tools()
+
+    async def _run(self, ready: asyncio.Future) -> None:
+        try:
+            async with AsyncExitStack() as stack:
+                read, write = await self.transport(stack)
+                session = await stack.enter_async_context(
+                    MCPClientSession(
+                        read, write, on_tools_changed=self._mark_tools_changed
+                    )
+                )
+                result = await session.initialize()
+                tools_capability = result.capabilities.tools
+                self.supports_tool_notifications = bool(
+                    tools_capability and tools_capability.listChanged
+                )
+                self.session = session
+                ready.set_result(None)
+                await self._closing.wait()
+        except asyncio.CancelledError:
+            if not ready.done():
+                ready.cancel()
+            raise
+        except Exception as e:
+            if not ready.done():
+                ready.set_exception(e)
+            else:
+                logger.warning(f"MCP server '{self.server_id}' connection lost: {e}")
+        finally:
+            self.session = None
+
+    async def refresh_tools(self) -> bool:
+        """List tools from the server.
+
+        Returns:
+            Whether the tool list differs from the previous one
+        """
+        if not self.session:
+            raise RuntimeError(f"MCP server '{self.server_id}' is not connected.")
+
+        self.tools_changed = False
+        response = await self.session.list_tools()
+        hashes = {tool.name: tool_schema_hash(tool) for tool in response.tools}
+        if hashes == self.tool_hashes:
+            # Unchanged tool list: keep the tools (and their memoized params)
+            return False
+
+        self.tools = {
+            tool.name: MCPClientTool(
+                name=tool.name,
+                mcp_name=self.server_id,
+                description=tool.description,
+                parameters=tool.inputSchema,
+                session=self.session,
+                progress_callback=self._on_progress,
+            )
+            for tool in response.tools
+        }
+        self.tool_hashes = hashes
+        return True
+
+    async def disconnect(self) -> None:
+        """Close the session and transport."""
+        if self._task is None:
+            return
+        self._closing.set()
+        try:
+            await self._task
+        except Exception:
+            pass
+        self._task = None
+        self.session = None
+        self.tools = {}
+        self.tool_hashes = {}
+
+
+def sse_transport(server_url: str) -> Transport:
+    async def open_transport(stack: AsyncExitStack):
+        return await stack.enter_async_context(sse_client(url=server_url))
+
+    return open_transport
+
+
+def stdio_transport(command: str, args: List[str]) -> Transport:
+    async def open_transport(stack: AsyncExitStack):
+        server_params = StdioServerParameters(command=command, args=args)
+        return await stack.enter_async_context(stdio_client(server_params))
+
+    return open_transport
+
+
+def memory_transport(server: FastMCP) -> Transport:
+    """Connect to a FastMCP server living in the same process.
+
+    The server runs on paired in-memory streams in the connection's task, so
+    requests skip HTTP, the loopback socket and the SSE event framing.
+    """
+
+    async def open_transport(stack: AsyncExitStack):
+        client_streams, (server_read, server_write) = await stack.enter_async_context(
+            create_client_server_memory_streams()
+        )
+        lowlevel_server = server._mcp_server
+        task_group = await stack.enter_async_context(anyio.create_task_group())
+        task_group.start_soon(
+            lowlevel_server.run,
+            server_read,
+            server_write,
+            lowlevel_server.create_initialization_options(),
+        )
+        # Stop the server before its task group and streams are closed
+        stack.callback(task_group.cancel_scope.cancel)
+        return client_streams
+
+    return open_transport
+
+
 class MCPClients(ToolCollection):
     """
-    A collection of tools that connects to an MCP server and manages available tools through the Model Context Protocol.
+    A collection of tools that connects to MCP servers and manages available tools through the Model Context Protocol.
+
+    Several servers can be attached at once. Each server's tools are exposed as
+    `<server_id>_<tool name>` and calls are routed through `tool_map` by that name.
     """
 
-    session: Optional[ClientSession] = None
-    exit_stack: AsyncExitStack = None
     description: str = "MCP client tools for server interaction"
 
     def __init__(self):
         super().__init__()  # Initialize with empty tools list
-        self.name = "mcp"  # Keep name for backward compatibility
-        self.exit_stack = AsyncExitStack()
+        self.name = "mcp"  # Default server id, kept for backward compatibility
+        self.servers: Dict[str, MCPServerConnection] = {}
+        self.tool_hashes: Dict[str, str] = {}
+        self.tools_changed = False
+        # Receives progress notifications of tool calls, see ProgressCallback
+        self.on_progress: Optional[ProgressCallback] = None
+        # Serializes refreshes and reconnects of agents sharing these clients
+        self._refresh_lock = asyncio.Lock()
 
-    async def connect_sse(self, server_url: str) -> None:
-        """Connect to an MCP server using SSE transport."""
-        if not server_url:
-            raise ValueError("Server URL is required.")
-        if self.session:
-            await self.disconnect()
+    def _report_progress(
+        self, tool_name: str, progress: float, total: Optional[float]
+    ) -> None:
+        if self.on_progress:
+            self.on_progress(tool_name, progress, total)
+
+    @property
+    def session(self) -> Optional[ClientSession]:
+        """Session of the first connected server, for single-server callers."""
+        return next(
+            (server.session for server in self.servers.values() if server.alive), None
+        )
+
+    @property
+    def connected(self) -> bool:
+        return any(server.alive for server in self.servers.values())
 
-        streams_context = sse_client(url=server_url)
-        streams = await self.exit_stack.enter_async_context(streams_context)
-        self.session = await self.exit_stack.enter_async_context(
-            ClientSession(*streams)
+    @property
+    def supports_tool_notifications(self) -> bool:
+        return bool(self.servers) and all(
+            server.supports_tool_notifications for server in self.servers.values()
         )
 
-        await self._initialize_and_list_tools()
+    def _mark_tools_changed(self) -> None:
+        self.tools_changed = True
 
-    async def connect_stdio(self, command: str, args: List[str]) -> None:
+    async def connect_sse(
+        self, server_url: str, server_id: Optional[str] = None
+    ) -> None:
+        """Connect to an MCP server using SSE transport."""
+        if not server_url:
+            raise ValueError("Server URL is required.")
+        await self.connect(server_id or self.name, sse_transport(server_url))
+
+    async def connect_stdio(
+        self, command: str, args: List[str], server_id: Optional[str] = None
+    ) -> None:
         """Connect to an MCP server using stdio transport."""
         if not command:
             raise ValueError("Server command is required.")
-        if self.session:
-            await self.disconnect()
+        await self.connect(server_id or self.name, stdio_transport(command, args))
 
-        server_params = StdioServerParameters(command=command, args=args)
-        stdio_transport = await self.exit_stack.enter_async_context(
-            stdio_client(server_params)
+    async def connect_memory(
+        self, server: FastMCP, server_id: Optional[str] = None
+    ) -> None:
+        """Connect to an in-process FastMCP server over in-memory streams."""
+        await self.connect(server_id or self.name, memory_transport(server))
+
+    async def connect(self, server_id: str, transport: Transport) -> None:
+        """Connect to one server, replacing an existing connection with the same id.
+
+        A server that fails to connect is kept as a dead connection without
+        tools, which `refresh_tools` retries with backoff.
+        """
+        previous = self.servers.get(server_id)
+        if previous is not None:
+            await self.disconnect(server_id)
+
+        server = MCPServerConnection(
+            server_id, transport, self._mark_tools_changed, self._report_progress
         )
-        read, write = stdio_transport
-        self.session = await self.exit_stack.enter_async_context(
-            ClientSession(read, write)
+        try:
+            await server.connect()
+        except BaseException:
+            await server.disconnect()
+            server.schedule_retry(
+                previous.retry_delay if previous is not None else RECONNECT_DELAY
+            )
+            self.servers[server_id] = server
+            self._rebuild_tools()
+            raise
+        self.servers[server_id] = server
+        self._rebuild_tools()
+        logger.info(
+            f"Connected to MCP server '{server_id}' with tools: {list(server.tools)}"
         )
 
-        await self._initialize_and_list_tools()
+    async def connect_all(self, servers: Dict[str, MCPServerSettings]) -> List[str]:
+        """Connect to several servers concurrently.
 
-    async def _initialize_and_list_tools(self) -> None:
-        """Initialize session and populate tool map."""
-        if not self.session:
-            raise RuntimeError("Session not initialized.")
+        A server that fails to connect is logged and kept as a dead connection
+        that `refresh_tools` retries, so startup takes as long as the slowest
+        server and does not depend on every server being up.
 
-        await self.session.initialize()
-        response = await self.session.list_tools()
+        Returns:
+            The ids of the servers that failed to connect
+        """
+        transports, failed = {}, []
+        for server_id, settings in servers.items():
+            try:
+                transports[server_id] = self._transport_for(settings)
+            except ValueError as e:
+                logger.error(f"Invalid MCP server '{server_id}' configuration: {e}")
+                failed.append(server_id)
+        results = await asyncio.gather(
+            *(self.connect(sid, transport) for sid, transport in transports.items()),
+            return_exceptions=True,
+        )
+        for server_id, result in zip(transports, results):
+            if isinstance(result, BaseException):
+                logger.error(f"Failed to connect to MCP server '{server_id}': {result}")
+                failed.append(server_id)
+        return failed
 
-        # Clear existing tools
-        self.tools = tuple()
-        self.tool_map = {}
+    @staticmethod
+    def _transport_for(settings: MCPServerSettings) -> Transport:
+        if settings.type == "sse":
+            if not settings.url:
+                raise ValueError("Server URL is required for SSE connection")
+            return sse_transport(settings.url)
+        if settings.type == "stdio":
+            if not settings.command:
+                raise ValueError("Command is required for stdio connection")
+            return stdio_transport(settings.command, settings.args)
+        raise ValueError(f"Unsupported connection type: {settings.type}")
 
-        # Create proper tool objects for each server tool
-        for tool in response.tools:
-            server_tool = MCPClientTool(
-                name=tool.name,
-                mcp_name=self.name,
-                description=tool.description,
-                parameters=tool.inputSchema,
-                session=self.session,
-            )
-            self.tool_map[tool.name] = server_tool
+    async def reconnect(self, server_id: str) -> None:
+        """Re-open the connection of a single server with its original transport."""
+        async with self._refresh_lock:
+            await self._reconnect(server_id)
 
-        self.tools = tuple(self.tool_map.values())
-        logger.info(
-            f"Connected to server with tools: {[tool.name for tool in response.tools]}"
+    async def _reconnect(self, server_id: str) -> None:
+        server = self.servers.get(server_id)
+        if server is None:
+            raise KeyError(f"Unknown MCP server '{server_id}'")
+        logger.info(f"Reconnecting to MCP server '{server_id}'...")
+        await self.connect(server_id, server.transport)
+
+    def _rebuild_tools(self) -> None:
+        """Merge the tools of all servers into the prefixed tool map."""
+        tool_map = {}
+        tool_hashes = {}
+        for server in self.servers.values():
+            for tool in server.tools.values():
+                tool_map[tool.full_name] = tool
+                tool_hashes[tool.full_name] = server.tool_hashes[tool.name]
+        self.tool_map = tool_map
+        self.tool_hashes = tool_hashes
+        self.tools = tuple(tool_map.values())
+
+    async def refresh_tools(self, changed_only: bool = False) -> bool:
+        """List tools of the connected servers in parallel and rebuild the tool map.
+
+        Dead servers whose retry is due are reconnected alongside. A dead
+        server's tools stay listed until a reconnect attempt fails.
+
+        Args:
+            changed_only: Only re-list servers that announced a tool list change
+
+        Returns:
+            Whether the tool list changed
+        """
+        async with self._refresh_lock:
+            return await self._refresh_tools(changed_only)
+
+    async def _refresh_tools(self, changed_only: bool) -> bool:
+        self.tools_changed = False
+        previous = dict(self.tool_hashes)
+        now = time.monotonic()
+        servers = [
+            server
+            for server in self.servers.values()
+            if server.alive and (server.tools_changed or not changed_only)
+        ]
+        dead = [
+            server
+            for server in self.servers.values()
+            if not server.alive and server.retry_at <= now
+        ]
+        results = await asyncio.gather(
+            *(server.refresh_tools() for server in servers),
+            *(self._reconnect(server.server_id) for server in dead),
+            return_exceptions=True,
         )
+        changed = False
+        for server, result in zip(servers + dead, results):
+            if isinstance(result, BaseException):
+                action = "list tools of" if server in servers else "reconnect to"
+                logger.error(
+                    f"Failed to {action} MCP server '{server.server_id}': {result}"
+                )
+            changed = changed or result is True
+        if changed:
+            self._rebuild_tools()
+        return self.tool_hashes != previous
 
-    async def disconnect(self) -> None:
-        """Disconnect from the MCP server and clean up resources."""
-        if self.session and self.exit_stack:
-            await self.exit_stack.aclose()
-            self.session = None
-            self.tools = tuple()
-            self.tool_map = {}
-            logger.info("Disconnected from MCP server")
+    async def execute(
+        self, *, name: str, tool_input: Dict[str, Any] = None
+    ) -> ToolResult:
+        """Route a call to the server owning the tool, reconnecting it once if it dropped."""
+        tool = self.tool_map.get(name)
+        if not tool:
+            return await super().execute(name=name, tool_input=tool_input)
+
+        server = self.servers[tool.mcp_name]
+        if server.alive:
+            result = await tool(**(tool_input or {}))
+            if server.alive or not result.error:
+                return result
+
+        async with self._refresh_lock:
+            # Another session may have reconnected it meanwhile
+            current = self.servers.get(server.server_id)
+            if current is None or not current.alive:
+                try:
+                    await self._reconnect(server.server_id)
+                except Exception as e:
+                    return ToolResult(
+                        error=f"MCP server '{server.server_id}' is unavailable: {e}"
+                    )
+        tool = self.tool_map.get(name)
+        if not tool:
+            return ToolResult(error=f"Tool {name} is no longer available")
+        return await tool(**(tool_input or {}))
+
+    async def disconnect(self, server_id: Optional[str] = None) -> None:
+        """Disconnect from one MCP server, or from all of them."""
+        server_ids = [server_id] if server_id else list(self.servers)
+        servers = [self.servers.pop(sid) for sid in server_ids if sid in self.servers]
+        await asyncio.gather(*(server.disconnect() for server in servers))
+        self._rebuild_tools()
+        for server in servers:
+            logger.info(f"Disconnected from MCP server '{server.server_id}'")
@@ -1,7 +1,9 @@
 from app.tool.search.base import WebSearchEngine
 from app.tool.search.google_search import GoogleSearchEngine
+from app.tool.search.ranker import PassageRanker
 
 __all__ = [
     "WebSearchEngine",
     "GoogleSearchEngine",
+    "PassageRanker",
 ]
@@ -0,0 +1,53 @@
+"""Build or query the local documentation index.
+
+    python -m app.tool.search build <corpus_dir> [--output <index_dir>]
+    python -m app.tool.search query "<query>" [--index <index_dir>]
+"""
+
+import argparse
+import time
+from pathlib import Path
+from typing import List, Optional
+
+from app.config import WORKSPACE_ROOT
+from app.tool.search.local_index import LocalIndex, build_index
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Local BM25 documentation index")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="Build an index from a corpus directory")
+    build.add_argument(
+        "corpus", type=Path, help="Directory with .md/.rst/.txt/.py files"
+    )
+    build.add_argument("--output", type=Path, default=WORKSPACE_ROOT / "slicer_index")
+    build.add_argument("--max-chars", type=int, default=1500)
+
+    query = commands.add_parser("query", help="Query an existing index")
+    query.add_argument("query")
+    query.add_argument("--index", type=Path, default=WORKSPACE_ROOT / "slicer_index")
+    query.add_argument("-n", "--num-results", type=int, default=5)
+
+    args = parser.parse_args(argv)
+    if args.command == "build":
+        start = time.perf_counter()
+        n_docs = build_index(args.corpus, args.output, args.max_chars)
+        print(
+            f"Indexed {n_docs} documents into {args.output} "
+            f"in {time.perf_counter() - start:.2f}s"
+        )
+    else:
+        index = LocalIndex(args.index)
+        start = time.perf_counter()
+        hits = index.search(args.query, args.num_results)
+        elapsed = (time.perf_counter() - start) * 1000
+        for score, doc_id in hits:
+            doc = index.document(doc_id)
+            print(f"{score:6.2f}  {doc['title']} ({doc['source']})")
+        print(f"{len(hits)} results in {elapsed:.1f} ms")
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
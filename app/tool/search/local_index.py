@@ -0,0 +1,200 @@
+"""On-disk BM25 inverted index over a local documentation corpus.
+
+Index layout (one directory):
+    meta.json     vocabulary (term -> [postings offset, document frequency]) and stats
+    postings.bin  uint32 (doc_id, term_frequency) pairs, grouped per term
+    doclens.bin   uint32 document lengths
+    docs.jsonl    one JSON document per line (source, title, text)
+    docs.idx      uint64 byte offsets of each line in docs.jsonl
+
+Postings, document lengths and document offsets are memory-mapped, so opening an
+index only parses the vocabulary and a query touches just the postings it needs.
+
+Build an index with:
+    python -m app.tool.search build <corpus_dir> [--output <index_dir>]
+"""
+
+import heapq
+import json
+import mmap
+import re
+from array import array
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from app.tool.search.ranker import idf, tokenize
+
+INDEX_VERSION = 1
+CORPUS_SUFFIXES = (".md", ".rst", ".txt", ".py")
+
+_IDENTIFIER_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+_CAMEL_PATTERN = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|[0-9]+")
+_HEADING_PATTERN = re.compile(r"^(#{1,6}\s+.+|[^\n]+\n[=\-~^]{3,})$", re.MULTILINE)
+
+
+def index_terms(text: str) -> List[str]:
+    """Tokenize text for indexing, splitting camelCase API names into their parts.
+
+    `slicer.util.loadVolume` yields `slicer`, `util`, `loadvolume`, `load` and
+    `volume`, so both exact API names and natural language queries match.
+    """
+    terms = tokenize(text)
+    for identifier in _IDENTIFIER_PATTERN.findall(text or ""):
+        parts = _CAMEL_PATTERN.findall(identifier)
+        if len(parts) > 1:
+            terms.extend(tokenize(" ".join(parts)))
+    return terms
+
+
+def iter_corpus_chunks(
+    corpus_dir: Path, max_chars: int = 1500
+) -> Iterator[Dict[str, str]]:
+    """Split every corpus file into paragraph-aligned chunks of at most `max_chars`."""
+    for path in sorted(corpus_dir.rglob("*")):
+        if not path.is_file() or path.suffix.lower() not in CORPUS_SUFFIXES:
+            continue
+        text = path.read_text(encoding="utf-8", errors="ignore")
+        source = str(path.relative_to(corpus_dir))
+        title = path.stem
+        buffer: List[str] = []
+        size = 0
+        for paragraph in re.split(r"\n\s*\n", text):
+            paragraph = paragraph.strip()
+            if not paragraph:
+                continue
+            heading = _HEADING_PATTERN.match(paragraph)
+            if (heading or size + len(paragraph) > max_chars) and buffer:
+                yield {"source": source, "title": title, "text": "\n\n".join(buffer)}
+                buffer, size = [], 0
+            if heading:
+                title = heading.group(0).splitlines()[0].lstrip("# ").strip()
+            buffer.append(paragraph[: max_chars * 2])
+            size += len(paragraph)
+        if buffer:
+            yield {"source": source, "title": title, "text": "\n\n".join(buffer)}
+
+
+def build_index(corpus_dir: Path, index_dir: Path, max_chars: int = 1500) -> int:
+    """Build an index for all documents under `corpus_dir`.
+
+    Returns:
+        The number of indexed documents
+    """
+    index_dir.mkdir(parents=True, exist_ok=True)
+    postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+    doc_lens = array("I")
+    doc_offsets = array("Q")
+
+    with (index_dir / "docs.jsonl").open("wb") as docs_file:
+        for doc_id, doc in enumerate(iter_corpus_chunks(corpus_dir, max_chars)):
+            terms = index_terms(f"{doc['title']}\n{doc['text']}")
+            for term, tf in Counter(terms).items():
+                postings[term].append((doc_id, tf))
+            doc_lens.append(len(terms))
+            doc_offsets.append(docs_file.tell())
+            docs_file.write(json.dumps(doc, ensure_ascii=False).encode() + b"\n")
+
+    vocab = {}
+    flat = array("I")
+    for term in sorted(postings):
+        vocab[term] = [len(flat) // 2, len(postings[term])]
+        for doc_id, tf in postings[term]:
+            flat.extend((doc_id, tf))
+
+    with (index_dir / "postings.bin").open("wb") as f:
+        flat.tofile(f)
+    with (index_dir / "doclens.bin").open("wb") as f:
+        doc_lens.tofile(f)
+    with (index_dir / "docs.idx").open("wb") as f:
+        doc_offsets.tofile(f)
+
+    n_docs = len(doc_lens)
+    meta = {
+        "version": INDEX_VERSION,
+        "corpus": str(corpus_dir),
+        "n_docs": n_docs,
+        "avgdl": (sum(doc_lens) / n_docs) if n_docs else 0.0,
+        "vocab": vocab,
+    }
+    (index_dir / "meta.json").write_text(json.dumps(meta), encoding="utf-8")
+    return n_docs
+
+
+class LocalIndex:
+    """Read-only, memory-mapped view of an index built with `build_index`."""
+
+    def __init__(self, index_dir: Path, k1: float = 1.5, b: float = 0.75):
+        self.index_dir = Path(index_dir)
+        self.k1 = k1
+        self.b = b
+
+        meta = json.loads((self.index_dir / "meta.json").read_text(encoding="utf-8"))
+        if meta.get("version") != INDEX_VERSION:
+            raise ValueError(f"Unsupported index version: {meta.get('version')}")
+        self.n_docs: int = meta["n_docs"]
+        self.avgdl: float = meta["avgdl"] or 1.0
+        self.vocab: Dict[str, List[int]] = meta["vocab"]
+
+        self._files = []
+        self._maps = []
+        self._postings = self._map("postings.bin", "I")
+        self._doc_lens = self._map("doclens.bin", "I")
+        self._doc_offsets = self._map("docs.idx", "Q")
+        self._docs = self._map("docs.jsonl")
+
+    def _map(self, filename: str, fmt: Optional[str] = None) -> memoryview:
+        f = (self.index_dir / filename).open("rb")
+        self._files.append(f)
+        if f.seek(0, 2) == 0:
+            return memoryview(b"").cast(fmt) if fmt else memoryview(b"")
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapped)
+        self._maps.append((mapped, view))
+        return view.cast(fmt) if fmt else view
+
+    def close(self) -> None:
+        for view in (self._postings, self._doc_lens, self._doc_offsets, self._docs):
+            view.release()
+        for mapped, view in self._maps:
+            view.release()
+            mapped.close()
+        for f in self._files:
+            f.close()
+        self._maps = []
+        self._files = []
+
+    def document(self, doc_id: int) -> Dict[str, str]:
+        """Read a single document from the memory-mapped document store."""
+        start = self._doc_offsets[doc_id]
+        end = (
+            self._doc_offsets[doc_id + 1]
+            if doc_id + 1 < len(self._doc_offsets)
+            else len(self._docs)
+        )
+        return json.loads(bytes(self._docs[start:end]))
+
+    def search(self, query: str, num_results: int = 5) -> List[Tuple[float, int]]:
+        """Score documents containing any query term.
+
+        Returns:
+            Up to `num_results` (score, doc_id) tuples, best first
+        """
+        scores: Dict[int, float] = defaultdict(float)
+        for term in dict.fromkeys(index_terms(query)):
+            entry = self.vocab.get(term)
+            if not entry:
+                continue
+            offset, df = entry
+            term_idf = idf(self.n_docs, df)
+            pairs = self._postings[offset * 2 : (offset + df) * 2]
+            for i in range(0, len(pairs), 2):
+                doc_id, tf = pairs[i], pairs[i + 1]
+                norm = self.k1 * (
+                    1 - self.b + self.b * self._doc_lens[doc_id] / self.avgdl
+                )
+                scores[doc_id] += term_idf * tf * (self.k1 + 1) / (tf + norm)
+        return heapq.nlargest(
+            num_results, ((score, doc_id) for doc_id, score in scores.items())
+        )
+
@@ -0,0 +1,214 @@
+import math
+import re
+from collections import Counter
+from typing import Callable, Iterable, List, Optional, Sequence, Tuple
+
+# Lowercased word runs, plus single CJK ideographs (which are not space-separated)
+_TOKEN_PATTERN = re.compile(r"[a-z0-9_]+|[一-鿿]")
+_SENTENCE_PATTERN = re.compile(r"(?<=[.!?。！？;；])\s+|\n+")
+
+STOPWORDS = frozenset(
+    """a an and are as at be by for from has have how in is it its of on or that
+    the this to was were what when where which who why will with you your""".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase terms, dropping common English stopwords."""
+    if not text:
+        return []
+    return [t for t in _TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+
+
+def split_sentences(text: str) -> List[str]:
+    """Split text into sentences on terminal punctuation and line breaks."""
+    return [s.strip() for s in _SENTENCE_PATTERN.split(text or "") if s.strip()]
+
+
+class BM25:
+    """Okapi BM25 scorer over an in-memory list of tokenized documents."""
+
+    def __init__(
+        self, documents: Sequence[Sequence[str]], k1: float = 1.5, b: float = 0.75
+    ):
+        self.k1 = k1
+        self.b = b
+        self.doc_freqs = [Counter(doc) for doc in documents]
+        self.doc_lens = [len(doc) for doc in documents]
+        self.avgdl = (sum(self.doc_lens) / len(self.doc_lens)) if documents else 0.0
+        df = Counter(term for freqs in self.doc_freqs for term in freqs)
+        self.idf = {term: idf(len(documents), n) for term, n in df.items()}
+
+    def score(self, query_terms: Iterable[str], index: int) -> float:
+        """Score a single document against the query terms."""
+        freqs = self.doc_freqs[index]
+        norm = self.k1 * (
+            1 - self.b + self.b * self.doc_lens[index] / (self.avgdl or 1)
+        )
+        total = 0.0
+        for term in query_terms:
+            tf = freqs.get(term)
+            if tf:
+                total += self.idf[term] * tf * (self.k1 + 1) / (tf + norm)
+        return total
+
+    def scores(self, query_terms: Iterable[str]) -> List[float]:
+        """Score every document against the query terms."""
+        terms = list(dict.fromkeys(query_terms))
+        return [self.score(terms, i) for i in range(len(self.doc_freqs))]
+
+
+def idf(n_docs: int, doc_freq: int) -> float:
+    """BM25 inverse document frequency (the non-negative "plus one" variant)."""
+    return math.log(1 + (n_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+
+
+class PassageRanker:
+    """Rank overlapping sentence windows of a page against a query with BM25.
+
+    Used to keep only the answer-bearing parts of fetched web pages so that tool
+    observations stay small.
+    """
+
+    def __init__(
+        self, window: int = 3, stride: int = 2, k1: float = 1.5, b: float = 0.75
+    ):
+        self.window = max(1, window)
+        self.stride = max(1, min(stride, self.window))
+        self.k1 = k1
+        self.b = b
+
+    def _windows(self, sentences: List[str]) -> List[Tuple[int, int]]:
+        """Return [start, end) sentence spans covering the whole text."""
+        if len(sentences) <= self.window:
+            return [(0, len(sentences))]
+        spans = [
+            (start, start + self.window)
+            for start in range(0, len(sentences) - self.window + 1, self.stride)
+        ]
+        if spans[-1][1] < len(sentences):
+            spans.append((len(sentences) - self.window, len(sentences)))
+        return spans
+
+    def rank(self, query: str, text: str) -> List[Tuple[float, int, int, str]]:
+        """Rank passages of `text` for `query`.
+
+        Returns:
+            (score, start, end, passage) tuples sorted by descending score, where
+            start/end are sentence indices of the window.
+        """
+        sentences = split_sentences(text)
+        if not sentences:
+            return []
+        spans = self._windows(sentences)
+        passages = [" ".join(sentences[start:end]) for start, end in spans]
+        bm25 = BM25([tokenize(p) for p in passages], k1=self.k1, b=self.b)
+        scores = bm25.scores(tokenize(query))
+        ranked = [
+            (score, start, end, passage)
+            for score, (start, end), passage in zip(scores, spans, passages)
+        ]
+        # Stable sort keeps earlier passages first on ties
+        ranked.sort(key=lambda item: -item[0])
+        return ranked
+
+    def extract(
+        self,
+        query: str,
+        text: str,
+        max_passages: int = 3,
+        token_budget: int = 256,
+        count_tokens: Optional[Callable[[str], int]] = None,
+    ) -> List[str]:
+        """Select the best non-overlapping passages that fit into a token budget.
+
+        Args:
+            query: The search query used for scoring
+            text: The page text to extract passages from
+            max_passages: Maximum number of passages to keep
+            token_budget: Maximum number of tokens for all kept passages together
+            count_tokens: Token counting function, defaults to a whitespace estimate
+
+        Returns:
+            The selected passages in document order
+        """
+        count_tokens = count_tokens or (lambda s: len(s.split()))
+        ranked = self.rank(query, text)
+        if not ranked:
+            return []
+
+        # Fall back to the page lead when no query term matches anywhere
+        if ranked[0][0] <= 0:
+            ranked = sorted(ranked, key=lambda item: item[1])
+
+        selected: List[Tuple[int, str]] = []
+        used_sentences = set()
+        remaining = token_budget
+        for score, start, end, passage in ranked:
+            if len(selected) >= max_passages or remaining <= 0:
+                break
+            if score <= 0 and selected:
+                break
+            if used_sentences.intersection(range(start, end)):
+                continue
+            tokens = count_tokens(passage)
+            if tokens > remaining:
+                if selected:
+                    continue
+                # Always return something: cut the best passage to the budget
+                passage = self._trim(query, passage, remaining, count_tokens)
+                tokens = remaining
+            selected.append((start, passage))
+            used_sentences.update(range(start, end))
+            remaining -= tokens
+
+        return [passage for _, passage in sorted(selected)]
+
+    def _trim(
+        self,
+        query: str,
+        passage: str,
+        budget: int,
+        count_tokens: Callable[[str], int],
+    ) -> str:
+        """Cut a passage to `budget` tokens around its best-matching sentence.
+
+        Neighbouring sentences are added while they fit. A best sentence that
+        does not fit on its own is cut to a run of words around its first
+        query term.
+        """
+        sentences = split_sentences(passage)
+        bm25 = BM25([tokenize(s) for s in sentences], k1=self.k1, b=self.b)
+        scores = bm25.scores(tokenize(query))
+        best = max(range(len(sentences)), key=lambda i: scores[i])
+        if count_tokens(sentences[best]) > budget:
+            return self._trim_words(query, sentences[best], budget, count_tokens)
+
+        start, end = best, best + 1
+        grown = True
+        while grown:
+            grown = False
+            for span in ((start - 1, end), (start, end + 1)):
+                if span[0] < 0 or span[1] > len(sentences):
+                    continue
+                if count_tokens(" ".join(sentences[span[0] : span[1]])) <= budget:
+                    start, end = span
+                    grown = True
+        return " ".join(sentences[start:end])
+
+    @staticmethod
+    def _trim_words(
+        query: str, sentence: str, budget: int, count_tokens: Callable[[str], int]
+    ) -> str:
+        words = sentence.split()
+        terms = set(tokenize(query))
+        hit = next(
+            (i for i, word in enumerate(words) if terms & set(tokenize(word))), 0
+        )
+        size = max(1, len(words) * budget // max(count_tokens(sentence), 1))
+        while True:
+            start = max(0, min(hit - size // 3, len(words) - size))
+            text = " ".join(words[start : start + size])
+            if size == 1 or count_tokens(text) <= budget:
+                return text
+            size -= 1
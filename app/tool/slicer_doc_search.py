@@ -0,0 +1,101 @@
+import asyncio
+import time
+from pathlib import Path
+from typing import ClassVar, Dict, Optional
+
+from app.config import WORKSPACE_ROOT, config
+from app.logger import logger
+from app.tool.base import BaseTool, ToolResult
+from app.tool.search.local_index import LocalIndex
+from app.tool.search.ranker import PassageRanker
+
+
+class SlicerDocSearch(BaseTool):
+    """Search a local, prebuilt index of 3D Slicer documentation and script snippets."""
+
+    name: str = "slicer_doc_search"
+    description: str = """Search the local 3D Slicer documentation and script repository.
+    Use this tool first for questions about the Slicer Python API (slicer.util, MRML node classes, modules).
+    It works offline and returns ranked documentation snippets in milliseconds."""
+    parameters: dict = {
+        "type": "object",
+        "properties": {
+            "query": {
+                "type": "string",
+                "description": "(required) Keywords or API names to look up, e.g. 'slicer.util.loadVolume' or 'set window level'.",
+            },
+            "num_results": {
+                "type": "integer",
+                "description": "(optional) The number of snippets to return. Default is 5.",
+                "default": 5,
+            },
+        },
+        "required": ["query"],
+    }
+    passage_ranker: PassageRanker = PassageRanker(window=4, stride=2)
+    snippet_words: int = 120
+
+    # Opened indexes are shared by all tool instances
+    _indexes: ClassVar[Dict[str, LocalIndex]] = {}
+
+    @staticmethod
+    def _index_path() -> Path:
+        path = (
+            getattr(config.search_config, "local_index_path", None)
+            if config.search_config
+            else None
+        )
+        return Path(path) if path else WORKSPACE_ROOT / "slicer_index"
+
+    def _get_index(self) -> Optional[LocalIndex]:
+        path = self._index_path()
+        index = self._indexes.get(str(path))
+        if index is None and (path / "meta.json").exists():
+            index = LocalIndex(path)
+            self._indexes[str(path)] = index
+            logger.info(f"📚 Opened local Slicer index at {path} ({index.n_docs} docs)")
+        return index
+
+    async def execute(self, query: str, num_results: int = 5) -> ToolResult:
+        """
+        Search the local Slicer documentation index.
+
+        Args:
+            query: The search query
+            num_results: The number of snippets to return (default: 5)
+
+        Returns:
+            A ToolResult with the ranked snippets
+        """
+        index = self._get_index()
+        if index is None:
+            return ToolResult(
+                error=f"Local Slicer index not found at {self._index_path()}. "
+                "Build it with `python -m app.tool.search build <corpus_dir>`."
+            )
+
+        start = time.perf_counter()
+        hits = index.search(query, num_results)
+        if not hits:
+            return ToolResult(
+                output=f"No local Slicer documentation found for '{query}'."
+            )
+
+        result_text = [f"Local Slicer documentation results for '{query}':"]
+        for i, (score, doc_id) in enumerate(hits, 1):
+            doc = index.document(doc_id)
+            snippet = " ... ".join(
+                self.passage_ranker.extract(
+                    query, doc["text"], max_passages=2, token_budget=self.snippet_words
+                )
+            )
+            result_text.append(f"\n{i}. {doc['title']} ({doc['source']})")
+            result_text.append(f"   {snippet}")
+        logger.info(
+            f"📚 Local index search for '{query}' took {(time.perf_counter() - start) * 1000:.1f} ms"
+        )
+        return ToolResult(output="\n".join(result_text))
+
+
+if __name__ == "__main__":
+    print(asyncio.run(SlicerDocSearch().execute(query="load volume from file")))
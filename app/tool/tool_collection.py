@@ -1,31 +1,89 @@
 """Collection classes for managing multiple tools."""
 
-from typing import Any, Dict, List
+import copy
+from typing import Any, Dict, List, Tuple
 
 from app.exceptions import ToolError
 from app.tool.base import BaseTool, ToolFailure, ToolResult
 
 
+class FrozenDict(dict):
+    """A dict that refuses changes, still serialized like any dict.
+
+    Copies (`copy.copy`, `copy.deepcopy`, `dict(...)`) are ordinary dicts.
+    """
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("Tool params are shared and read-only, copy them to modify")
+
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __copy__(self) -> Dict[str, Any]:
+        return dict(self)
+
+    def __deepcopy__(self, memo) -> Dict[str, Any]:
+        return {key: copy.deepcopy(value, memo) for key, value in self.items()}
+
+
+def freeze(value: Any) -> Any:
+    """Deep read-only copy of JSON-like data: dicts become FrozenDicts, lists tuples."""
+    if isinstance(value, dict):
+        return FrozenDict((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
 class ToolCollection:
-    """A collection of defined tools."""
+    """A collection of defined tools.
+
+    Tool params are memoized per exclusion set and shared between callers, so
+    they are frozen: changing one raises TypeError. `version` is bumped
+    whenever the set of tools is replaced or extended, which also drops the
+    memoized params.
+    """
 
     class Config:
         arbitrary_types_allowed = True
 
     def __init__(self, *tools: BaseTool):
+        self.version = 0
+        self._params_cache: Dict[Tuple[str, ...], Tuple[Dict[str, Any], ...]] = {}
         self.tools = tools
         self.tool_map = {tool.name: tool for tool in tools}
 
     def __iter__(self):
         return iter(self.tools)
 
-    def to_params(self) -> List[Dict[str, Any]]:
-        return [tool.to_param() for tool in self.tools]
+    @property
+    def tools(self) -> Tuple[BaseTool, ...]:
+        return self._tools
 
-    def to_params_exclude(self, *exclude: str) -> List[Dict[str, Any]]:
+    @tools.setter
+    def tools(self, tools: Tuple[BaseTool, ...]) -> None:
+        self._tools = tuple(tools)
+        self.version += 1
+        self._params_cache = {}
+
+    def to_params(self) -> Tuple[Dict[str, Any], ...]:
+        return self._cached_params(())
+
+    def to_params_exclude(self, *exclude: str) -> Tuple[Dict[str, Any], ...]:
         if not exclude:
-            exclude = ["terminate"]
-        return [tool.to_param() for tool in self.tools if tool.name not in exclude]
+            exclude = ("terminate",)
+        return self._cached_params(tuple(sorted(exclude)))
+
+    def _cached_params(self, exclude: Tuple[str, ...]) -> Tuple[Dict[str, Any], ...]:
+        params = self._params_cache.get(exclude)
+        if params is None:
+            params = tuple(
+                freeze(tool.to_param())
+                for tool in self.tools
+                if tool.name not in exclude
+            )
+            self._params_cache[exclude] = params
+        return params
 
     async def execute(
         self, *, name: str, tool_input: Dict[str, Any] = None
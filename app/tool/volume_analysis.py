@@ -0,0 +1,134 @@
+import asyncio
+import json
+from typing import Any, Optional
+
+from app.logger import logger
+from app.slicer.shm import SharedVolume, VolumeDescriptor
+from app.tool.base import BaseTool, ToolResult
+
+
+class VolumeAnalysis(BaseTool):
+    """Compute intensity statistics of a Slicer volume from shared memory.
+
+    The volume is exported by the Slicer MCP server's `export_volume` tool and
+    mapped here without copying, so voxels never travel through JSON-RPC.
+    """
+
+    name: str = "analyze_volume"
+    description: str = """Compute intensity statistics of a volume loaded in 3D Slicer.
+    Returns shape, spacing, min/max/mean/std and, when a threshold range is given,
+    the number of voxels and the physical volume (mm³ and mL) inside that range.
+    Use this for questions like "what is the mean HU" or "how much of the volume is above 300 HU"."""
+    parameters: dict = {
+        "type": "object",
+        "properties": {
+            "node": {
+                "type": "string",
+                "description": "(required) Name or ID of the volume node.",
+            },
+            "threshold_min": {
+                "type": "number",
+                "description": "(optional) Lower bound of the intensity range to measure.",
+            },
+            "threshold_max": {
+                "type": "number",
+                "description": "(optional) Upper bound of the intensity range to measure.",
+            },
+        },
+        "required": ["node"],
+    }
+    # MCPClients connected to the Slicer MCP server
+    mcp_clients: Optional[Any] = None
+
+    def _find_mcp_tool(self, tool_name: str) -> Optional[str]:
+        for full_name, tool in self.mcp_clients.tool_map.items():
+            if tool.name == tool_name:
+                return full_name
+        return None
+
+    async def _call_mcp(self, full_name: str, **kwargs) -> dict:
+        result = await self.mcp_clients.execute(name=full_name, tool_input=kwargs)
+        if result.error:
+            raise RuntimeError(result.error)
+        return json.loads(result.output)
+
+    async def execute(
+        self,
+        node: str,
+        threshold_min: Optional[float] = None,
+        threshold_max: Optional[float] = None,
+    ) -> ToolResult:
+        """
+        Export a volume, compute statistics on the shared array and release it.
+
+        Args:
+            node: Name or ID of the volume node
+            threshold_min: Optional lower bound of the measured intensity range
+            threshold_max: Optional upper bound of the measured intensity range
+
+        Returns:
+            A ToolResult with the statistics as JSON
+        """
+        try:
+            import numpy  # noqa: F401
+        except ImportError:
+            return ToolResult(error="NumPy is required for volume analysis.")
+
+        export_tool = self.mcp_clients and self._find_mcp_tool("export_volume")
+        if not export_tool:
+            return ToolResult(error="The Slicer MCP server does not export volumes.")
+        release_tool = export_tool[: -len("export_volume")] + "release_volume"
+
+        try:
+            response = await self._call_mcp(export_tool, node=node)
+        except Exception as e:
+            return ToolResult(error=f"Failed to export volume '{node}': {e}")
+        if not response.get("success"):
+            return ToolResult(error=response.get("error", "Failed to export volume"))
+
+        descriptor = VolumeDescriptor(**response["descriptor"])
+        try:
+            # Reductions over large arrays release the GIL, keep the loop responsive
+            stats = await asyncio.to_thread(
+                self._statistics, descriptor, threshold_min, threshold_max
+            )
+        except Exception as e:
+            return ToolResult(error=f"Failed to analyze volume '{node}': {e}")
+        finally:
+            try:
+                await self._call_mcp(release_tool, shm_name=descriptor.shm_name)
+            except Exception as e:
+                # The statistics are still valid, the segment is freed at shutdown
+                logger.warning(
+                    f"Failed to release shared volume {descriptor.shm_name}: {e}"
+                )
+        return ToolResult(output=json.dumps(stats))
+
+    @staticmethod
+    def _statistics(
+        descriptor: VolumeDescriptor,
+        threshold_min: Optional[float],
+        threshold_max: Optional[float],
+    ) -> dict:
+        import numpy as np
+
+        with SharedVolume(descriptor) as volume:
+            array = volume.array
+            stats = {
+                "node": descriptor.node_name or descriptor.node_id,
+                "shape": list(descriptor.shape),
+                "spacing": list(descriptor.spacing),
+                "min": float(array.min()),
+                "max": float(array.max()),
+                "mean": float(array.mean(dtype=np.float64)),
+                "std": float(array.std(dtype=np.float64)),
+            }
+            if threshold_min is not None or threshold_max is not None:
+                lower = -np.inf if threshold_min is None else threshold_min
+                upper = np.inf if threshold_max is None else threshold_max
+                count = int(np.count_nonzero((array >= lower) & (array <= upper)))
+                stats["threshold_voxels"] = count
+                stats["threshold_volume_mm3"] = count * volume.voxel_volume
+                stats["threshold_volume_ml"] = count * volume.voxel_volume / 1000
+            del array
+        return stats
@@ -7,15 +7,20 @@ from pydantic import BaseModel, ConfigDict, Field, model_validator
 from tenacity import retry, stop_after_attempt, wait_exponential
 
 from app.config import config
+from app.llm import LLM
 from app.logger import logger
 from app.tool.base import BaseTool, ToolResult
 from app.tool.search import (
     GoogleSearchEngine,
+    PassageRanker,
     WebSearchEngine,
 )
 from app.tool.search.base import SearchItem
 from app.schema import Payload
 
+# Characters of page content shown when no passages were extracted
+CONTENT_PREVIEW_CHARS = 1000
+
 
 class SearchResult(BaseModel):
     """Represents a single search result returned by a search engine."""
@@ -32,6 +37,10 @@ class SearchResult(BaseModel):
     raw_content: Optional[str] = Field(
         default=None, description="Raw content from the search result page if available"
     )
+    passages: List[str] = Field(
+        default_factory=list,
+        description="Query-relevant passages extracted from the raw content",
+    )
 
     def __str__(self) -> str:
         """String representation of a search result."""
@@ -79,10 +88,17 @@ class SearchResponse(ToolResult):
             if result.description.strip():
                 result_text.append(f"   Description: {result.description}")
 
-            # Add content preview if available
-            if result.raw_content:
-                content_preview = result.raw_content[:1000].replace("\n", " ").strip()
-                if len(result.raw_content) > 1000:
+            # Prefer ranked passages over a blind content preview
+            if result.passages:
+                result_text.append("   Relevant passages:")
+                result_text.extend(f"   - {passage}" for passage in result.passages)
+            elif result.raw_content:
+                content_preview = (
+                    result.raw_content[:CONTENT_PREVIEW_CHARS]
+                    .replace("\n", " ")
+                    .strip()
+                )
+                if len(result.raw_content) > CONTENT_PREVIEW_CHARS:
                     content_preview += "..."
                 result_text.append(f"   Content: {content_preview}")
 
@@ -192,6 +208,7 @@ class WebSearch(BaseTool):
         "google": GoogleSearchEngine(),
     }
     content_fetcher: WebContentFetcher = WebContentFetcher()
+    passage_ranker: PassageRanker = PassageRanker()
 
     async def execute(
         self,
@@ -251,6 +268,7 @@ class WebSearch(BaseTool):
                 # Fetch content if requested
                 if fetch_content:
                     results = await self._fetch_content_for_results(results)
+                    self._extract_passages(query, results)
 
                 # Return a successful structured response
                 return SearchResponse(
@@ -357,6 +375,42 @@ class WebSearch(BaseTool):
                 result.raw_content = content
         return result
 
+    def _extract_passages(self, query: str, results: List[SearchResult]) -> None:
+        """Keep only the query-relevant passages of fetched pages within a token budget."""
+        max_passages = (
+            getattr(config.search_config, "max_passages", 3)
+            if config.search_config
+            else 3
+        )
+        token_budget = (
+            getattr(config.search_config, "passage_token_budget", 256)
+            if config.search_config
+            else 256
+        )
+        count_tokens = LLM().count_tokens
+
+        tokens_before = tokens_after = 0
+        for result in results:
+            if not result.raw_content:
+                continue
+            result.passages = self.passage_ranker.extract(
+                query,
+                result.raw_content,
+                max_passages=max_passages,
+                token_budget=token_budget,
+                count_tokens=count_tokens,
+            )
+            # Against the content preview the observation shows otherwise
+            tokens_before += count_tokens(result.raw_content[:CONTENT_PREVIEW_CHARS])
+            tokens_after += sum(count_tokens(p) for p in result.passages)
+
+        if tokens_before:
+            logger.info(
+                f"📉 Passage extraction for '{query}': {tokens_before} -> {tokens_after} "
+                f"content tokens vs. the preview "
+                f"({100 * (1 - tokens_after / tokens_before):.1f}% saved)"
+            )
+
     def _get_engine_order(self) -> List[str]:
         """Determines the order in which to try search engines."""
         preferred = (
@@ -0,0 +1,87 @@
+"""Round-trip latency of MCP tool calls over SSE vs. the in-memory transport.
+
+Both transports talk to the same FastMCP server inside this process, so the
+difference is the cost of HTTP, the loopback socket and SSE framing.
+
+    python -m benchmarks.mcp_transport [--calls 500] [--port 6667]
+"""
+
+import argparse
+import asyncio
+import statistics
+import threading
+import time
+from typing import List
+
+from mcp.server.fastmcp import FastMCP
+
+from app.tool.mcp import MCPClients
+
+
+def build_server(port: int) -> FastMCP:
+    server = FastMCP(name="TransportBenchmark", port=port, log_level="WARNING")
+
+    @server.tool()
+    def echo(text: str) -> str:
+        """Return the given text."""
+        return text
+
+    return server
+
+
+async def measure(clients: MCPClients, calls: int) -> List[float]:
+    # Warm up connection pools and lazy imports
+    for _ in range(10):
+        await clients.execute(name="mcp_echo", tool_input={"text": "warmup"})
+
+    latencies = []
+    for i in range(calls):
+        start = time.perf_counter()
+        result = await clients.execute(
+            name="mcp_echo", tool_input={"text": f"call {i}"}
+        )
+        latencies.append((time.perf_counter() - start) * 1000)
+        assert result.output == f"call {i}", result
+    return latencies
+
+
+def report(name: str, latencies: List[float]) -> None:
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(
+        f"{name:<8} mean {statistics.mean(latencies):7.3f} ms  "
+        f"p50 {statistics.median(latencies):7.3f} ms  p95 {p95:7.3f} ms"
+    )
+
+
+async def run(calls: int, port: int) -> None:
+    server = build_server(port)
+    thread = threading.Thread(target=server.run, kwargs={"transport": "sse"})
+    thread.daemon = True
+    thread.start()
+    await asyncio.sleep(1)  # let uvicorn bind the port
+
+    sse = MCPClients()
+    await sse.connect_sse(f"http://localhost:{port}/sse")
+    sse_latencies = await measure(sse, calls)
+    await sse.disconnect()
+
+    memory = MCPClients()
+    await memory.connect_memory(server)
+    memory_latencies = await measure(memory, calls)
+    await memory.disconnect()
+
+    print(f"{calls} echo tool calls per transport")
+    report("sse", sse_latencies)
+    report("memory", memory_latencies)
+    print(
+        f"speedup  {statistics.mean(sse_latencies) / statistics.mean(memory_latencies):.1f}x"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=500)
+    parser.add_argument("--port", type=int, default=6667)
+    args = parser.parse_args()
+    asyncio.run(run(args.calls, args.port))
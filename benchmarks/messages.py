@@ -0,0 +1,198 @@
+"""Pydantic messages vs. the slotted records used on the hot paths.
+
+- Streaming: assembling a completion from its deltas with the former
+  `MessageChunk` (a new model and a copy of the text so far per delta, plus a
+  `Payload` model per frame) vs. `StreamAccumulator` and `Payload.write_message`.
+- Memory: bytes per message held and construction / `to_dict` cost of
+  `Message` vs. `MessageRecord`.
+
+    python -m benchmarks.messages [--deltas 2000] [--messages 10000]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import time
+import tracemalloc
+from typing import Callable, List
+
+from openai.types.chat.chat_completion_chunk import (
+    ChoiceDelta,
+    ChoiceDeltaToolCall,
+    ChoiceDeltaToolCallFunction,
+)
+
+from app.schema import (
+    FunctionRecord,
+    Message,
+    MessageRecord,
+    Payload,
+    Role,
+    StreamAccumulator,
+    ToolCall,
+    ToolCallRecord,
+)
+
+
+class LegacyChunk(Message):
+    """The former `MessageChunk`, kept here as the baseline."""
+
+    def __init__(self, content="", **kwargs):
+        super().__init__(role=Role.ASSISTANT)
+        self.content = content
+        self.tool_calls = kwargs.get("tool_calls", None)
+
+    def __add__(self, other):
+        new_tool_calls = self.tool_calls
+        if other.tool_calls is not None:
+            new_tool_calls = list(self.tool_calls or [])
+            for delta in other.tool_calls:
+                while len(new_tool_calls) <= delta.index:
+                    new_tool_calls.append(None)
+                if new_tool_calls[delta.index] is None:
+                    new_tool_calls[delta.index] = ToolCall(
+                        index=delta.index,
+                        id=delta.id,
+                        type=delta.type,
+                        function=delta.function.model_dump(),
+                    )
+                elif delta.function.arguments is not None:
+                    new_tool_calls[
+                        delta.index
+                    ].function.arguments += delta.function.arguments
+        return self.__class__(
+            content=self.content + other.content, tool_calls=new_tool_calls
+        )
+
+
+def make_deltas(n: int) -> List[ChoiceDelta]:
+    text = [ChoiceDelta(content=f"token{i} ") for i in range(n // 2)]
+    first = ChoiceDeltaToolCall(
+        index=0,
+        id="call_0",
+        type="function",
+        function=ChoiceDeltaToolCallFunction(
+            name="create_chat_completion", arguments=""
+        ),
+    )
+    arguments = [
+        ChoiceDeltaToolCall(
+            index=0, function=ChoiceDeltaToolCallFunction(arguments=f"arg{i} ")
+        )
+        for i in range(n - len(text) - 1)
+    ]
+    return (
+        text
+        + [ChoiceDelta(tool_calls=[first])]
+        + [ChoiceDelta(tool_calls=[call]) for call in arguments]
+    )
+
+
+def legacy_stream(deltas: List[ChoiceDelta]) -> Message:
+    completion = LegacyChunk()
+    for delta in deltas:
+        content = delta.content or ""
+        Payload(content or "").write_structed_content()
+        completion += LegacyChunk(content=content, tool_calls=delta.tool_calls)
+    return completion
+
+
+def record_stream(deltas: List[ChoiceDelta]) -> Message:
+    completion = StreamAccumulator()
+    for delta in deltas:
+        content = delta.content or ""
+        Payload.write_message(content)
+        completion.add(content, delta.tool_calls)
+    return completion.to_message()
+
+
+def timed(fn: Callable, *args, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def footprint(build: Callable[[int], object], n: int) -> float:
+    """Bytes allocated per object, the message text being shared."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objects = [build(i) for i in range(n)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del objects
+    return (after - before) / n
+
+
+TEXT = "Observed output of cmd `slicer_doc_search` executed:\n" + "text " * 100
+
+
+def build_message(i: int) -> Message:
+    if i % 2:
+        return Message.tool_message(TEXT, name="slicer_doc_search", tool_call_id="c1")
+    call = ToolCall(id="c1", function={"name": "slicer_doc_search", "arguments": "{}"})
+    return Message(role="assistant", content=TEXT, tool_calls=[call])
+
+
+def build_record(i: int) -> MessageRecord:
+    if i % 2:
+        return MessageRecord("tool", TEXT, None, "slicer_doc_search", "c1")
+    call = ToolCallRecord("c1", FunctionRecord("slicer_doc_search", "{}"))
+    return MessageRecord("assistant", TEXT, (call,))
+
+
+def run(n_deltas: int, n_messages: int) -> dict:
+    deltas = make_deltas(n_deltas)
+    with contextlib.redirect_stdout(io.StringIO()):
+        legacy = legacy_stream(deltas)
+        current = record_stream(deltas)
+        assert legacy.content == current.content
+        assert [c.model_dump() for c in legacy.tool_calls] == [
+            c.model_dump() for c in current.tool_calls
+        ]
+        stream_legacy = timed(legacy_stream, deltas)
+        stream_records = timed(record_stream, deltas)
+
+    messages = [build_message(i) for i in range(n_messages)]
+    records = [MessageRecord.from_message(m) for m in messages]
+    build_messages = timed(lambda: [build_message(i) for i in range(n_messages)])
+    build_records = timed(lambda: [build_record(i) for i in range(n_messages)])
+    dump_messages = timed(lambda: [m.model_dump(exclude_none=True) for m in messages])
+    dump_records = timed(lambda: [r.to_dict() for r in records])
+    per_message = footprint(build_message, n_messages)
+    per_record = footprint(build_record, n_messages)
+
+    def us(seconds: float, n: int) -> float:
+        return round(seconds / n * 1e6, 2)
+
+    return {
+        "stream_deltas": n_deltas,
+        "stream_ms": {
+            "message_chunk": round(stream_legacy * 1000, 1),
+            "accumulator": round(stream_records * 1000, 1),
+        },
+        "messages": n_messages,
+        "build_us": {
+            "message": us(build_messages, n_messages),
+            "record": us(build_records, n_messages),
+        },
+        "to_dict_us": {
+            "message_model_dump": us(dump_messages, n_messages),
+            "record": us(dump_records, n_messages),
+        },
+        "bytes_per_message": {
+            "message": round(per_message),
+            "record": round(per_record),
+        },
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--deltas", type=int, default=2000)
+    parser.add_argument("--messages", type=int, default=10000)
+    args = parser.parse_args()
+    print(json.dumps(run(args.deltas, args.messages), indent=2))
@@ -0,0 +1,127 @@
+"""Append and resume cost of the persisted session store.
+
+Writes a synthetic tool-using conversation through `Memory` into a
+`SessionStore`, once with batched fsyncs and once with an fsync per record,
+then times rebuilding the memory from the snapshot and log tail (the "resume"
+command) and from the log alone. Also compares the on-disk size with one JSON
+line per message.
+
+    python -m benchmarks.session_store [--messages 1000] [--runs 20] [--dir /tmp/x]
+"""
+
+import argparse
+import json
+import shutil
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from typing import List
+
+from app.logger import logger
+from app.schema import Function, Memory, Message, ToolCall
+from app.session_store import SessionStore
+
+
+def conversation(n_messages: int) -> List[Message]:
+    messages = []
+    for i in range(n_messages):
+        kind = i % 3
+        if kind == 0:
+            messages.append(Message.user_message(f"Question {i}: " + "where " * 30))
+        elif kind == 1:
+            call = ToolCall(
+                id=f"call_{i}",
+                function=Function(
+                    name="slicer_doc_search",
+                    arguments=json.dumps({"query": f"segment editor {i}"}),
+                ),
+            )
+            messages.append(
+                Message.from_tool_calls(
+                    tool_calls=[call], content="Let me look that up. " * 15
+                )
+            )
+        else:
+            messages.append(
+                Message.tool_message(
+                    "Observed output of cmd `slicer_doc_search` executed:\n"
+                    + "result text " * 120,
+                    name="slicer_doc_search",
+                    tool_call_id=f"call_{i - 1}",
+                )
+            )
+    return messages
+
+
+def write(store: SessionStore, session_id: str, messages: List[Message]) -> float:
+    """Seconds per appended message."""
+    memory = Memory(max_messages=len(messages))
+    log = store.log(session_id)
+    memory.persist_to(log)
+    start = time.perf_counter()
+    for message in messages:
+        memory.add_message(message)
+    log.close()
+    return (time.perf_counter() - start) / len(messages)
+
+
+def time_load(store: SessionStore, session_id: str, n: int, runs: int) -> List[float]:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        loaded = store.load(session_id, max_messages=n)
+        timings.append((time.perf_counter() - start) * 1000)
+    assert len(loaded) == n, len(loaded)
+    return timings
+
+
+def run(n_messages: int, runs: int, root: Path) -> dict:
+    messages = conversation(n_messages)
+    batched = SessionStore(root / "batched")
+    per_record = SessionStore(root / "per_record", sync_every=1, sync_interval=0)
+    log_only = SessionStore(root / "log_only", snapshot_every=n_messages + 1)
+
+    append_batched = write(batched, "bench", messages)
+    append_per_record = write(per_record, "bench", messages)
+    write(log_only, "bench", messages)
+
+    loaded = batched.load("bench", max_messages=n_messages)
+    assert [m.to_dict() for m in loaded] == [m.to_dict() for m in messages]
+
+    resume = time_load(batched, "bench", n_messages, runs)
+    replay = time_load(log_only, "bench", n_messages, runs)
+    on_disk = sum(p.stat().st_size for p in (root / "batched" / "bench").iterdir())
+    as_json = sum(len(m.model_dump_json()) + 1 for m in messages)
+    return {
+        "messages": n_messages,
+        "append_us_batched_fsync": round(append_batched * 1e6, 1),
+        "append_us_fsync_per_record": round(append_per_record * 1e6, 1),
+        "resume_ms_snapshot_and_tail": {
+            "median": round(statistics.median(resume), 2),
+            "max": round(max(resume), 2),
+        },
+        "resume_ms_log_only": {
+            "median": round(statistics.median(replay), 2),
+            "max": round(max(replay), 2),
+        },
+        "bytes_on_disk": on_disk,
+        "bytes_as_json_lines": as_json,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument(
+        "--dir", type=Path, help="Store directory, a temp dir by default"
+    )
+    args = parser.parse_args()
+    logger.remove()
+    root = args.dir or Path(tempfile.mkdtemp(prefix="session_store_"))
+    try:
+        print(json.dumps(run(args.messages, args.runs, root), indent=2))
+    finally:
+        if args.dir is None:
+            shutil.rmtree(root)
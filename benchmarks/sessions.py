@@ -0,0 +1,136 @@
+"""Chat sessions served by one agent process.
+
+Runs `SessionHost` with a scripted LLM that answers after a fixed latency and
+terminates, so the numbers show the host's own overhead: the Python heap held
+per open session, next to the resident size a separate agent process would
+cost, and the turn throughput of concurrent sessions vs. one conversation at
+a time.
+
+    python -m benchmarks.sessions [--sessions 200] [--turns 3] [--latency 0.05]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import resource
+import time
+import tracemalloc
+from typing import List, Optional
+
+from app.llm import LLM
+from app.logger import logger
+from app.schema import Function, Message, ToolCall
+from app.slicer.agent import SlicerAgent
+from app.slicer.sessions import SessionHost
+
+
+class ScriptedLLM(LLM):
+    """Answers every request with a terminate call after `latency` seconds."""
+
+    def __new__(cls, latency: float):
+        return object.__new__(cls)
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.requests = 0
+
+    async def ask(self, messages, **kwargs) -> Message:
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        call = ToolCall(
+            id=f"call_{self.requests}",
+            function=Function(name="terminate", arguments='{"status": "success"}'),
+        )
+        return Message.from_tool_calls(tool_calls=[call], content="Done")
+
+
+async def run_frames(host: SessionHost, frames: List[dict], on_drained=None) -> float:
+    """Feed `frames` to the host, returns the seconds until all turns finished."""
+    pending = iter(frames)
+    start = time.perf_counter()
+
+    async def read_message() -> Optional[dict]:
+        frame = next(pending, None)
+        if frame is not None:
+            return frame
+        await asyncio.gather(*(s.queue.join() for s in host.sessions.values()))
+        if on_drained is not None:
+            on_drained()
+        raise EOFError
+
+    await host.serve(read_message)
+    return time.perf_counter() - start
+
+
+def frames_for(sessions: int, turns: int) -> List[dict]:
+    # Interleaved like independent widgets sending at the same time
+    return [
+        {"type": "message", "content": f"question {turn}", "session_id": f"s{index}"}
+        for turn in range(turns)
+        for index in range(sessions)
+    ]
+
+
+async def run(sessions: int, turns: int, latency: float, max_active: int) -> dict:
+    template = SlicerAgent(llm=ScriptedLLM(latency), max_steps=5)
+    rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    # Heap per session: open every session and keep its conversation
+    host = SessionHost(
+        template, max_sessions=sessions, max_active=max_active, max_pending=turns
+    )
+    heap = {}
+    tracemalloc.start()
+    base = tracemalloc.take_snapshot()
+    await run_frames(
+        host,
+        frames_for(sessions, turns),
+        on_drained=lambda: heap.update(snapshot=tracemalloc.take_snapshot()),
+    )
+    tracemalloc.stop()
+    per_session = (
+        sum(stat.size_diff for stat in heap["snapshot"].compare_to(base, "filename"))
+        / sessions
+    )
+
+    # Throughput: concurrent sessions vs. one conversation at a time
+    total = sessions * turns
+    host = SessionHost(
+        template, max_sessions=sessions, max_active=max_active, max_pending=turns
+    )
+    concurrent = await run_frames(host, frames_for(sessions, turns))
+    serial_turns = min(total, 50)
+    host = SessionHost(template, max_sessions=1, max_active=1, max_pending=serial_turns)
+    serial = await run_frames(host, frames_for(1, serial_turns)) * total / serial_turns
+
+    return {
+        "sessions": sessions,
+        "turns_per_session": turns,
+        "llm_latency_s": latency,
+        "max_active": max_active,
+        "process_rss_mb": round(rss_mb, 1),
+        "heap_per_session_kb": round(per_session / 1024, 1),
+        "sessions_per_process_rss": int(rss_mb * 1024 * 1024 / per_session),
+        "concurrent_s": round(concurrent, 2),
+        "concurrent_turns_per_s": round(total / concurrent, 1),
+        "one_at_a_time_s": round(serial, 2),
+        "speedup": round(serial / concurrent, 1),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--max-active", type=int, default=32)
+    args = parser.parse_args()
+    logger.remove()
+    # Replies go to stdout in the real process, keep them out of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = asyncio.run(
+            run(args.sessions, args.turns, args.latency, args.max_active)
+        )
+    print(json.dumps(results, indent=2))
@@ -15,9 +15,12 @@ except ImportError as e:
 
 if __name__ == "__main__":
     server = MCPServer(port=6666)
-    server.start()
+    # server.start()  # only needed to serve clients in other processes over SSE
     # agent = SlicerAgent()
-    agent = SlicerAgentWithMCP()  # must start Slicer Web Server first
+    # The server lives in this process, so connect to it in-memory instead of SSE
+    agent = SlicerAgentWithMCP(
+        mcp_server=server.mcp
+    )  # must start Slicer Web Server first
     asyncio.run(agent.run_loop())
     server.stop()
 
@@ -27,4 +30,7 @@ if __name__ == "__main__":
 # {"content": "How many nodes are there in Slicer", "type": "message"}
 # {"content": "How to use python code to print these nodes in Slicer?", "type": "message"}
 # {"content": "What's the weather of 2025.04.29 in Shanghai?", "type": "message"}
-# {"content": "clear", "type": "command"}
\ No newline at end of file
+# {"content": "clear", "type": "command"}
+# {"content": "who are you?", "type": "message", "session_id": "widget-1"}
+# {"content": "close", "type": "command", "session_id": "widget-1"}
+# {"content": "resume widget-1", "type": "command", "session_id": "widget-2"}